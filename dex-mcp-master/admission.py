@@ -0,0 +1,206 @@
+"""Admission control for requests to browser extensions.
+
+Requests beyond the in-flight limits (overall, per extension and per tab)
+wait in a queue instead of all reaching the extension at once, where one slow
+page would make every one of them time out together. Waiting requests are
+started in priority order, so clicks and typing overtake bulk reads like
+``grab_dom``; a request's priority improves the longer it waits, so bulk work
+still progresses under a steady stream of clicks. When the queue is full new
+requests are rejected straight away with a hint of when to retry.
+"""
+
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Hashable, Optional
+
+from metrics import Gauge
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+
+# Lower runs first; types not listed are NORMAL
+PRIORITIES = {
+    "click_element": INTERACTIVE,
+    "input_text": INTERACTIVE,
+    "send_keys": INTERACTIVE,
+    "select_tab": INTERACTIVE,
+    "add_assistant_message": INTERACTIVE,
+    "grab_dom": BULK,
+    "screenshot": BULK,
+    "capture_with_highlights": BULK,
+    "batch": BULK,
+    "paste_text": BULK,
+    "read_range": BULK,
+}
+
+
+class OverloadedError(Exception):
+    """The request queue is full; retry after ``retry_after`` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "since", "connection_id", "tab_key", "future")
+
+    def __init__(self, priority: int, seq: int, connection_id: str, tab_key: Optional[Hashable]):
+        self.priority = priority
+        self.seq = seq
+        self.since = time.monotonic()
+        self.connection_id = connection_id
+        self.tab_key = tab_key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionControl:
+    """In-flight limits and a bounded priority queue in front of the extensions."""
+
+    def __init__(
+        self,
+        max_in_flight: int = 128,
+        max_per_extension: int = 64,
+        max_per_tab: int = 4,
+        max_queued: int = 256,
+        aging: float = 5.0,
+    ):
+        """
+        Args:
+            max_in_flight: Requests awaiting an answer across all extensions.
+            max_per_extension: Requests awaiting an answer from one extension.
+            max_per_tab: Requests awaiting an answer about one tab; most
+                actions are also serialized per tab, so this mainly bounds waits.
+            max_queued: Requests admitted but not yet sent, including those
+                waiting for their tab; further requests are rejected.
+            aging: Seconds of waiting that raise a request by one priority level.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_per_extension = max_per_extension
+        self.max_per_tab = max_per_tab
+        self.max_queued = max_queued
+        self.aging = aging
+        self.queued = Gauge("dex_admission_queued", "Requests admitted but not yet sent to an extension")
+        self._queued = 0
+        self._in_flight = 0
+        self._per_extension: dict[str, int] = {}
+        self._per_tab: dict[Hashable, int] = {}
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+        # Moving average of how long a request holds its slot
+        self._service_seconds = 0.5
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def retry_after(self) -> float:
+        """Seconds until the current queue has probably drained."""
+        backlog = self._queued + self._in_flight
+        return round(min(30.0, max(0.1, self._service_seconds * backlog / self.max_in_flight)), 2)
+
+    def admit(self, message_type: str):
+        """Take a place in the queue or fail fast with ``OverloadedError``.
+
+        Every admitted request must call ``leave`` once it is done.
+        """
+        if self._queued >= self.max_queued:
+            retry_after = self.retry_after()
+            raise OverloadedError(
+                f"Too many browser requests queued ({self._queued}); retry {message_type} in {retry_after}s",
+                retry_after,
+            )
+        self._queued += 1
+        self.queued.set(self._queued)
+
+    def leave(self):
+        self._queued -= 1
+        self.queued.set(self._queued)
+
+    async def acquire(self, message_type: str, connection_id: str, tab_key: Optional[Hashable]) -> float:
+        """Wait for an in-flight slot for a request to ``connection_id`` about ``tab_key``.
+
+        Returns when the slot was granted; pass it to ``release`` once the
+        request is no longer in flight.
+        """
+        if not self._waiters and self._fits(connection_id, tab_key):
+            self._take(connection_id, tab_key)
+        else:
+            waiter = _Waiter(PRIORITIES.get(message_type, NORMAL), next(self._seq), connection_id, tab_key)
+            self._waiters.append(waiter)
+            self._grant()
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # Granted just as we were cancelled
+                    self._give_back(connection_id, tab_key)
+                raise
+
+        # In flight now; counted as queued again after ``release`` until
+        # ``leave``, e.g. while the request waits to be replayed
+        self._queued -= 1
+        self.queued.set(self._queued)
+        return time.monotonic()
+
+    def release(self, connection_id: str, tab_key: Optional[Hashable], started: float):
+        """Give back a slot taken by ``acquire`` at ``started``."""
+        self._service_seconds += 0.1 * (time.monotonic() - started - self._service_seconds)
+        self._queued += 1
+        self.queued.set(self._queued)
+        self._give_back(connection_id, tab_key)
+
+    @asynccontextmanager
+    async def slot(self, message_type: str, connection_id: str, tab_key: Optional[Hashable]) -> AsyncIterator[None]:
+        """Hold one in-flight slot for a request to ``connection_id`` about ``tab_key``."""
+        started = await self.acquire(message_type, connection_id, tab_key)
+        try:
+            yield
+        finally:
+            self.release(connection_id, tab_key, started)
+
+    def _fits(self, connection_id: str, tab_key: Optional[Hashable]) -> bool:
+        return (
+            self._in_flight < self.max_in_flight
+            and self._per_extension.get(connection_id, 0) < self.max_per_extension
+            and (tab_key is None or self._per_tab.get(tab_key, 0) < self.max_per_tab)
+        )
+
+    def _take(self, connection_id: str, tab_key: Optional[Hashable]):
+        self._in_flight += 1
+        self._per_extension[connection_id] = self._per_extension.get(connection_id, 0) + 1
+        if tab_key is not None:
+            self._per_tab[tab_key] = self._per_tab.get(tab_key, 0) + 1
+
+    def _give_back(self, connection_id: str, tab_key: Optional[Hashable]):
+        self._in_flight -= 1
+        self._per_extension[connection_id] -= 1
+        if not self._per_extension[connection_id]:
+            del self._per_extension[connection_id]
+        if tab_key is not None:
+            self._per_tab[tab_key] -= 1
+            if not self._per_tab[tab_key]:
+                del self._per_tab[tab_key]
+        self._grant()
+
+    def _grant(self):
+        """Start the most urgent waiters that fit within the limits."""
+        if not self._waiters:
+            return
+        now = time.monotonic()
+        # A waiter blocked by its own tab or extension does not hold up others
+        for waiter in sorted(self._waiters, key=lambda w: (w.priority - (now - w.since) / self.aging, w.seq)):
+            if self._in_flight >= self.max_in_flight:
+                break
+            if waiter.future.done():
+                # Cancelled; its task removes it once it runs again
+                continue
+            if self._fits(waiter.connection_id, waiter.tab_key):
+                self._waiters.remove(waiter)
+                self._take(waiter.connection_id, waiter.tab_key)
+                waiter.future.set_result(None)
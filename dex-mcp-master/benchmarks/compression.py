@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Compare permessage-deflate settings on grab_dom payloads.
+
+For every combination of window bits, memory level and compression level this
+reports the bytes that would go on the wire and the CPU time spent compressing
+and decompressing one message, mirroring what websockets does per message.
+
+Usage:
+    python benchmarks/compression.py captured_grab_dom.json [more.json ...]
+
+Each file should hold one raw extension response (the JSON text frame). Without
+arguments a synthetic page of repeated form rows is used instead.
+"""
+
+import argparse
+import json
+import sys
+import time
+import zlib
+
+WINDOW_BITS = (9, 12, 15)
+MEM_LEVELS = (1, 5, 8, 9)
+LEVELS = (1, 6, 9)
+
+
+def synthetic_payload(rows: int = 2000) -> bytes:
+    """Build a grab_dom-shaped response resembling a long spreadsheet page."""
+    lines = []
+    xpaths = {}
+    for i in range(1, rows + 1):
+        lines.append(f'[{i}]<input type="text" class="cell-input row-{i % 50}" aria-label="Row {i} Name" value="Contact {i}">')
+        xpaths[str(i)] = f"/html/body/div[2]/table/tbody/tr[{i}]/td[2]/input[1]"
+    response = {
+        "id": "benchmark",
+        "result": {
+            "success": True,
+            "data": {"processedOutput": "\n".join(lines), "highlightToXPath": xpaths},
+        },
+    }
+    return json.dumps(response).encode()
+
+
+def measure(payload: bytes, window_bits: int, mem_level: int, level: int, repeat: int) -> tuple[int, float, float]:
+    """Return (compressed bytes, compress ms, decompress ms) for one message."""
+    compressed = b""
+    start = time.process_time()
+    for _ in range(repeat):
+        encoder = zlib.compressobj(level, zlib.DEFLATED, -window_bits, mem_level)
+        compressed = encoder.compress(payload) + encoder.flush(zlib.Z_SYNC_FLUSH)
+    compress_ms = (time.process_time() - start) * 1000 / repeat
+
+    start = time.process_time()
+    for _ in range(repeat):
+        decoder = zlib.decompressobj(-window_bits)
+        decoder.decompress(compressed)
+    decompress_ms = (time.process_time() - start) * 1000 / repeat
+
+    # websockets strips the trailing 0x00 0x00 0xff 0xff of the sync flush
+    return len(compressed) - 4, compress_ms, decompress_ms
+
+
+def report(name: str, payload: bytes, repeat: int):
+    print(f"\n{name}: {len(payload):,} bytes uncompressed")
+    print(f"{'wbits':>5} {'mem':>4} {'level':>5} {'wire bytes':>12} {'ratio':>6} {'compress ms':>12} {'inflate ms':>11}")
+    for window_bits in WINDOW_BITS:
+        for mem_level in MEM_LEVELS:
+            for level in LEVELS:
+                size, compress_ms, decompress_ms = measure(payload, window_bits, mem_level, level, repeat)
+                print(
+                    f"{window_bits:>5} {mem_level:>4} {level:>5} {size:>12,} "
+                    f"{size / len(payload):>6.3f} {compress_ms:>12.2f} {decompress_ms:>11.2f}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("payloads", nargs="*", help="Captured grab_dom responses")
+    parser.add_argument("--repeat", type=int, default=5, help="Iterations per setting")
+    args = parser.parse_args()
+
+    if not args.payloads:
+        report("synthetic grab_dom", synthetic_payload(), args.repeat)
+        return
+
+    for path in args.payloads:
+        with open(path, "rb") as f:
+            report(path, f.read(), args.repeat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
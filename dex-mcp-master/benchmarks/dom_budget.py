@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Measure grab_dom pruning at several token budgets.
+
+For each page and budget this reports the estimated tokens before and after
+pruning, which passes were needed, how many nodes were dropped, collapsed or
+cut, how many interactive elements are still listed, and the time spent.
+
+Usage:
+    python benchmarks/dom_budget.py captured_grab_dom.json [more.json ...] [--budget 4000 ...]
+
+Each file should hold one raw extension response (the JSON text frame) or just
+its ``data`` object. Without arguments a synthetic page is used: a long
+spreadsheet with hidden and decorative chrome around it.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dom_budget import prune_dom  # noqa: E402
+
+BUDGETS = (1000, 4000, 8000, 16000)
+
+
+def synthetic_page(rows: int = 2000) -> dict:
+    """Build grab_dom data resembling a spreadsheet inside an app shell."""
+    lines = ['<div class="app-shell layout-root theme-light">']
+    xpaths = {}
+    lines.append('\t<nav class="sidebar" aria-hidden="true">')
+    for i in range(20):
+        lines.append(f'\t\t<a class="sidebar-link sidebar-link--muted">Menu {i}</a>')
+    lines.append("\t<svg>")
+    lines.append('\t\t<path d="M0 0L10 10">')
+    lines.append('\t<table class="grid-table grid-table--dense">')
+    index = 1
+    for row in range(rows):
+        lines.append('\t\t<tr class="grid-row grid-row--selectable">')
+        for column in ("Name", "Email"):
+            lines.append(
+                f'\t\t\t[{index}]<input type="text" class="cell-input cell-input--editable" '
+                f'aria-label="Row {row} {column}" value="{column} {row}">'
+            )
+            xpaths[str(index)] = f"/html/body/div[1]/table/tbody/tr[{row + 1}]/td[{len(xpaths) % 2 + 1}]/input[1]"
+            index += 1
+    lines.append(f'\t[{index}]<button class="btn btn-primary">Save</button>')
+    xpaths[str(index)] = "/html/body/div[1]/button[1]"
+    return {"processedOutput": "\n".join(lines), "highlightToXPath": xpaths}
+
+
+def load_page(path: str) -> dict:
+    with open(path, "rb") as f:
+        message = json.loads(f.read())
+    if "result" in message:
+        message = message["result"].get("data") or {}
+    return message
+
+
+def report(name: str, data: dict, budgets: list[int], repeat: int):
+    text = data.get("processedOutput") or ""
+    xpaths = data.get("highlightToXPath") or {}
+    print(f"\n{name}: {len(text):,} chars, {len(xpaths):,} interactive elements")
+    print(f"{'budget':>7} {'tokens':>14} {'dropped':>8} {'collapsed':>10} {'cut':>6} {'elements':>9} {'ms':>8}  passes")
+    for budget in budgets:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            pruned = prune_dom(text, xpaths, budget)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+        print(
+            f"{budget:>7} {pruned.original_tokens:>6,}->{pruned.tokens:<6,} {pruned.dropped:>8,} "
+            f"{pruned.collapsed:>10,} {pruned.truncated:>6,} {len(pruned.highlight_to_xpath):>9,} "
+            f"{elapsed_ms:>8.2f}  {', '.join(pruned.passes) or '-'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", help="Captured grab_dom responses")
+    parser.add_argument("--budget", type=int, action="append", help="Token budget (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5, help="Iterations per budget")
+    args = parser.parse_args()
+    budgets = args.budget or list(BUDGETS)
+
+    if not args.pages:
+        report("synthetic spreadsheet", synthetic_page(), budgets, args.repeat)
+        return
+
+    for path in args.pages:
+        report(path, load_page(path), budgets, args.repeat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
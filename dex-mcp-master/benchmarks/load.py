@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Load-test the extension bridge against a simulated extension.
+
+Starts the WebSocket bridge and a ``FakeExtension`` (on its own thread, so its
+work does not compete with the bridge's event loop), then for each number of
+concurrent callers runs tool calls through ``tools.browser`` and reports
+throughput and p50/p99 latency of the calls admitted, errors, calls rejected
+by admission control and peak resident memory.
+
+Usage:
+    python benchmarks/load.py [--callers 1 10 50 100 500] [--requests 2000]
+                              [--latency 0.02] [--recording session.jsonl]
+
+Calls name tabs round-robin (``--tabs``), so they spread over per-tab locks the
+way a multi-tab workflow would. ``screenshot`` always targets the active tab
+and is serialized.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context import Context  # noqa: E402
+from fake_extension import FakeExtension, load_recording  # noqa: E402
+from tools.browser import get_tabs_tool, grab_dom_tool, query_elements_tool, screenshot_tool  # noqa: E402
+from tools.results import OVERLOADED  # noqa: E402
+from ws_server import start_websocket_server  # noqa: E402
+
+ACTIONS = {
+    "get_tabs": lambda context, tab_id: get_tabs_tool(context),
+    "grab_dom": lambda context, tab_id: grab_dom_tool(context, {"tab_id": tab_id}),
+    "query_elements": lambda context, tab_id: query_elements_tool(context, {"tab_id": tab_id, "text": "Contact 1"}),
+    "screenshot": lambda context, tab_id: screenshot_tool(context),
+}
+
+
+def peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_level(context: Context, callers: int, requests: int, mix: list[str], tabs: int) -> dict:
+    """Run ``requests`` tool calls with ``callers`` concurrent workers."""
+    counter = iter(range(requests))
+    latencies: list[float] = []
+    errors = 0
+    rejected = 0
+
+    async def worker():
+        nonlocal errors, rejected
+        for n in counter:
+            action = ACTIONS[mix[n % len(mix)]]
+            start = time.perf_counter()
+            result = await action(context, n % tabs + 1)
+            if result.error_code == OVERLOADED:
+                # Turned away by admission control without reaching the extension
+                rejected += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if not result.success:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(callers)))
+    elapsed = time.perf_counter() - start
+    return {
+        "callers": callers,
+        "requests": len(latencies) + rejected,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else 0.0,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+        "errors": errors,
+        "rejected": rejected,
+        "rss_mib": peak_rss_mib(),
+    }
+
+
+async def benchmark(args) -> list[dict]:
+    context = Context(reconnect_grace=0)
+    server = await start_websocket_server(context, port=0)
+    port = server.sockets[0].getsockname()[1]
+
+    extension = FakeExtension(
+        url=f"ws://127.0.0.1:{port}",
+        recording=load_recording(args.recording) if args.recording else None,
+        latency=args.latency,
+        jitter=args.jitter,
+        tabs=args.tabs,
+        dom_rows=args.dom_rows,
+        screenshot_bytes=args.screenshot_bytes,
+    )
+    ready = threading.Event()
+
+    def run_extension():
+        async def main():
+            connected = asyncio.Event()
+            task = asyncio.create_task(extension.run(connected))
+            await connected.wait()
+            ready.set()
+            await task
+
+        asyncio.run(main())
+
+    threading.Thread(target=run_extension, daemon=True).start()
+    ready.wait(10)
+    while not context.has_ws():
+        await asyncio.sleep(0.01)
+
+    mix = args.mix.split(",")
+    results = []
+    try:
+        await run_level(context, 1, min(20, args.requests), mix, args.tabs)  # warm-up
+        for callers in args.callers:
+            results.append(await run_level(context, callers, max(args.requests, callers), mix, args.tabs))
+            row = results[-1]
+            print(
+                f"{row['callers']:>7} {row['requests']:>8} {row['seconds']:>8.2f} {row['throughput']:>9.1f} "
+                f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['errors']:>6} {row['rejected']:>8} {row['rss_mib']:>8.1f}"
+            )
+    finally:
+        await context.close()
+        server.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callers", type=int, nargs="+", default=[1, 10, 50, 100, 500], help="Concurrency levels")
+    parser.add_argument("--requests", type=int, default=2000, help="Tool calls per level")
+    parser.add_argument("--mix", default="get_tabs,grab_dom,query_elements", help=f"Comma-separated: {', '.join(ACTIONS)}")
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated extension latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Extra random latency in seconds")
+    parser.add_argument("--tabs", type=int, default=50, help="Tabs the calls are spread over")
+    parser.add_argument("--dom-rows", type=int, default=200, help="Rows in the synthesized DOM")
+    parser.add_argument("--screenshot-bytes", type=int, default=200_000, help="Size of the synthesized screenshot")
+    parser.add_argument("--recording", help="Replay responses from a main.py --record file")
+    args = parser.parse_args()
+
+    unknown = set(args.mix.split(",")) - set(ACTIONS)
+    if unknown:
+        parser.error(f"unknown actions in --mix: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.WARNING)
+    print(f"{'callers':>7} {'requests':>8} {'seconds':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6} {'rejected':>8} {'rss MiB':>8}")
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Serialization codecs for messages exchanged with the browser extension.
+
+The extension offers the codecs it can speak in its hello message and the
+server picks the first one it has installed. ``orjson`` and ``msgpack`` are
+optional; stdlib ``json`` is always available as the fallback.
+
+Every codec decodes text frames as JSON, so control messages such as
+``hello`` work before a codec has been negotiated.
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+
+class JsonCodec:
+    """Stdlib JSON sent as text frames."""
+
+    name = "json"
+
+    def encode(self, message: dict) -> str:
+        return json.dumps(message)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """orjson sent as binary frames, skipping the ``str`` intermediate."""
+
+    name = "orjson"
+
+    def encode(self, message: dict) -> bytes:
+        return orjson.dumps(message)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    """MessagePack sent as binary frames. Raw bytes round-trip natively."""
+
+    name = "msgpack"
+
+    def encode(self, message: dict) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            return json.loads(data)
+        return msgpack.unpackb(data, raw=False)
+
+
+DEFAULT_CODEC = JsonCodec()
+
+
+def available_codecs() -> dict[str, Any]:
+    """Codecs usable in this process, keyed by negotiated name."""
+    codecs = {"json": DEFAULT_CODEC}
+    if orjson is not None:
+        codecs["orjson"] = OrjsonCodec()
+    if msgpack is not None:
+        codecs["msgpack"] = MsgpackCodec()
+    return codecs
+
+
+def negotiate_codec(offered: list[str]) -> Any:
+    """Pick the first codec in the extension's preference list that we support."""
+    codecs = available_codecs()
+    for name in offered or []:
+        if name in codecs:
+            return codecs[name]
+    return DEFAULT_CODEC
@@ -0,0 +1,167 @@
+"""Registry of connected browser extensions and request routing."""
+
+import asyncio
+import time
+import uuid
+from typing import Hashable, Iterator, Optional
+
+from websockets.server import WebSocketServerProtocol
+
+from codec import DEFAULT_CODEC
+
+# Consecutive timeouts after which a connection stops receiving new work
+# until it answers a request again.
+MAX_CONSECUTIVE_FAILURES = 3
+
+
+class ExtensionConnection:
+    """A connected browser extension and its routing state."""
+
+    def __init__(self, ws: WebSocketServerProtocol):
+        self.id = uuid.uuid4().hex[:8]
+        self.ws = ws
+        self.capabilities: set[str] = set()
+        self.codec = DEFAULT_CODEC
+        self.in_flight = 0
+        self.failures = 0
+        self.connected_at = time.monotonic()
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the connection should be offered new requests."""
+        return self.failures < MAX_CONSECUTIVE_FAILURES
+
+    def supports(self, capability: str) -> bool:
+        """Check whether the extension advertised a capability on connect."""
+        return capability in self.capabilities
+
+    def describe(self) -> dict:
+        """Summarize the connection for logging and diagnostics."""
+        return {
+            "id": self.id,
+            "capabilities": sorted(self.capabilities),
+            "codec": self.codec.name,
+            "in_flight": self.in_flight,
+            "healthy": self.healthy,
+        }
+
+
+class ConnectionPool:
+    """Track every connected extension and pick one for each request.
+
+    Requests for a tab stay on the extension that owns the tab. Everything
+    else goes to the least-loaded healthy extension, preferring the newest
+    connection on ties so a single reconnecting extension behaves as before.
+    """
+
+    def __init__(self):
+        self._connections: dict[str, ExtensionConnection] = {}
+        self._tab_owners: dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def __iter__(self) -> Iterator[ExtensionConnection]:
+        return iter(list(self._connections.values()))
+
+    def add(self, ws: WebSocketServerProtocol) -> ExtensionConnection:
+        """Register a new extension connection."""
+        existing = self.find(ws)
+        if existing:
+            return existing
+        connection = ExtensionConnection(ws)
+        self._connections[connection.id] = connection
+        return connection
+
+    def remove(self, ws: WebSocketServerProtocol) -> Optional[ExtensionConnection]:
+        """Forget a connection and every tab routed to it."""
+        connection = self.find(ws)
+        if not connection:
+            return None
+        del self._connections[connection.id]
+        self._tab_owners = {
+            tab_id: owner for tab_id, owner in self._tab_owners.items() if owner != connection.id
+        }
+        return connection
+
+    def get(self, connection_id: str) -> Optional[ExtensionConnection]:
+        return self._connections.get(connection_id)
+
+    def find(self, ws: WebSocketServerProtocol) -> Optional[ExtensionConnection]:
+        """Look up the connection wrapping a WebSocket."""
+        for connection in self._connections.values():
+            if connection.ws is ws:
+                return connection
+        return None
+
+    def pin_tab(self, tab_id: int, connection: ExtensionConnection):
+        """Route future requests for ``tab_id`` to ``connection``."""
+        self._tab_owners[tab_id] = connection.id
+
+    def unpin_tab(self, tab_id: int):
+        self._tab_owners.pop(tab_id, None)
+
+    def owner_of(self, tab_id: int) -> Optional[ExtensionConnection]:
+        owner = self._tab_owners.get(tab_id)
+        return self._connections.get(owner) if owner else None
+
+    def select(self, tab_id: Optional[int] = None, connection_id: Optional[str] = None) -> Optional[ExtensionConnection]:
+        """Pick the connection that should handle a request.
+
+        Args:
+            tab_id: Tab targeted by the request, if any. Tabs belong to one
+                browser, so a known owner always wins.
+            connection_id: Explicit session pin. Takes precedence over routing.
+        """
+        if connection_id is not None:
+            return self._connections.get(connection_id)
+
+        if tab_id is not None:
+            owner = self.owner_of(tab_id)
+            if owner:
+                return owner
+
+        candidates = [c for c in self._connections.values() if c.healthy]
+        if not candidates:
+            candidates = list(self._connections.values())
+        if not candidates:
+            return None
+
+        return min(candidates, key=lambda c: (c.in_flight, -c.connected_at))
+
+
+class TabLocks:
+    """One FIFO lock per tab so actions on a tab run one at a time, in order.
+
+    Locks are created on first use and dropped once nobody holds or waits for
+    them. Actions on different tabs never contend.
+    """
+
+    def __init__(self):
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._users: dict[Hashable, int] = {}
+
+    async def acquire(self, key: Hashable):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._leave(key)
+            raise
+
+    def release(self, key: Hashable):
+        self._locks[key].release()
+        self._leave(key)
+
+    def _leave(self, key: Hashable):
+        self._users[key] -= 1
+        if not self._users[key]:
+            del self._users[key]
+            del self._locks[key]
+
+    def busy(self) -> dict[Hashable, int]:
+        """Actions running or queued per tab."""
+        return dict(self._users)
@@ -1,78 +1,986 @@
 import asyncio
-import json
+import logging
+import time
 import uuid
+from collections import OrderedDict
 from typing import Any, Optional
 import websockets
 from websockets.server import WebSocketServerProtocol
 
+from admission import AdmissionControl, OverloadedError
+from connections import ConnectionPool, ExtensionConnection, TabLocks
+from debug_logs import DebugLogSink
+from dom_cache import DomCache
+from imaging import ImagePipeline
+from macros import MacroStore
+from metrics import BridgeMetrics
+from result_cache import IdempotencyStore, ResultCache, current_scope
+from tab_index import TabIndex
+from timeouts import AdaptiveTimeouts
+
+logger = logging.getLogger(__name__)
+
+# Message types whose image payload can be delivered as a raw binary frame
+# when the extension advertises the "binary_frames" capability.
+BINARY_MESSAGE_TYPES = {"screenshot", "capture_with_highlights"}
+
+# Actions that only read browser state
+READ_ONLY_MESSAGE_TYPES = {
+    "get_tabs",
+    "grab_dom",
+    "query_elements",
+    "screenshot",
+    "capture_with_highlights",
+    "read_range",
+}
+
+# Actions that leave the browser in the same state when repeated, so they are
+# safe to replay on a new connection if the old one dropped mid-request
+IDEMPOTENT_MESSAGE_TYPES = READ_ONLY_MESSAGE_TYPES | {"navigate", "select_tab", "select_range"}
+
+# Read-only actions about one tab, whose results are cached while the tab's
+# URL and DOM version stay the same
+CACHEABLE_MESSAGE_TYPES = READ_ONLY_MESSAGE_TYPES - {"get_tabs"}
+
+# Actions that may be grouped into a single ``batch`` message
+BATCHABLE_MESSAGE_TYPES = {
+    "navigate",
+    "click_element",
+    "input_text",
+    "send_keys",
+    "grab_dom",
+    "query_elements",
+    "select_range",
+    "paste_text",
+    "read_range",
+}
+
+# Actions that do not touch a particular tab, or only observe it, and so
+# skip the per-tab lock. Waits in particular must not block the action they
+# are waiting on.
+UNLOCKED_MESSAGE_TYPES = {
+    "get_tabs",
+    "new_tab",
+    "add_assistant_message",
+    "wait_for_selector",
+    "wait_for_navigation",
+    "wait_for_network_idle",
+    "wait_for_text",
+}
+
+# Lock key for actions without a tab_id, which the extension runs on
+# whichever tab is active
+ACTIVE_TAB = "active"
+
+# Parts of a streamed reply the extension may send before the consumer
+# acknowledges them with ``stream_ack``; bounds memory per stream without ever
+# holding up the socket reader
+STREAM_WINDOW = 16
+
+# Unread parts at which an extension that ignores the window is cut off
+STREAM_MAX_UNREAD = 8 * STREAM_WINDOW
+
+# How many timed-out or cancelled request ids to remember so their late
+# responses can be dropped without a lookup miss being logged as unknown
+MAX_ABANDONED_REQUESTS = 1024
+
+NO_CONNECTION_MESSAGE = "No connection to browser extension. Please connect your browser extension first."
+
+
+class ExtensionError(Exception):
+    """The browser extension reported an error or could not be reached."""
+
+
+class NoConnectionError(ExtensionError):
+    """No browser extension is connected."""
+
+
+class ExtensionTimeoutError(ExtensionError):
+    """The browser extension did not answer in time."""
+
+
+class ConnectionLostError(ExtensionError):
+    """The extension disconnected before answering; the action may or may not have run."""
+
+
+class ExtensionReportedError(ExtensionError):
+    """The browser extension answered with an ``error`` instead of a result."""
+
+
+class PendingRequest:
+    """A request sent to an extension that is waiting for its response."""
+
+    def __init__(
+        self,
+        message_type: str,
+        payload: dict,
+        future: asyncio.Future,
+        connection: ExtensionConnection,
+        chunks: Optional[asyncio.Queue] = None,
+    ):
+        self.message_type = message_type
+        self.payload = payload
+        self.future = future
+        self.connection = connection
+        # Parts of a streamed reply, in arrival order; the final message
+        # still resolves ``future``
+        self.chunks = chunks
+        self.sent_at: Optional[float] = None
+
 
 class Context:
-    def __init__(self):
-        self._ws: Optional[WebSocketServerProtocol] = None
-        self._pending_requests: dict[str, asyncio.Future] = {}
+    def __init__(
+        self,
+        timeouts: Optional[AdaptiveTimeouts] = None,
+        images: Optional[ImagePipeline] = None,
+        reconnect_grace: float = 10.0,
+        max_queued_requests: int = 100,
+        max_replays: int = 2,
+        debug_logs: Optional[DebugLogSink] = None,
+        macros: Optional[MacroStore] = None,
+        results: Optional[ResultCache] = None,
+        idempotency: Optional[IdempotencyStore] = None,
+        admission: Optional[AdmissionControl] = None,
+    ):
+        """
+        Args:
+            timeouts: Per-action timeout policy.
+            images: Screenshot post-processing pipeline and its defaults.
+            debug_logs: Sampling, rate limits and buffer size for extension
+                ``debug_log`` messages.
+            macros: Recorded macros and where they are saved.
+            results: Cache of read-only results, keyed by tab, URL and DOM version.
+            idempotency: Results of messages sent under idempotency keys.
+            admission: In-flight limits and queue bound for extension requests.
+            reconnect_grace: Seconds a request waits for an extension to
+                (re)connect before failing with ``NoConnectionError``.
+            max_queued_requests: Requests allowed to wait for a connection at
+                once; further requests fail immediately.
+            max_replays: Times an idempotent request is resent after its
+                connection drops mid-request.
+        """
+        self.connections = ConnectionPool()
+        self.dom_cache = DomCache()
+        self.tab_locks = TabLocks()
+        self.tabs = TabIndex()
+        self.metrics = BridgeMetrics()
+        self.timeouts = timeouts or AdaptiveTimeouts()
+        self.images = images or ImagePipeline()
+        self.debug_logs = debug_logs or DebugLogSink()
+        # Optional ``record(message_type, payload, result)`` hook called with
+        # every successful response, e.g. ``fake_extension.ResponseRecorder``
+        self.recorder = None
+        self.metrics.register(self.debug_logs.logged)
+        self.macros = macros or MacroStore()
+        self.results = results or ResultCache()
+        self.idempotency = idempotency or IdempotencyStore()
+        self.metrics.register(self.results.lookups)
+        self.metrics.register(self.idempotency.lookups)
+        self.admission = admission or AdmissionControl()
+        self.metrics.register(self.admission.queued)
+        self.reconnect_grace = reconnect_grace
+        self.max_queued_requests = max_queued_requests
+        self.max_replays = max_replays
+        self._pending_requests: dict[str, PendingRequest] = {}
+        self._connected = asyncio.Event()
+        self._waiting_for_connection = 0
+        # Ids of requests we gave up on, oldest first
+        self._abandoned_requests: OrderedDict[str, None] = OrderedDict()
+        # Keeps fire-and-forget cancel sends alive until they finish
+        self._background_tasks: set[asyncio.Task] = set()
+        self._disconnects = 0
+        # Event loop that owns the WebSocket. Requests issued from any other
+        # loop (e.g. an MCP server running on its own thread) are dispatched
+        # onto this loop so futures and socket writes never cross loops.
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
 
     @property
     def ws(self) -> WebSocketServerProtocol:
-        if not self._ws:
-            raise Exception("No connection to browser extension. Please connect your browser extension first.")
-        return self._ws
-
-    def set_ws(self, ws: WebSocketServerProtocol):
-        """Set the active WebSocket connection."""
-        # Replace the active WebSocket without explicitly closing the old one.
-        # Closing it here causes the browser extension to immediately reconnect,
-        # resulting in a connection-churn loop. Let the client decide when to
-        # disconnect instead.
-        self._ws = ws
+        """WebSocket of the extension that would receive an untargeted request."""
+        connection = self.connections.select()
+        if not connection:
+            raise NoConnectionError(NO_CONNECTION_MESSAGE)
+        return connection.ws
+
+    def bind_loop(self):
+        """Make the running loop the owner of all extension I/O.
+
+        Called when the WebSocket server starts so requests made from other
+        loops are dispatched here even before the first extension connects.
+        """
+        self._loop = asyncio.get_running_loop()
+
+    def set_ws(self, ws: WebSocketServerProtocol) -> ExtensionConnection:
+        """Register a newly connected browser extension."""
+        # Earlier connections are kept rather than closed. Closing them causes
+        # the browser extension to immediately reconnect, resulting in a
+        # connection-churn loop. Let the client decide when to disconnect.
+        self._loop = asyncio.get_running_loop()
+        connection = self.connections.add(ws)
+        self.metrics.connections.set(len(self.connections))
+        if self._disconnects:
+            self.metrics.reconnects.inc()
+        self._connected.set()
+        return connection
+
+    def remove_ws(self, ws: WebSocketServerProtocol):
+        """Forget a browser extension whose WebSocket has closed.
+
+        Requests still waiting on that connection fail with
+        ``ConnectionLostError``; idempotent ones are replayed by their sender
+        once another extension is available.
+        """
+        connection = self.connections.remove(ws)
+        if connection:
+            self._disconnects += 1
+            self.tabs.forget(connection.id)
+            for pending in self._pending_requests.values():
+                if pending.connection is connection and not pending.future.done():
+                    pending.future.set_exception(
+                        ConnectionLostError(
+                            f"Browser extension disconnected before answering {pending.message_type}; "
+                            "the action may or may not have run"
+                        )
+                    )
+        self.metrics.connections.set(len(self.connections))
+        if not self.connections:
+            self._connected.clear()
+
+    def set_capabilities(self, ws: WebSocketServerProtocol, capabilities: list[str]):
+        """Record the capabilities an extension advertised in its hello message."""
+        connection = self.connections.find(ws)
+        if connection:
+            connection.capabilities = set(capabilities or [])
+
+    def tabs_synced(self) -> bool:
+        """Whether the tab index is kept current for every connected extension."""
+        connections = list(self.connections)
+        return bool(connections) and all(
+            connection.supports("tab_events") and self.tabs.is_synced(connection.id)
+            for connection in connections
+        )
+
+    def apply_tab_event(self, ws: WebSocketServerProtocol, payload: dict):
+        """Update the tab index and tab routing from a pushed ``tab_event``."""
+        connection = self.connections.find(ws)
+        if not connection:
+            return
+
+        event = payload.get("event")
+        tab_id = self.tabs.apply(connection.id, event, payload)
+        if event == "snapshot":
+            for tab in self.tabs.list():
+                if self.tabs.owner_of(tab["id"]) == connection.id:
+                    self.connections.pin_tab(tab["id"], connection)
+        elif event == "removed":
+            self.connections.unpin_tab(tab_id)
+            self.dom_cache.invalidate(tab_id)
+        else:
+            self.connections.pin_tab(tab_id, connection)
+            if event == "updated" and "url" in (payload.get("tab") or {}):
+                self.dom_cache.invalidate(tab_id)
+
+    def supports(self, capability: str, tab_id: Optional[int] = None) -> bool:
+        """Check whether the extension that would handle ``tab_id`` has a capability."""
+        connection = self.connections.select(tab_id)
+        return bool(connection and connection.supports(capability))
 
     def has_ws(self) -> bool:
         """Check if we have an active WebSocket connection."""
-        return self._ws is not None
+        return len(self.connections) > 0
+
+    async def send_socket_message(
+        self,
+        message_type: str,
+        payload: dict = None,
+        timeout: Optional[float] = None,
+        connection_id: Optional[str] = None,
+    ) -> Any:
+        """Send a message to the browser extension and wait for response.
+
+        Without an explicit ``timeout`` the per-action adaptive timeout
+        applies. If the request times out or the caller is cancelled, the
+        extension is sent a ``cancel`` message for it.
+
+        The request goes to the extension that owns ``payload["tab_id"]`` when
+        that tab is known, to ``connection_id`` when the caller pins a session,
+        and otherwise to the least-loaded healthy extension.
+
+        Safe to call from any event loop. When the caller is not running on the
+        loop that owns the WebSocket, the request is handed to that loop with
+        ``run_coroutine_threadsafe`` and the result is awaited from the caller's
+        loop, so cancellation still propagates in both directions.
+
+        Inside ``result_cache.idempotency_key(key)`` the message is sent at
+        most once per key: a retry gets the first attempt's answer.
+        """
+        scope = current_scope.get()
+        message_key = scope.message_key(message_type, payload) if scope else None
+        send = self._send_socket_message(message_type, payload, timeout, connection_id, time.perf_counter(), message_key)
+        owner = self._loop
+        if owner is not None and owner is not asyncio.get_running_loop():
+            if owner.is_closed():
+                send.close()
+                raise NoConnectionError(NO_CONNECTION_MESSAGE)
+            concurrent_future = asyncio.run_coroutine_threadsafe(send, owner)
+            return await asyncio.wrap_future(concurrent_future)
+        return await send
+
+    async def _send_socket_message(
+        self,
+        message_type: str,
+        payload: dict = None,
+        timeout: Optional[float] = None,
+        connection_id: Optional[str] = None,
+        queued_at: Optional[float] = None,
+        message_key: Optional[tuple] = None,
+    ) -> Any:
+        """Send a message on the owning loop and wait for the matching response.
+
+        Waits up to ``reconnect_grace`` for an extension when none is
+        connected, and replays idempotent requests whose connection dropped.
+        Actions on the same tab wait for each other and run in call order;
+        time spent waiting counts towards the queue phase, not the timeout.
+        Read-only results are served from ``results`` while the tab's DOM
+        version is unchanged, and other actions drop their tab's results.
+
+        Under an idempotency key, the result or the error the extension
+        answered with is stored and returned to retries of the same message.
+
+        Requests beyond the ``admission`` in-flight limits wait for a slot,
+        most urgent first, and fail with ``OverloadedError`` when too many are
+        already waiting.
+        """
+        if message_key is not None:
+            return await self.idempotency.run(
+                message_key,
+                lambda: self._send_socket_message(message_type, payload, timeout, connection_id, queued_at),
+                answers=(ExtensionReportedError,),
+            )
+
+        queued_at = queued_at or time.perf_counter()
+        payload = payload or {}
+        if timeout is None:
+            timeout = self.timeouts.timeout_for(message_type)
 
-    async def send_socket_message(self, message_type: str, payload: dict = None, timeout: float = 30.0) -> Any:
-        """Send a message to the browser extension and wait for response."""
-        if not self.has_ws():
-            raise Exception("No connection to browser extension. Please connect your browser extension first.")
-        
-        message_id = str(uuid.uuid4())
-        message = {
-            "id": message_id,
-            "type": message_type,
-            "payload": payload or {}
-        }
-        
-        # Create future for response
-        future = asyncio.Future()
-        self._pending_requests[message_id] = future
-        
         try:
-            # Send message
-            await self.ws.send(json.dumps(message))
+            self.admission.admit(message_type)
+        except OverloadedError:
+            self.metrics.requests.inc(type=message_type, outcome="overloaded")
+            raise
+
+        lock_key = self.tab_lock_key(message_type, payload)
+        if lock_key is not None:
+            try:
+                await self.tab_locks.acquire(lock_key)
+            except BaseException:
+                self.admission.leave()
+                raise
+        try:
+            # Looked up under the tab lock so earlier actions on the tab have
+            # already invalidated what they changed
+            cache_tab, cache_key = self._result_cache_key(message_type, payload, connection_id)
+            if cache_key is not None:
+                cached = self.results.get(cache_key)
+                if cached is not None:
+                    return cached
+
+            replays = 0
+            while True:
+                connection = await self._acquire_connection(message_type, payload.get("tab_id"), connection_id)
+                tab_key = lock_key if lock_key is not None else payload.get("tab_id")
+                try:
+                    async with self.admission.slot(message_type, connection.id, tab_key):
+                        result = await self._request(connection, message_type, payload, timeout, queued_at)
+                    break
+                except ConnectionLostError:
+                    if message_type not in IDEMPOTENT_MESSAGE_TYPES or replays >= self.max_replays:
+                        raise
+                    replays += 1
+                    self.metrics.replays.inc(type=message_type)
+                    logger.info(f"Replaying {message_type} after the browser extension disconnected")
+                    queued_at = time.perf_counter()
+            if cache_key is not None and isinstance(result, dict) and result.get("success"):
+                self.results.put(cache_key, cache_tab, result)
+            return result
+        finally:
+            if message_type not in READ_ONLY_MESSAGE_TYPES:
+                self.results.invalidate(payload.get("tab_id"))
+            if lock_key is not None:
+                self.tab_locks.release(lock_key)
+            self.admission.leave()
+
+    def _result_cache_key(
+        self, message_type: str, payload: dict, connection_id: Optional[str]
+    ) -> tuple[Optional[int], Optional[tuple]]:
+        """The tab a read-only request is about and its result cache key.
+
+        Both are ``None`` unless the tab's owner pushes tab events, so its URL
+        and DOM version in the tab index are current.
+        """
+        if message_type not in CACHEABLE_MESSAGE_TYPES:
+            return None, None
+        tab_id = payload.get("tab_id")
+        if tab_id is None:
+            connection = self.connections.select(None, connection_id)
+            tab_id = self.tabs.active_tab(connection.id) if connection else None
+        tab = self.tabs.get(tab_id) if tab_id is not None else None
+        owner = self.tabs.owner_of(tab_id) if tab else None
+        connection = self.connections.get(owner) if owner else None
+        if not connection or not connection.supports("tab_events") or not self.tabs.is_synced(owner):
+            return None, None
+        key = self.results.key(message_type, payload, tab)
+        return (tab_id, key) if key is not None else (None, None)
+
+    @staticmethod
+    def tab_lock_key(message_type: str, payload: dict) -> Optional[Any]:
+        """Tab an action must hold the lock for, or ``None`` if it needs none.
+
+        Actions without a ``tab_id`` share the ``ACTIVE_TAB`` lock. The server
+        does not know which tab is active, so they are not serialized against
+        actions that name that tab explicitly.
+        """
+        if message_type in UNLOCKED_MESSAGE_TYPES:
+            return None
+        tab_id = payload.get("tab_id")
+        return tab_id if tab_id is not None else ACTIVE_TAB
+
+    async def _acquire_connection(
+        self, message_type: str, tab_id: Optional[int], connection_id: Optional[str]
+    ) -> ExtensionConnection:
+        """Pick a connection, waiting out a short extension restart if needed."""
+        connection = self.connections.select(tab_id, connection_id)
+        if connection:
+            return connection
+
+        if connection_id is None and self.reconnect_grace > 0:
+            if self._waiting_for_connection >= self.max_queued_requests:
+                self.metrics.requests.inc(type=message_type, outcome="queue_full")
+                raise NoConnectionError(
+                    f"{NO_CONNECTION_MESSAGE} ({self._waiting_for_connection} requests already waiting)"
+                )
+
+            deadline = time.monotonic() + self.reconnect_grace
+            self._waiting_for_connection += 1
+            try:
+                while not connection:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self._connected.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    connection = self.connections.select(tab_id)
+            finally:
+                self._waiting_for_connection -= 1
+
+        if not connection:
+            self.metrics.requests.inc(type=message_type, outcome="no_connection")
+            raise NoConnectionError(NO_CONNECTION_MESSAGE)
+        return connection
+
+    async def _request(
+        self,
+        connection: ExtensionConnection,
+        message_type: str,
+        payload: dict,
+        timeout: float,
+        queued_at: float,
+    ) -> Any:
+        """Send one request on ``connection`` and wait for its response."""
+        metrics = self.metrics
+        message_id, pending = self._register(connection, message_type, payload)
+        outcome = "error"
+        try:
+            await self._send(message_id, pending, queued_at)
             
             # Wait for response with timeout
-            response = await asyncio.wait_for(future, timeout=timeout)
+            response = await asyncio.wait_for(pending.future, timeout=timeout)
+            connection.failures = 0
+            self.timeouts.observe(message_type, time.perf_counter() - pending.sent_at)
             
             if "error" in response:
-                raise Exception(f"Browser extension error: {response['error']}")
+                raise ExtensionReportedError(f"Browser extension error: {response['error']}")
             
-            return response.get("result")
+            result = response.get("result")
+            self._learn_tab_routes(connection, message_type, pending.payload, result)
+            if self.recorder is not None:
+                self.recorder.record(message_type, pending.payload, result)
+            outcome = "ok"
+            return result
             
         except asyncio.TimeoutError:
-            raise Exception(f"Timeout waiting for response from browser extension")
+            self._count_timeout(connection, message_type, timeout)
+            outcome = "timeout"
+            metrics.timeouts.inc(type=message_type)
+            self._abandon(message_id, pending, "timeout")
+            raise ExtensionTimeoutError(
+                f"Timeout waiting for response from browser extension ({message_type}, {timeout:.1f}s)"
+            )
+        except ConnectionLostError:
+            outcome = "connection_lost"
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            self._abandon(message_id, pending, "cancelled")
+            raise
         finally:
-            # Clean up pending request
-            self._pending_requests.pop(message_id, None)
+            self._unregister(message_id, pending, outcome)
+
+    def _count_timeout(self, connection: ExtensionConnection, message_type: str, timeout: float):
+        """Feed a timeout back into the adaptive timeout and connection health.
 
-    def handle_response(self, message: dict):
-        """Handle incoming response from browser extension."""
+        Only a timeout at least as long as the action's default counts as a
+        failure of the extension; missing a deadline that was adapted down
+        from recent fast responses says more about the page than the extension.
+        """
+        self.timeouts.observe_timeout(message_type, timeout)
+        if timeout >= self.timeouts.default_for(message_type):
+            connection.failures += 1
+
+    def _register(
+        self,
+        connection: ExtensionConnection,
+        message_type: str,
+        payload: dict,
+        chunks: Optional[asyncio.Queue] = None,
+    ) -> tuple[str, PendingRequest]:
+        """Create the pending entry for a request about to be sent on ``connection``."""
+        if message_type in BINARY_MESSAGE_TYPES and connection.supports("binary_frames"):
+            payload = {**payload, "binary": True}
+        
+        message_id = str(uuid.uuid4())
+        # Create future for response on the loop that will resolve it
+        future = asyncio.get_running_loop().create_future()
+        pending = PendingRequest(message_type, payload, future, connection, chunks)
+        self._pending_requests[message_id] = pending
+        
+        connection.in_flight += 1
+        self.metrics.in_flight.inc()
+        return message_id, pending
+
+    async def _send(self, message_id: str, pending: PendingRequest, queued_at: float):
+        """Encode and write a registered request, recording queue and send time."""
+        metrics = self.metrics
+        connection = pending.connection
+        message = {
+            "id": message_id,
+            "type": pending.message_type,
+            "payload": pending.payload
+        }
+        frame = connection.codec.encode(message)
+        send_started = time.perf_counter()
+        metrics.phase_seconds.observe(send_started - queued_at, type=pending.message_type, phase="queue")
+        try:
+            await connection.ws.send(frame)
+        except websockets.exceptions.ConnectionClosed as e:
+            raise ConnectionLostError(f"Browser extension disconnected while sending {pending.message_type}: {e}")
+        pending.sent_at = time.perf_counter()
+        metrics.phase_seconds.observe(pending.sent_at - send_started, type=pending.message_type, phase="send")
+        metrics.payload_bytes.inc(len(frame), direction="out")
+
+    def _unregister(self, message_id: str, pending: PendingRequest, outcome: str):
+        """Clean up a finished request and count its outcome."""
+        pending.connection.in_flight -= 1
+        self.metrics.in_flight.dec()
+        self.metrics.requests.inc(type=pending.message_type, outcome=outcome)
+        self._pending_requests.pop(message_id, None)
+
+    def stream_socket_message(
+        self,
+        message_type: str,
+        payload: dict = None,
+        timeout: Optional[float] = None,
+        connection_id: Optional[str] = None,
+    ) -> "ResponseStream":
+        """Send a request whose reply arrives in parts and iterate over them.
+
+        The request is sent with ``stream: true`` and ``window``. The extension
+        answers with any number of ``{"id": ..., "chunk": {...}}`` messages
+        followed by a normal final response, sending at most ``window`` parts
+        beyond those acknowledged by ``stream_ack`` messages as they are read.
+        ``timeout`` bounds the wait for each part, not the whole reply.
+        Streamed requests are not replayed on reconnect since parts may
+        already have been consumed.
+
+        Use as ``async with context.stream_socket_message(...) as stream:``
+        and ``async for chunk in stream``; ``stream.result`` holds the final
+        result once iteration ends.
+        """
+        return ResponseStream(self, message_type, payload or {}, timeout, connection_id)
+
+    def _abandon(self, message_id: str, pending: PendingRequest, reason: str):
+        """Stop waiting for a request and tell the extension to stop working on it."""
+        self._abandoned_requests[message_id] = None
+        while len(self._abandoned_requests) > MAX_ABANDONED_REQUESTS:
+            self._abandoned_requests.popitem(last=False)
+
+        if pending.sent_at is None:
+            return
+
+        self.metrics.cancellations.inc(type=pending.message_type, reason=reason)
+        self._post_control(pending.connection, "cancel", {"id": message_id, "reason": reason})
+
+    def _post_control(self, connection: ExtensionConnection, message_type: str, payload: dict):
+        """Send a message that expects no reply without making the caller wait for the socket."""
+        task = asyncio.get_running_loop().create_task(self._send_control(connection, message_type, payload))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _send_control(self, connection: ExtensionConnection, message_type: str, payload: dict):
+        message = {
+            "id": str(uuid.uuid4()),
+            "type": message_type,
+            "payload": payload,
+        }
+        try:
+            await connection.ws.send(connection.codec.encode(message))
+        except Exception as e:
+            logger.debug(f"Could not send {message_type} for {payload.get('id')}: {e}")
+
+    def is_abandoned(self, message_id: Optional[str]) -> bool:
+        """Whether a response id belongs to a request that timed out or was cancelled."""
+        return message_id in self._abandoned_requests
+
+    async def send_batch(
+        self, actions: list[dict], stop_on_error: bool = True, timeout: Optional[float] = None
+    ) -> list[dict]:
+        """Run an ordered list of actions and return one result per step.
+
+        Each action is ``{"type": ..., "payload": {...}}``. Extensions that
+        advertise the ``batch`` capability receive the whole list as a single
+        message; otherwise the steps are sent one after another from here.
+        ``timeout`` applies per step and defaults to each action's adaptive
+        timeout.
+
+        Returns a list of ``{"index", "type", "success", "result" | "error"}``
+        entries. With ``stop_on_error`` the list ends at the first failure.
+        """
+        for action in actions:
+            if action.get("type") not in BATCHABLE_MESSAGE_TYPES:
+                raise ValueError(f"Action type '{action.get('type')}' cannot be batched")
+
+        tab_ids = {(action.get("payload") or {}).get("tab_id") for action in actions}
+        tab_id = tab_ids.pop() if len(tab_ids) == 1 else None
+
+        if self.supports("batch", tab_id):
+            payload = {
+                "actions": [{"type": a["type"], "payload": a.get("payload") or {}} for a in actions],
+                "stop_on_error": stop_on_error,
+            }
+            if tab_id is not None:
+                payload["tab_id"] = tab_id
+            if timeout is None:
+                batch_timeout = sum(self.timeouts.timeout_for(a["type"]) for a in actions)
+            else:
+                batch_timeout = timeout * len(actions)
+            result = await self.send_socket_message("batch", payload, timeout=batch_timeout)
+            return (result or {}).get("results", [])
+
+        results = []
+        for index, action in enumerate(actions):
+            step = {"index": index, "type": action["type"]}
+            try:
+                result = await self.send_socket_message(action["type"], action.get("payload") or {}, timeout=timeout)
+                step["success"] = bool(result and result.get("success"))
+                step["result"] = result
+                if not step["success"]:
+                    step["error"] = (result or {}).get("error", "Unknown error")
+            except Exception as e:
+                step["success"] = False
+                step["error"] = str(e)
+            results.append(step)
+            if stop_on_error and not step["success"]:
+                break
+        return results
+
+    def _learn_tab_routes(self, connection: ExtensionConnection, message_type: str, payload: dict, result: Any):
+        """Pin tabs to the extension that reported them so later calls follow."""
+        if not isinstance(result, dict):
+            return
+
+        if message_type == "get_tabs":
+            tabs = result.get("tabs") or result.get("data") or []
+            tabs = tabs if isinstance(tabs, list) else []
+            for tab in tabs:
+                if isinstance(tab, dict) and tab.get("id") is not None:
+                    self.connections.pin_tab(tab["id"], connection)
+            self.tabs.replace(connection.id, tabs)
+        elif message_type == "new_tab" and result.get("success"):
+            tab = result.get("data") or {}
+            if tab.get("id") is not None:
+                self.connections.pin_tab(tab["id"], connection)
+                self.tabs.apply(connection.id, "created", {"tab": tab})
+        elif message_type == "close_tab" and result.get("success"):
+            if payload.get("tab_id") is not None:
+                self.connections.unpin_tab(payload["tab_id"])
+                self.dom_cache.invalidate(payload["tab_id"])
+                self.tabs.apply(connection.id, "removed", {"tab_id": payload["tab_id"]})
+
+    def handle_chunk(self, message: dict, size: int = 0, decode_seconds: float = 0.0):
+        """Queue one part of a streamed reply for its consumer.
+
+        Never waits, so a slow consumer holds up only its own stream: the
+        extension sends at most ``STREAM_WINDOW`` parts the consumer has not
+        acknowledged. One that runs ``STREAM_MAX_UNREAD`` parts ahead anyway
+        has its request cancelled and failed.
+        """
+        self.metrics.payload_bytes.inc(size, direction="in")
         message_id = message.get("id")
-        if message_id in self._pending_requests:
-            future = self._pending_requests[message_id]
-            if not future.done():
-                future.set_result(message)
+        pending = self._pending_requests.get(message_id)
+        if pending is None or pending.chunks is None or pending.future.done():
+            if self.is_abandoned(message_id):
+                self.metrics.orphaned_responses.inc()
+            return
+
+        if pending.chunks.empty() and pending.sent_at is not None:
+            self.metrics.phase_seconds.observe(
+                time.perf_counter() - decode_seconds - pending.sent_at, type=pending.message_type, phase="first_chunk"
+            )
+        self.metrics.phase_seconds.observe(decode_seconds, type=pending.message_type, phase="decode")
+        if pending.chunks.qsize() >= STREAM_MAX_UNREAD:
+            logger.warning(f"Browser extension ignored the stream window for {pending.message_type}; cancelling it")
+            pending.future.set_exception(
+                ExtensionError(f"Browser extension sent more than {STREAM_MAX_UNREAD} unacknowledged parts")
+            )
+            self._abandon(message_id, pending, "overflow")
+            return
+        pending.chunks.put_nowait(message["chunk"])
+
+    def handle_response(self, message: dict, size: int = 0, decode_seconds: float = 0.0):
+        """Handle incoming response from browser extension.
+
+        ``size`` and ``decode_seconds`` describe the frame(s) the message was
+        decoded from and feed the payload and decode metrics.
+        """
+        self.metrics.payload_bytes.inc(size, direction="in")
+        message_id = message.get("id")
+        pending = self._pending_requests.get(message_id)
+        if pending is None:
+            if self.is_abandoned(message_id):
+                self.metrics.orphaned_responses.inc()
+            return
+
+        message_type = pending.message_type
+        received_at = time.perf_counter() - decode_seconds
+        if pending.sent_at is not None:
+            self.metrics.phase_seconds.observe(received_at - pending.sent_at, type=message_type, phase="turnaround")
+        self.metrics.phase_seconds.observe(decode_seconds, type=message_type, phase="decode")
+        self.metrics.response_bytes.observe(size, type=message_type)
+
+        future = pending.future
+        loop = future.get_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            _resolve_future(future, message)
+        else:
+            loop.call_soon_threadsafe(_resolve_future, future, message)
 
     async def close(self):
-        """Close the WebSocket connection."""
-        if self._ws:
-            await self._ws.close()
-            self._ws = None 
\ No newline at end of file
+        """Close every browser extension connection."""
+        for connection in self.connections:
+            await connection.ws.close()
+            self.connections.remove(connection.ws)
+        self.images.shutdown()
+        self.debug_logs.stop()
+
+
+def _resolve_future(future: asyncio.Future, message: dict):
+    """Set a response on a pending future unless it already completed."""
+    if not future.done():
+        future.set_result(message)
+
+
+class ResponseStream:
+    """Async iterator over the parts of a chunked extension reply.
+
+    Created by ``Context.stream_socket_message``. The request is sent on the
+    first iteration. Each iteration is dispatched to the loop that owns the
+    WebSocket, so a stream can be consumed from any loop. Like any request it
+    is admitted by ``context.admission`` and holds its tab lock and in-flight
+    slot until the reply has been read or abandoned.
+    """
+
+    _END = object()
+
+    def __init__(
+        self,
+        context: Context,
+        message_type: str,
+        payload: dict,
+        timeout: Optional[float],
+        connection_id: Optional[str],
+    ):
+        self.context = context
+        self.message_type = message_type
+        self.payload = {**payload, "stream": True, "window": STREAM_WINDOW}
+        self.timeout = timeout if timeout is not None else context.timeouts.timeout_for(message_type)
+        self.connection_id = connection_id
+        self.result: Any = None
+        self._message_id: Optional[str] = None
+        self._pending: Optional[PendingRequest] = None
+        self._admitted = False
+        self._lock_key: Optional[Any] = None
+        # (connection id, tab key, start) of the admission slot while held
+        self._slot: Optional[tuple] = None
+        # Parts read since the last ``stream_ack``
+        self._unacknowledged = 0
+        self._finished = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        chunk = await self._on_owner_loop(self._next())
+        if chunk is self._END:
+            raise StopAsyncIteration
+        return chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Stop reading; an unfinished reply is cancelled on the extension."""
+        await self._on_owner_loop(self._close("cancelled"))
+
+    async def _on_owner_loop(self, coroutine):
+        owner = self.context._loop
+        if owner is not None and owner is not asyncio.get_running_loop():
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, owner))
+        return await coroutine
+
+    async def _start(self):
+        context = self.context
+        queued_at = time.perf_counter()
+        try:
+            context.admission.admit(self.message_type)
+        except OverloadedError:
+            context.metrics.requests.inc(type=self.message_type, outcome="overloaded")
+            self._finished = True
+            raise
+        self._admitted = True
+        # The tab lock and admission slot are held until the whole reply has
+        # been read or abandoned
+        try:
+            lock_key = context.tab_lock_key(self.message_type, self.payload)
+            if lock_key is not None:
+                await context.tab_locks.acquire(lock_key)
+                self._lock_key = lock_key
+            connection = await context._acquire_connection(
+                self.message_type, self.payload.get("tab_id"), self.connection_id
+            )
+            tab_key = lock_key if lock_key is not None else self.payload.get("tab_id")
+            started = await context.admission.acquire(self.message_type, connection.id, tab_key)
+            self._slot = (connection.id, tab_key, started)
+        except BaseException:
+            self._finished = True
+            self._release()
+            raise
+        self._message_id, self._pending = context._register(
+            connection, self.message_type, self.payload, asyncio.Queue()
+        )
+        try:
+            await context._send(self._message_id, self._pending, queued_at)
+        except BaseException:
+            self._finish("error")
+            raise
+
+    async def _next(self) -> Any:
+        if self._finished:
+            return self._END
+        if self._pending is None:
+            await self._start()
+
+        pending = self._pending
+        try:
+            if pending.chunks.empty() and not pending.future.done():
+                getter = asyncio.ensure_future(pending.chunks.get())
+                try:
+                    await asyncio.wait_for(
+                        asyncio.wait({getter, pending.future}, return_when=asyncio.FIRST_COMPLETED), self.timeout
+                    )
+                finally:
+                    if not getter.done():
+                        getter.cancel()
+                if getter.done() and not getter.cancelled():
+                    return self._consumed(getter.result())
+        except asyncio.TimeoutError:
+            self.context._count_timeout(pending.connection, self.message_type, self.timeout)
+            self.context.metrics.timeouts.inc(type=self.message_type)
+            await self._close("timeout")
+            raise ExtensionTimeoutError(
+                f"Timeout waiting for the next part from browser extension ({self.message_type}, {self.timeout:.1f}s)"
+            )
+        except asyncio.CancelledError:
+            await self._close("cancelled")
+            raise
+
+        if not pending.chunks.empty():
+            return self._consumed(pending.chunks.get_nowait())
+
+        # Every part has been read and the final response is in
+        try:
+            response = pending.future.result()
+        except ConnectionLostError:
+            self._finish("connection_lost")
+            raise
+        except ExtensionError:
+            self._finish("error")
+            raise
+        pending.connection.failures = 0
+        self.context.timeouts.observe(self.message_type, time.perf_counter() - pending.sent_at)
+        if "error" in response:
+            self._finish("error")
+            raise ExtensionReportedError(f"Browser extension error: {response['error']}")
+        self.result = response.get("result")
+        self._finish("ok")
+        return self._END
+
+    def _consumed(self, chunk: Any) -> Any:
+        """Count a part as read, acknowledging every half window so the extension keeps sending."""
+        self._unacknowledged += 1
+        if self._unacknowledged >= STREAM_WINDOW // 2:
+            self.context._post_control(
+                self._pending.connection, "stream_ack", {"id": self._message_id, "parts": self._unacknowledged}
+            )
+            self._unacknowledged = 0
+        return chunk
+
+    async def _close(self, reason: str):
+        if self._finished or self._pending is None:
+            self._finished = True
+            return
+        pending = self._pending
+        if not pending.future.done():
+            self.context._abandon(self._message_id, pending, reason)
+        self._finish(reason)
+        # Parts buffered but never read
+        while not pending.chunks.empty():
+            pending.chunks.get_nowait()
+
+    def _finish(self, outcome: str):
+        if not self._finished:
+            self._finished = True
+            self.context._unregister(self._message_id, self._pending, outcome)
+            self._release()
+
+    def _release(self):
+        """Give back the admission slot, tab lock and queue place the stream holds."""
+        admission = self.context.admission
+        if self._slot is not None:
+            admission.release(*self._slot)
+            self._slot = None
+        if self._lock_key is not None:
+            self.context.tab_locks.release(self._lock_key)
+            self._lock_key = None
+        if self._admitted:
+            admission.leave()
+            self._admitted = False
@@ -0,0 +1,222 @@
+"""Off-loop handling of ``debug_log`` messages from browser extensions.
+
+Chatty extensions can send hundreds of debug lines a second. Formatting and
+writing each one on the event loop delays the responses queued behind them,
+so the WebSocket handler only decides whether to keep a line (sampling and a
+per-connection rate limit) and enqueues the raw fields. A ``QueueListener`` thread
+builds the log records, formats and writes them, and also fills a ring buffer
+of recent lines that the ``get_debug_logs`` tool reads.
+"""
+
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from metrics import Counter
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warn": logging.WARNING,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+
+class RingBufferHandler(logging.Handler):
+    """Keep the most recent records for later queries."""
+
+    def __init__(self, capacity: int):
+        super().__init__()
+        self.records: deque[logging.LogRecord] = deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord):
+        with self.lock:
+            self.records.append(record)
+
+    def query(
+        self,
+        limit: int = 50,
+        source: Optional[str] = None,
+        min_level: int = logging.NOTSET,
+        contains: Optional[str] = None,
+    ) -> list[dict]:
+        """Most recent matching records, oldest first."""
+        with self.lock:
+            records = list(self.records)
+
+        matches = []
+        for record in reversed(records):
+            if source is not None and record.source != source:
+                continue
+            if record.levelno < min_level:
+                continue
+            if contains and contains not in record.text:
+                continue
+            matches.append(
+                {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+                    + f".{int(record.msecs):03d}",
+                    "source": record.source,
+                    "level": record.levelname.lower(),
+                    "message": record.text,
+                }
+            )
+            if len(matches) >= limit:
+                break
+        matches.reverse()
+        return matches
+
+
+class _PayloadListener(logging.handlers.QueueListener):
+    """Builds ``LogRecord``s from queued ``(created, level, source, text)`` tuples on its thread."""
+
+    def prepare(self, item: tuple) -> logging.LogRecord:
+        created, level, source, text = item
+        record = logging.LogRecord("dex.extension", level, "", 0, "[DEBUG_LOG %s] %s", (source, text), None)
+        # When the line arrived, not when the thread got to it
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        record.source = source
+        record.text = text
+        return record
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than fail when the queue is full at shutdown
+        self.queue.put(self._sentinel)
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def is_full(self, now: float) -> bool:
+        """Whether the bucket has refilled completely, i.e. is as good as new."""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class DebugLogSink:
+    """Sample, rate-limit and hand extension debug logs to a background thread.
+
+    Warnings and errors are never sampled out, but still count against the
+    rate limit. The rate limit applies per extension connection, whatever
+    ``source`` its lines claim. Lines are logged as ``dex.extension`` records to ``handlers``,
+    which default to the root logger's handlers at start-up.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        rate_per_connection: float = 20.0,
+        burst_per_connection: float = 100.0,
+        capacity: int = 1000,
+        handlers: Optional[list[logging.Handler]] = None,
+        max_queued: int = 10000,
+    ):
+        """
+        Args:
+            sample_rate: Fraction of debug and info lines kept.
+            rate_per_connection: Lines per second each extension connection
+                may log on average.
+            burst_per_connection: Lines a connection may log at once after
+                being quiet.
+            capacity: Lines kept in the ring buffer for ``get_debug_logs``.
+            handlers: Where kept lines are written; the root logger's
+                handlers when omitted.
+            max_queued: Lines waiting for the listener thread; further
+                lines are dropped until it catches up.
+        """
+        self.sample_rate = sample_rate
+        self.rate_per_connection = rate_per_connection
+        self.burst_per_connection = burst_per_connection
+        self.buffer = RingBufferHandler(capacity)
+        self.logged = Counter("dex_debug_logs_total", "Extension debug_log lines by outcome", ("outcome",))
+        self._handlers = handlers
+        # Least recently active connection first
+        self._buckets: OrderedDict[str, _TokenBucket] = OrderedDict()
+        self._queue: queue.Queue = queue.Queue(max_queued)
+        self._listener: Optional[_PayloadListener] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the listener thread; called on the first submitted line."""
+        with self._start_lock:
+            if self._listener is not None:
+                return
+            handlers = self._handlers if self._handlers is not None else logging.getLogger().handlers
+            self._listener = _PayloadListener(self._queue, self.buffer, *handlers, respect_handler_level=True)
+            self._listener.start()
+
+    def stop(self):
+        """Flush queued lines and stop the listener thread."""
+        with self._start_lock:
+            if self._listener is None:
+                return
+            self._listener.stop()
+            self._listener = None
+
+    def submit(self, connection_id: str, payload: dict) -> bool:
+        """Queue one ``debug_log`` payload from a connection; returns False if it was dropped."""
+        level = LEVELS.get(str(payload.get("level", "info")).lower(), logging.INFO)
+        source = str(payload.get("source") or connection_id)
+
+        if level < logging.WARNING and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.logged.inc(outcome="sampled_out")
+            return False
+
+        if not self._bucket(connection_id).take():
+            self.logged.inc(outcome="rate_limited")
+            return False
+
+        if self._listener is None:
+            self.start()
+        try:
+            self._queue.put_nowait((time.time(), level, source, str(payload.get("message"))))
+        except queue.Full:
+            self.logged.inc(outcome="queue_full")
+            return False
+        self.logged.inc(outcome="kept")
+        return True
+
+    def _bucket(self, connection_id: str) -> _TokenBucket:
+        """The rate limit of a connection, forgetting connections that have gone quiet."""
+        bucket = self._buckets.pop(connection_id, None)
+        if bucket is None:
+            bucket = _TokenBucket(self.rate_per_connection, self.burst_per_connection)
+        self._buckets[connection_id] = bucket
+
+        # A full bucket limits exactly like a new one, so dropping it is free;
+        # one still throttling its connection is always kept
+        now = time.monotonic()
+        while len(self._buckets) > 1:
+            oldest = next(iter(self._buckets.values()))
+            if not oldest.is_full(now):
+                break
+            self._buckets.popitem(last=False)
+        return bucket
+
+    def query(self, *args, **kwargs) -> list[dict]:
+        return self.buffer.query(*args, **kwargs)
+
+    def dropped(self) -> dict[str, int]:
+        """Lines dropped so far, by reason."""
+        return {
+            outcome: int(self.logged.value(outcome=outcome)) for outcome in ("sampled_out", "rate_limited", "queue_full")
+        }
@@ -0,0 +1,380 @@
+"""Fit ``grab_dom`` output into a token budget.
+
+The formatted DOM is pruned in deterministic passes, cheapest loss first,
+stopping as soon as the text fits:
+
+1. drop invisible, decorative and off-screen nodes
+2. replace attribute strings that repeat with short ``&N`` references
+3. collapse runs of structurally identical siblings (table rows, list items)
+   into ten, three or one examples and a count
+4. shorten long lines
+5. cut the remaining lines, keeping interactive ones first
+
+Legend entries are kept whole for as long as a shown line references them.
+
+Nesting is taken from each line's indentation, so flat output works too.
+"""
+
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+CHARS_PER_TOKEN = 4
+
+# A processedOutput line: indentation, optional "[12]" highlight index, then
+# the node text
+LINE = re.compile(r"^(?P<indent>\s*)(?:\[(?P<index>\d+)\])?\s*(?P<body>.*)$")
+OPENING_TAG = re.compile(r"^<[^>]*>")
+TAG_NAME = re.compile(r"^<\s*([a-zA-Z][\w-]*)")
+ATTRIBUTE = re.compile(r"""([\w:-]+)\s*=\s*("[^"]*"|'[^']*')""")
+DIGITS = re.compile(r"\d+")
+# "&3 = class=..." lines that dedupe_attributes puts on top, and their uses
+LEGEND = re.compile(r"^(?P<reference>&\d+) = ")
+REFERENCE = re.compile(r"&\d+(?!\d)")
+# A reference a truncation may have cut short, e.g. "&1" of "&12"
+PARTIAL_REFERENCE = re.compile(r"&\d*$")
+
+# Markers in an opening tag that mean the node is not visible to the user
+HIDDEN_MARKERS = re.compile(
+    r"""\shidden(?=[\s>/=])(?!\s*=\s*["']?false)"""
+    r"""|aria-hidden\s*=\s*["']?true"""
+    r"""|display\s*:\s*none"""
+    r"""|visibility\s*:\s*hidden"""
+    r"""|type\s*=\s*["']?hidden"""
+    r"""|data-offscreen(?!\s*=\s*["']?false)"""
+    r"""|data-visible\s*=\s*["']?false""",
+    re.IGNORECASE,
+)
+DECORATIVE_ROLES = re.compile(r"""role\s*=\s*["']?(presentation|none)\b""", re.IGNORECASE)
+EMPTY_ALT = re.compile(r"""alt\s*=\s*(""|'')""")
+DECORATIVE_TAGS = {"svg", "path", "g", "use", "br", "hr", "style", "script", "noscript", "template", "meta", "link"}
+
+# Attribute strings shorter than this are cheaper to repeat than to reference
+MIN_DEDUPE_LENGTH = 24
+# Shortest run of identical siblings worth collapsing
+MIN_RUN = 3
+# Examples kept per collapsed run, tried in order until the text fits
+COLLAPSE_KEEP = (10, 3, 1)
+MAX_LINE_LENGTH = 160
+
+
+@dataclass
+class _Node:
+    indent: str
+    index: Optional[str]
+    body: str
+    children: list["_Node"] = field(default_factory=list)
+    # Cached by _signature; children are not modified once it is set
+    signature: Optional[tuple] = field(default=None, repr=False)
+
+    @property
+    def depth(self) -> int:
+        return len(self.indent.expandtabs(4))
+
+    def render(self) -> str:
+        prefix = f"[{self.index}]" if self.index is not None else ""
+        return f"{self.indent}{prefix}{self.body}"
+
+
+@dataclass
+class PrunedDom:
+    """Result of ``prune_dom``."""
+
+    text: str
+    highlight_to_xpath: dict[str, str]
+    original_tokens: int
+    tokens: int
+    # Passes that were needed, in order
+    passes: list[str] = field(default_factory=list)
+    dropped: int = 0
+    collapsed: int = 0
+    truncated: int = 0
+
+    def stats(self) -> dict:
+        return {
+            "originalTokens": self.original_tokens,
+            "tokens": self.tokens,
+            "passes": self.passes,
+            "dropped": self.dropped,
+            "collapsed": self.collapsed,
+            "truncated": self.truncated,
+        }
+
+
+def estimate_tokens(text: str, chars_per_token: float = CHARS_PER_TOKEN) -> int:
+    """Rough token count of ``text``."""
+    return math.ceil(len(text) / chars_per_token)
+
+
+def parse_lines(text: str) -> list[_Node]:
+    """Build a node tree from processedOutput using indentation for nesting."""
+    roots: list[_Node] = []
+    stack: list[_Node] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = LINE.match(line)
+        node = _Node(match.group("indent"), match.group("index"), match.group("body"))
+        while stack and stack[-1].depth >= node.depth:
+            stack.pop()
+        (stack[-1].children if stack else roots).append(node)
+        stack.append(node)
+    return roots
+
+
+def render(nodes: list[_Node]) -> list[str]:
+    lines = []
+    for node in nodes:
+        lines.append(node.render())
+        lines.extend(render(node.children))
+    return lines
+
+
+def _count(nodes: list[_Node]) -> int:
+    return sum(1 + _count(node.children) for node in nodes)
+
+
+def _opening_tag(body: str) -> str:
+    match = OPENING_TAG.match(body)
+    return match.group(0) if match else ""
+
+
+def is_hidden(node: _Node) -> bool:
+    """Whether the node's opening tag marks it invisible or off-screen."""
+    return bool(HIDDEN_MARKERS.search(_opening_tag(node.body)))
+
+
+def is_decorative(node: _Node) -> bool:
+    """Whether a non-interactive node carries no content for the model."""
+    if node.index is not None:
+        return False
+    tag = _opening_tag(node.body)
+    name = TAG_NAME.match(tag)
+    if name and name.group(1).lower() in DECORATIVE_TAGS:
+        return True
+    if DECORATIVE_ROLES.search(tag):
+        return True
+    return bool(name and name.group(1).lower() == "img" and EMPTY_ALT.search(tag))
+
+
+def drop_invisible(nodes: list[_Node]) -> tuple[list[_Node], int]:
+    """Remove hidden and decorative nodes along with their descendants."""
+    kept = []
+    dropped = 0
+    for node in nodes:
+        if is_hidden(node) or is_decorative(node):
+            dropped += 1 + _count(node.children)
+            continue
+        node.children, child_dropped = drop_invisible(node.children)
+        dropped += child_dropped
+        kept.append(node)
+    return kept, dropped
+
+
+def dedupe_attributes(lines: list[str]) -> list[str]:
+    """Replace repeated long attribute strings with ``&N`` and a legend on top."""
+    counts: dict[str, int] = {}
+    for line in lines:
+        for match in ATTRIBUTE.finditer(_opening_tag(LINE.match(line).group("body"))):
+            attribute = match.group(0)
+            if len(attribute) >= MIN_DEDUPE_LENGTH:
+                counts[attribute] = counts.get(attribute, 0) + 1
+
+    references: dict[str, str] = {}
+    for attribute, count in counts.items():
+        reference = f"&{len(references) + 1}"
+        legend_cost = len(reference) + len(attribute) + 4
+        if count > 1 and (len(attribute) - len(reference)) * count > legend_cost:
+            references[attribute] = reference
+
+    if not references:
+        return lines
+
+    def replace(match: re.Match) -> str:
+        return references.get(match.group(0), match.group(0))
+
+    deduped = []
+    for line in lines:
+        match = LINE.match(line)
+        body = match.group("body")
+        tag = _opening_tag(body)
+        if tag:
+            line = line[: match.start("body")] + ATTRIBUTE.sub(replace, tag) + body[len(tag):]
+        deduped.append(line)
+
+    legend = [f"{reference} = {attribute}" for attribute, reference in references.items()]
+    return legend + deduped
+
+
+def _signature(node: _Node) -> tuple:
+    """Structure of a node: tag, attribute names and child structure, ignoring values."""
+    if node.signature is None:
+        tag = _opening_tag(node.body)
+        name = TAG_NAME.match(tag)
+        attributes = tuple(sorted(match.group(1) for match in ATTRIBUTE.finditer(tag)))
+        shape = (name.group(1).lower() if name else DIGITS.sub("#", node.body[:20]), attributes)
+        node.signature = shape + tuple(_signature(child) for child in node.children)
+    return node.signature
+
+
+def _indices(nodes: list[_Node]) -> list[int]:
+    indices = []
+    for node in nodes:
+        if node.index is not None:
+            indices.append(int(node.index))
+        indices.extend(_indices(node.children))
+    return indices
+
+
+def collapse_repeats(nodes: list[_Node], keep: int) -> tuple[list[_Node], int]:
+    """Keep ``keep`` examples of each run of identical siblings and count the rest.
+
+    Returns new nodes; ``nodes`` is left as it was so the tree can be
+    collapsed again with a different ``keep``.
+    """
+    collapsed = 0
+    result = []
+    i = 0
+    while i < len(nodes):
+        signature = _signature(nodes[i])
+        end = i + 1
+        while end < len(nodes) and _signature(nodes[end]) == signature:
+            end += 1
+
+        run = nodes[i:end]
+        examples = run
+        if len(run) >= max(MIN_RUN, keep + 1):
+            examples, rest = run[:keep], run[keep:]
+        for node in examples:
+            children, child_collapsed = collapse_repeats(node.children, keep)
+            collapsed += child_collapsed
+            result.append(_Node(node.indent, node.index, node.body, children, node.signature))
+
+        if examples is not run:
+            collapsed += _count(rest)
+            name = TAG_NAME.match(_opening_tag(rest[0].body))
+            label = f"<{name.group(1)}>" if name else "items"
+            indices = _indices(rest)
+            span = f" [{min(indices)}]-[{max(indices)}]" if indices else ""
+            summary = f"... {len(rest)} more {label} like above{span}, use query_elements to target them"
+            result.append(_Node(rest[0].indent, None, summary))
+        i = end
+    return result, collapsed
+
+
+def split_legend(lines: list[str]) -> tuple[dict[str, str], list[str]]:
+    """Separate the ``&N = ...`` legend on top of ``lines`` from the DOM lines."""
+    legend: dict[str, str] = {}
+    for position, line in enumerate(lines):
+        match = LEGEND.match(line)
+        if not match:
+            return legend, lines[position:]
+        legend[match.group("reference")] = line
+    return legend, []
+
+
+def _references(line: str) -> list[str]:
+    return list(dict.fromkeys(REFERENCE.findall(line)))
+
+
+def drop_unused_legend(lines: list[str]) -> list[str]:
+    """Remove legend entries that no line references any more."""
+    legend, body = split_legend(lines)
+    used = {reference for line in body for reference in _references(line)}
+    return [line for reference, line in legend.items() if reference in used] + body
+
+
+def shorten_lines(lines: list[str], max_length: int = MAX_LINE_LENGTH) -> list[str]:
+    """Truncate long lines; legend entries stay whole and no reference is cut short."""
+    legend, body = split_legend(lines)
+    shortened = [
+        line if len(line) <= max_length else PARTIAL_REFERENCE.sub("", line[:max_length]) + "..."
+        for line in body
+    ]
+    return list(legend.values()) + shortened
+
+
+def cut_lines(lines: list[str], budget_chars: int) -> tuple[list[str], int]:
+    """Keep as many lines as fit, interactive ones first, in their original order.
+
+    A line is kept together with the legend entries it references, which are
+    charged to the first line that needs them; other legend entries go.
+    """
+    legend, body = split_legend(lines)
+    marker_allowance = 40
+    remaining = budget_chars - marker_allowance
+    chosen = set()
+    needed: set[str] = set()
+    for interactive in (True, False):
+        for position, line in enumerate(body):
+            if position in chosen or bool(LINE.match(line).group("index")) != interactive:
+                continue
+            missing = [ref for ref in _references(line) if ref in legend and ref not in needed]
+            cost = len(line) + 1 + sum(len(legend[ref]) + 1 for ref in missing)
+            if cost <= remaining:
+                chosen.add(position)
+                needed.update(missing)
+                remaining -= cost
+
+    kept = [line for reference, line in legend.items() if reference in needed]
+    kept += [line for position, line in enumerate(body) if position in chosen]
+    cut = len(body) - len(chosen)
+    if cut:
+        kept.append(f"... {cut} more lines cut to fit the budget")
+    return kept, cut
+
+
+def prune_dom(
+    processed_output: str,
+    highlight_to_xpath: dict[str, str],
+    max_tokens: int,
+    chars_per_token: float = CHARS_PER_TOKEN,
+) -> PrunedDom:
+    """Shrink formatted DOM text to about ``max_tokens`` tokens.
+
+    Passes run in a fixed order and stop once the text fits, so the same page
+    and budget always give the same output. ``highlight_to_xpath`` is reduced
+    to the elements still shown.
+    """
+    original_tokens = estimate_tokens(processed_output, chars_per_token)
+    pruned = PrunedDom(processed_output, highlight_to_xpath, original_tokens, original_tokens)
+    if original_tokens <= max_tokens:
+        return pruned
+
+    budget_chars = int(max_tokens * chars_per_token)
+
+    def fits(lines: list[str]) -> bool:
+        return sum(len(line) + 1 for line in lines) <= budget_chars
+
+    nodes, pruned.dropped = drop_invisible(parse_lines(processed_output))
+    lines = render(nodes)
+    pruned.passes.append("drop_invisible")
+
+    if not fits(lines):
+        lines = dedupe_attributes(lines)
+        pruned.passes.append("dedupe_attributes")
+
+    for keep in COLLAPSE_KEEP:
+        if fits(lines):
+            break
+        collapsed_nodes, pruned.collapsed = collapse_repeats(nodes, keep)
+        lines = dedupe_attributes(render(collapsed_nodes))
+        pruned.passes.append(f"collapse_repeats({keep})")
+
+    if not fits(lines):
+        lines = shorten_lines(lines)
+        pruned.passes.append("shorten_lines")
+
+    if not fits(lines):
+        lines, pruned.truncated = cut_lines(lines, budget_chars)
+        pruned.passes.append("cut_lines")
+
+    lines = drop_unused_legend(lines)
+    pruned.text = "\n".join(lines)
+    pruned.tokens = estimate_tokens(pruned.text, chars_per_token)
+    shown = {LINE.match(line).group("index") for line in lines}
+    pruned.highlight_to_xpath = {
+        index: xpath for index, xpath in highlight_to_xpath.items() if index in shown
+    }
+    return pruned
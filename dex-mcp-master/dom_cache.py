@@ -0,0 +1,179 @@
+"""Per-tab DOM snapshots and the deltas between them.
+
+``grab_dom`` results are reduced to their interactive nodes keyed by XPath,
+which stays stable across calls while highlight indices are renumbered. The
+last snapshot of each tab is kept so later calls can return only what changed.
+"""
+
+import re
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# Leading "[12]" highlight index on a processedOutput line
+HIGHLIGHT_PREFIX = re.compile(r"^\s*\[(\d+)\]\s*")
+
+# Tag name and explicit role of a node's text, e.g. '<a role="button">'
+NODE_TAG = re.compile(r"^<\s*([a-zA-Z][\w-]*)")
+NODE_ROLE = re.compile(r"""\brole\s*=\s*["']?([\w-]+)""")
+
+# ARIA roles implied by tag names, for matching nodes without a role attribute
+IMPLICIT_ROLES = {
+    "a": "link",
+    "button": "button",
+    "input": "textbox",
+    "textarea": "textbox",
+    "select": "combobox",
+    "option": "option",
+    "img": "img",
+    "form": "form",
+    "nav": "navigation",
+    "table": "table",
+    "li": "listitem",
+    "h1": "heading",
+    "h2": "heading",
+    "h3": "heading",
+    "h4": "heading",
+    "h5": "heading",
+    "h6": "heading",
+}
+
+
+class DomSnapshot:
+    """Interactive nodes of one tab at one point in time."""
+
+    def __init__(
+        self,
+        version: int,
+        nodes: dict[str, str],
+        highlight_to_xpath: dict[str, str],
+        extension_version: Any = None,
+    ):
+        self.version = version
+        self.nodes = nodes
+        self.highlight_to_xpath = highlight_to_xpath
+        # Opaque DOM version reported by the extension, echoed back as
+        # ``since_version`` when asking it for a delta.
+        self.extension_version = extension_version
+
+
+def index_nodes(data: dict) -> dict[str, str]:
+    """Key the interactive nodes of a ``grab_dom`` result by XPath.
+
+    The highlight index is stripped from each node's text so renumbering
+    alone does not register as a change.
+    """
+    xpaths = data.get("highlightToXPath") or {}
+    nodes: dict[str, str] = {}
+
+    for line in (data.get("processedOutput") or "").splitlines():
+        match = HIGHLIGHT_PREFIX.match(line)
+        if match and match.group(1) in xpaths:
+            nodes[xpaths[match.group(1)]] = line[match.end():].strip()
+
+    for xpath in xpaths.values():
+        nodes.setdefault(xpath, "")
+
+    return nodes
+
+
+def diff_nodes(old: dict[str, str], new: dict[str, str]) -> dict:
+    """Compute added, removed and changed nodes between two snapshots."""
+    return {
+        "added": {xpath: node for xpath, node in new.items() if xpath not in old},
+        "removed": [xpath for xpath in old if xpath not in new],
+        "changed": {
+            xpath: node for xpath, node in new.items() if xpath in old and old[xpath] != node
+        },
+    }
+
+
+def apply_delta(nodes: dict[str, str], delta: dict) -> dict[str, str]:
+    """Apply an extension-computed delta to a copy of ``nodes``."""
+    updated = dict(nodes)
+    for xpath in delta.get("removed") or []:
+        updated.pop(xpath, None)
+    updated.update(delta.get("added") or {})
+    updated.update(delta.get("changed") or {})
+    return updated
+
+
+def node_role(node: str) -> Optional[str]:
+    """Explicit or implied ARIA role of a node's text."""
+    match = NODE_ROLE.search(node)
+    if match:
+        return match.group(1).lower()
+    match = NODE_TAG.match(node)
+    return IMPLICIT_ROLES.get(match.group(1).lower()) if match else None
+
+
+def query_nodes(
+    nodes: dict[str, str],
+    xpath: Optional[str] = None,
+    text: Optional[str] = None,
+    role: Optional[str] = None,
+    limit: int = 20,
+) -> tuple[list[dict], int]:
+    """Filter snapshot nodes by XPath prefix, text and role.
+
+    Text matching is a case-insensitive substring test on the node's text.
+    Returns up to ``limit`` matches as ``{"xpath", "text"}`` dicts along with
+    the total number of matches.
+    """
+    text = text.lower() if text else None
+    role = role.lower() if role else None
+    matches = []
+    total = 0
+
+    for node_xpath, node in nodes.items():
+        if xpath and not node_xpath.startswith(xpath):
+            continue
+        if text and text not in node.lower():
+            continue
+        if role and node_role(node) != role:
+            continue
+        total += 1
+        if len(matches) < limit:
+            matches.append({"xpath": node_xpath, "text": node})
+
+    return matches, total
+
+
+class DomCache:
+    """Bounded LRU of the latest DOM snapshot per tab."""
+
+    def __init__(self, max_tabs: int = 32):
+        self.max_tabs = max_tabs
+        self._snapshots: OrderedDict[Hashable, DomSnapshot] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[DomSnapshot]:
+        snapshot = self._snapshots.get(key)
+        if snapshot:
+            self._snapshots.move_to_end(key)
+        return snapshot
+
+    def store(
+        self,
+        key: Hashable,
+        nodes: dict[str, str],
+        highlight_to_xpath: dict[str, str],
+        extension_version: Any = None,
+    ) -> DomSnapshot:
+        """Save a new snapshot for ``key`` and evict the least recently used tab."""
+        previous = self._snapshots.pop(key, None)
+        snapshot = DomSnapshot(
+            version=previous.version + 1 if previous else 1,
+            nodes=nodes,
+            highlight_to_xpath=highlight_to_xpath,
+            extension_version=extension_version,
+        )
+        self._snapshots[key] = snapshot
+        while len(self._snapshots) > self.max_tabs:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Drop the snapshot for one tab, or all snapshots."""
+        if key is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(key, None)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Simulated browser extension for local testing and load benchmarks.
+
+``FakeExtension`` connects to the WebSocket bridge like the real extension
+and answers its requests. Responses come from a recording of a real session
+when one is loaded, and are otherwise synthesized: a tab list, a DOM of
+``dom_rows`` form rows, a PNG-sized screenshot of ``screenshot_bytes`` and
+a grid of cells for the spreadsheet messages.
+Every answer is delayed by ``latency`` seconds plus up to ``jitter``, and
+``cancel`` messages stop the matching answer.
+
+Recordings are JSON lines of ``{"type", "payload", "result"}`` written by
+``ResponseRecorder``; start the server with ``python main.py --record
+session.jsonl`` to capture one.
+
+Usage:
+    python fake_extension.py [--url ws://127.0.0.1:8765] [--recording session.jsonl] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import random
+import threading
+from typing import Any, Optional
+
+import websockets
+
+from sheets import parse_cell, parse_tsv
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseRecorder:
+    """Append every successful extension response to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, message_type: str, payload: dict, result: Any):
+        line = json.dumps({"type": message_type, "payload": payload, "result": _jsonable(result)})
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _jsonable(result: Any) -> Any:
+    """Turn binary screenshot bytes back into the data URL a JSON reply would carry."""
+    if isinstance(result, dict):
+        data = result.get("data")
+        if isinstance(data, (bytes, bytearray)):
+            mime = result.get("mimeType", "image/png")
+            return {**result, "data": f"data:{mime};base64,{base64.b64encode(data).decode()}"}
+        return {key: _jsonable(value) for key, value in result.items()}
+    if isinstance(result, (bytes, bytearray)):
+        return base64.b64encode(result).decode()
+    return result
+
+
+def load_recording(path: str) -> dict[str, list]:
+    """Read a recording into recorded results per message type, in order."""
+    responses: dict[str, list] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                responses.setdefault(entry["type"], []).append(entry["result"])
+    return responses
+
+
+class FakeExtension:
+    """A scripted stand-in for the browser extension."""
+
+    def __init__(
+        self,
+        url: str = "ws://127.0.0.1:8765",
+        recording: Optional[dict[str, list]] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        tabs: int = 10,
+        dom_rows: int = 200,
+        screenshot_bytes: int = 200_000,
+        capabilities: Optional[list[str]] = None,
+    ):
+        """
+        Args:
+            url: WebSocket address of the bridge.
+            recording: Results per message type from ``load_recording``;
+                each type's results are replayed round-robin.
+            latency: Seconds before each answer.
+            jitter: Extra random delay of up to this many seconds.
+            tabs: Open tabs reported by ``get_tabs``.
+            dom_rows: Form rows in the synthesized ``grab_dom`` output.
+            screenshot_bytes: Size of the synthesized screenshot.
+            capabilities: Capabilities announced in the hello message.
+        """
+        self.url = url
+        self.latency = latency
+        self.jitter = jitter
+        self.tabs = [{"id": i, "title": f"Tab {i}", "url": f"https://example.com/{i}"} for i in range(1, tabs + 1)]
+        self.capabilities = capabilities or []
+        self.requests = 0
+        self.cancelled = 0
+        self._recording = {
+            message_type: itertools.cycle(results) for message_type, results in (recording or {}).items() if results
+        }
+        self._dom = _synthetic_dom(dom_rows)
+        self._screenshot = "data:image/png;base64," + base64.b64encode(random.randbytes(screenshot_bytes)).decode()
+        # Spreadsheet cells per tab, keyed by zero-based (row, column)
+        self.cells: dict[Any, dict[tuple[int, int], str]] = {}
+        self._selection: dict[Any, tuple[int, int]] = {}
+        self._answers: dict[str, asyncio.Task] = {}
+        self._ws = None
+
+    async def run(self, ready: Optional[asyncio.Event] = None):
+        """Connect and answer requests until the connection closes."""
+        async with websockets.connect(self.url, max_size=None) as ws:
+            self._ws = ws
+            await ws.send(json.dumps({"type": "hello", "payload": {"capabilities": self.capabilities}}))
+            if "tab_events" in self.capabilities:
+                await ws.send(json.dumps({"type": "tab_event", "payload": {"event": "snapshot", "tabs": self.tabs}}))
+            if ready:
+                ready.set()
+            try:
+                async for frame in ws:
+                    message = json.loads(frame)
+                    if message.get("type") == "hello_ack":
+                        continue
+                    if message.get("type") == "cancel":
+                        task = self._answers.pop(message["payload"]["id"], None)
+                        if task:
+                            task.cancel()
+                            self.cancelled += 1
+                        continue
+                    self.requests += 1
+                    task = asyncio.create_task(self._answer(message))
+                    self._answers[message["id"]] = task
+                    task.add_done_callback(lambda _, message_id=message["id"]: self._answers.pop(message_id, None))
+            finally:
+                for task in self._answers.values():
+                    task.cancel()
+
+    async def _answer(self, message: dict):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        result = self.respond(message["type"], message.get("payload") or {})
+        try:
+            await self._ws.send(json.dumps({"id": message["id"], "result": result}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def respond(self, message_type: str, payload: dict) -> dict:
+        """The result for one request: recorded if available, else synthesized."""
+        recorded = self._recording.get(message_type)
+        if recorded:
+            return next(recorded)
+        if message_type == "get_tabs":
+            return {"success": True, "tabs": self.tabs}
+        if message_type == "grab_dom":
+            return {"success": True, "action": "grab_dom", "data": self._dom}
+        if message_type in ("screenshot", "capture_with_highlights"):
+            data = {"dataUrl": self._screenshot} if message_type == "capture_with_highlights" else self._screenshot
+            return {"success": True, "action": message_type, "data": data, "mimeType": "image/png"}
+        if message_type == "batch":
+            results = []
+            for index, action in enumerate(payload.get("actions") or []):
+                result = self.respond(action.get("type"), action.get("payload") or {})
+                step = {"index": index, "type": action.get("type"), "success": bool(result.get("success"))}
+                step.update({"result": result} if step["success"] else {"error": result.get("error")})
+                results.append(step)
+                if payload.get("stop_on_error", True) and not step["success"]:
+                    break
+            return {"success": True, "results": results}
+        if message_type in ("select_range", "paste_text", "read_range"):
+            return self._spreadsheet(message_type, payload)
+        return {"success": True, "action": message_type}
+
+    def _spreadsheet(self, message_type: str, payload: dict) -> dict:
+        """A grid of cells per tab that pastes and reads back like a spreadsheet."""
+        tab = payload.get("tab_id", "active")
+        cells = self.cells.setdefault(tab, {})
+        if message_type == "paste_text":
+            if tab not in self._selection:
+                return {"success": False, "error": "No range selected"}
+            top, left = self._selection[tab]
+            for r, row in enumerate(parse_tsv(payload.get("text", ""))):
+                for c, value in enumerate(row):
+                    cells[(top + r, left + c)] = value
+            return {"success": True, "action": message_type}
+
+        try:
+            start, _, end = payload.get("range", "").rsplit("!", 1)[-1].partition(":")
+            _, top, left = parse_cell(start)
+            _, bottom, right = parse_cell(end or start)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+        if message_type == "select_range":
+            self._selection[tab] = (top, left)
+            return {"success": True, "action": message_type}
+        values = [[cells.get((r, c), "") for c in range(left, right + 1)] for r in range(top, bottom + 1)]
+        return {"success": True, "action": message_type, "data": {"values": values}}
+
+
+def _synthetic_dom(rows: int) -> dict:
+    lines = []
+    xpaths = {}
+    for i in range(1, rows + 1):
+        lines.append(f'[{i}]<input type="text" class="cell-input" aria-label="Row {i} Name" value="Contact {i}">')
+        xpaths[str(i)] = f"/html/body/div[2]/table/tbody/tr[{i}]/td[2]/input[1]"
+    return {"processedOutput": "\n".join(lines), "highlightToXPath": xpaths}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:8765", help="WebSocket address of the bridge")
+    parser.add_argument("--recording", help="JSON lines recording to replay")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before each answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay in seconds")
+    parser.add_argument("--tabs", type=int, default=10, help="Open tabs to report")
+    parser.add_argument("--dom-rows", type=int, default=200, help="Rows in the synthesized DOM")
+    parser.add_argument("--screenshot-bytes", type=int, default=200_000, help="Size of the synthesized screenshot")
+    parser.add_argument("--capability", action="append", default=[], help="Capability to announce (repeatable)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    extension = FakeExtension(
+        url=args.url,
+        recording=load_recording(args.recording) if args.recording else None,
+        latency=args.latency,
+        jitter=args.jitter,
+        tabs=args.tabs,
+        dom_rows=args.dom_rows,
+        screenshot_bytes=args.screenshot_bytes,
+        capabilities=args.capability,
+    )
+    try:
+        asyncio.run(extension.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
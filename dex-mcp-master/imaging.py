@@ -0,0 +1,275 @@
+"""Server-side post-processing for screenshots.
+
+Captures can be downscaled, cropped, converted to grayscale and re-encoded as
+JPEG or WebP before they reach the model. Work runs in a thread pool so the
+event loop keeps serving the extension, and results are cached by tab, URL,
+content hash and options so re-capturing an unchanged page is free.
+
+Captures can also be compared against the last one returned for the same tab
+using a perceptual difference hash, so callers polling for visual changes get
+a tiny "unchanged" answer instead of another full image.
+
+Requires Pillow (and NumPy for hashing); without them captures pass through
+unchanged and every capture counts as changed.
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Any, Iterator, Optional
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # pragma: no cover - optional dependency
+    PILImage = None
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+FORMATS = ("png", "jpeg", "jpg", "webp")
+
+
+class ImageError(Exception):
+    """A capture could not be decoded or transformed."""
+
+
+class CropError(ImageError):
+    """The crop region does not lie within the capture."""
+
+
+@dataclass(frozen=True)
+class ImageOptions:
+    """How to transform a capture. ``None`` fields leave that aspect alone."""
+
+    max_width: Optional[int] = None
+    max_height: Optional[int] = None
+    # "png", "jpeg" or "webp"
+    format: Optional[str] = None
+    # Encoder quality for JPEG/WebP, 1-100
+    quality: Optional[int] = None
+    grayscale: bool = False
+    # (left, top, width, height) in source pixels, applied before scaling
+    crop: Optional[tuple[int, int, int, int]] = None
+
+    def is_noop(self) -> bool:
+        return self == ImageOptions()
+
+    def validate(self):
+        """Raise ``ValueError`` for options no capture could satisfy."""
+        for name in ("max_width", "max_height"):
+            value = getattr(self, name)
+            if value is not None and (not _is_int(value) or value <= 0):
+                raise ValueError(f"{name} must be a positive integer")
+        if self.format is not None and (not isinstance(self.format, str) or self.format.lower() not in FORMATS):
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        if self.quality is not None and (not _is_int(self.quality) or not 1 <= self.quality <= 100):
+            raise ValueError("quality must be an integer from 1 to 100")
+        if self.crop is not None:
+            if len(self.crop) != 4 or not all(_is_int(value) for value in self.crop):
+                raise ValueError("crop must be [left, top, width, height] in integer pixels")
+            left, top, width, height = self.crop
+            if left < 0 or top < 0:
+                raise ValueError("crop left and top must not be negative")
+            if width <= 0 or height <= 0:
+                raise ValueError("crop width and height must be positive")
+
+    def merged_with(self, overrides: "ImageOptions") -> "ImageOptions":
+        """Apply per-call overrides on top of these defaults."""
+        changes = {
+            name: value
+            for name, value in vars(overrides).items()
+            if value is not None and value is not False
+        }
+        return replace(self, **changes)
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def decode_data_url(data_url: str) -> tuple[bytes, str]:
+    """Split a base64 data URL into its bytes and MIME type."""
+    try:
+        header, encoded = data_url.split(",", 1)
+        return base64.b64decode(encoded, validate=True), header[5:].split(";")[0]
+    except ValueError as e:
+        raise ImageError(f"Invalid image data URL: {e}") from e
+
+
+@contextmanager
+def _pillow_errors(action: str) -> Iterator[None]:
+    """Re-raise what Pillow throws for corrupt or unsupported captures as ``ImageError``."""
+    try:
+        yield
+    except (OSError, ValueError, KeyError, SyntaxError, PILImage.DecompressionBombError) as e:
+        raise ImageError(f"Could not {action} capture: {e}") from e
+
+
+def transform_image(data: bytes, options: ImageOptions) -> tuple[bytes, str]:
+    """Apply ``options`` to an encoded image and return (bytes, MIME type).
+
+    Raises ``ImageError`` if the capture can't be decoded or encoded, and
+    ``CropError`` if the crop region extends past its edges.
+    """
+    with _pillow_errors("process"):
+        image = PILImage.open(io.BytesIO(data))
+        source_format = (image.format or "png").lower()
+
+        if options.crop:
+            left, top, width, height = options.crop
+            if left + width > image.width or top + height > image.height:
+                raise CropError(f"Crop {list(options.crop)} extends past the {image.width}x{image.height} capture")
+            image = image.crop((left, top, left + width, top + height))
+
+        if options.max_width or options.max_height:
+            image.thumbnail(
+                (options.max_width or image.width, options.max_height or image.height),
+                PILImage.Resampling.LANCZOS,
+            )
+
+        if options.grayscale:
+            image = image.convert("L")
+
+        target_format = (options.format or source_format).lower()
+        if target_format == "jpg":
+            target_format = "jpeg"
+        if target_format == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        save_kwargs: dict[str, Any] = {}
+        if options.quality is not None and target_format in ("jpeg", "webp"):
+            save_kwargs["quality"] = options.quality
+        if target_format == "png":
+            save_kwargs["optimize"] = True
+
+        output = io.BytesIO()
+        image.save(output, format=target_format.upper(), **save_kwargs)
+    return output.getvalue(), FORMAT_MIME_TYPES.get(target_format, f"image/{target_format}")
+
+
+def perceptual_hash(data: bytes, hash_size: int = 8) -> int:
+    """64-bit difference hash: does each pixel of a tiny grayscale thumbnail
+    get brighter or darker than its right-hand neighbour?
+
+    Robust to re-encoding and small rendering noise, sensitive to layout and
+    content changes. Raises ``ImageError`` if the capture can't be decoded.
+    """
+    with _pillow_errors("hash"):
+        image = PILImage.open(io.BytesIO(data))
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        thumbnail = image.convert("L").resize((hash_size + 1, hash_size), PILImage.Resampling.BILINEAR)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class ImagePipeline:
+    """Thread-pooled image transforms with an LRU cache of results."""
+
+    def __init__(
+        self,
+        defaults: Optional[ImageOptions] = None,
+        max_workers: int = 2,
+        cache_size: int = 64,
+    ):
+        self.defaults = defaults or ImageOptions()
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dex-image")
+        self._cache: OrderedDict[tuple, tuple[bytes, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Last returned capture per tab: key -> (perceptual hash, unix time)
+        self._baselines: OrderedDict[Any, tuple[int, float]] = OrderedDict()
+
+    @property
+    def available(self) -> bool:
+        return PILImage is not None
+
+    @property
+    def can_hash(self) -> bool:
+        return PILImage is not None and np is not None
+
+    async def compare_to_last(self, key: Any, data: bytes, threshold: int) -> tuple[bool, int, Optional[float]]:
+        """Check whether a capture differs from the last one returned for ``key``.
+
+        Returns ``(changed, distance, since)`` where ``distance`` is the number
+        of differing hash bits (0-64) and ``since`` the time the baseline was
+        captured (``None`` when changed). A changed capture becomes the new
+        baseline. Raises ``ImageError`` if the capture can't be decoded.
+        """
+        if not self.can_hash:
+            return True, 64, None
+
+        loop = asyncio.get_running_loop()
+        current = await loop.run_in_executor(self._executor, perceptual_hash, data)
+        baseline = self._baselines.get(key)
+        if baseline:
+            distance = hamming_distance(current, baseline[0])
+            if distance <= threshold:
+                self._baselines.move_to_end(key)
+                return False, distance, baseline[1]
+        else:
+            distance = 64
+
+        self._baselines[key] = (current, time.time())
+        while len(self._baselines) > self.cache_size:
+            self._baselines.popitem(last=False)
+        return True, distance, None
+
+    def resolve(self, overrides: Optional[ImageOptions] = None) -> ImageOptions:
+        """Effective options for a call: configured defaults plus overrides."""
+        return self.defaults.merged_with(overrides) if overrides else self.defaults
+
+    async def process(
+        self,
+        data: bytes,
+        options: ImageOptions,
+        tab_id: Any = None,
+        url: Optional[str] = None,
+    ) -> tuple[bytes, Optional[str]]:
+        """Transform ``data`` off the event loop; returns (bytes, MIME type or None if unchanged).
+
+        Raises ``ImageError`` as ``transform_image`` does.
+        """
+        if options.is_noop() or not self.available:
+            if not self.available and not options.is_noop():
+                logger.warning("Pillow is not installed; returning the capture unprocessed")
+            return data, None
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._process_cached, data, options, tab_id, url)
+
+    def _process_cached(self, data: bytes, options: ImageOptions, tab_id: Any, url: Optional[str]) -> tuple[bytes, str]:
+        key = (tab_id, url, hashlib.sha1(data).hexdigest(), options)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached:
+                self._cache.move_to_end(key)
+                return cached
+
+        processed = transform_image(data, options)
+
+        with self._lock:
+            self._cache[key] = processed
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return processed
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,269 @@
+"""Recorded action sequences that can be replayed for many rows of data.
+
+While a recording is active, every successful action a tool sends is kept
+along with the XPath of the element it targeted (looked up once in the tab's
+cached DOM snapshot). Stopping the recording turns the literal values given
+as parameters into ``{name}`` placeholders, so the same steps can be played
+back for each row of data without the model choosing every step.
+
+Playback sends runs of batchable steps as one ``batch`` message where the
+extension supports it. A step that fails because its element moved is
+retried once after re-resolving the element's XPath against a fresh DOM; the
+new element id is then used for the remaining rows.
+"""
+
+import json
+import os
+import re
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from context import Context
+
+# Actions worth replaying; reads like grab_dom are left out
+RECORDABLE_MESSAGE_TYPES = {
+    "navigate",
+    "click_element",
+    "input_text",
+    "send_keys",
+    "select_tab",
+    "wait_for_selector",
+    "wait_for_navigation",
+    "wait_for_network_idle",
+    "wait_for_text",
+}
+
+# Actions whose tab_id is the tab they act on rather than where they run;
+# playback on a given tab switches to that tab instead
+TAB_TARGET_MESSAGE_TYPES = {"select_tab"}
+
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+@dataclass
+class Macro:
+    name: str
+    parameters: list[str]
+    # {"type": ..., "payload": {...}, "xpath": ...}; xpath only for element actions
+    steps: list[dict]
+    created_at: float = field(default_factory=time.time)
+
+    def copy(self) -> "Macro":
+        """A copy for one run, whose steps playback may update without touching the saved macro."""
+        # Playback replaces a step's payload rather than editing it in place
+        return replace(self, steps=[dict(step) for step in self.steps])
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "parameters": self.parameters,
+            "steps": [step["type"] for step in self.steps],
+        }
+
+
+def _tab_key(tab_id: Optional[int]) -> Any:
+    return tab_id if tab_id is not None else "active"
+
+
+def _parameterize(value: Any, literals: dict[str, str]) -> Any:
+    """Replace recorded literal values with ``{name}`` placeholders."""
+    if isinstance(value, str):
+        for name, literal in literals.items():
+            if literal and literal in value:
+                value = value.replace(literal, "{" + name + "}")
+        return value
+    if isinstance(value, dict):
+        return {key: _parameterize(item, literals) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_parameterize(item, literals) for item in value]
+    return value
+
+
+def fill(value: Any, row: dict[str, Any]) -> Any:
+    """Substitute a row's values into the placeholders of a step."""
+    if isinstance(value, str):
+        return PLACEHOLDER.sub(lambda m: str(row[m.group(1)]) if m.group(1) in row else m.group(0), value)
+    if isinstance(value, dict):
+        return {key: fill(item, row) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, row) for item in value]
+    return value
+
+
+class MacroStore:
+    """Current recording and saved macros, optionally persisted to a JSON file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._macros: dict[str, Macro] = {}
+        self._recording: Optional[dict] = None
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for entry in json.load(f):
+                    self._macros[entry["name"]] = Macro(**entry)
+
+    @property
+    def recording(self) -> Optional[str]:
+        return self._recording["name"] if self._recording else None
+
+    def start(self, name: str):
+        if self._recording:
+            raise ValueError(f"Already recording macro '{self._recording['name']}'")
+        self._recording = {"name": name, "steps": []}
+
+    def observe(self, context: "Context", message_type: str, payload: dict):
+        """Record one successful action if a recording is active."""
+        if not self._recording or message_type not in RECORDABLE_MESSAGE_TYPES:
+            return
+        payload = dict(payload)
+        # Other actions are replayed on whichever tab playback targets
+        tab_id = None if message_type in TAB_TARGET_MESSAGE_TYPES else payload.pop("tab_id", None)
+        step = {"type": message_type, "payload": payload}
+        if "element_id" in payload:
+            snapshot = context.dom_cache.get(_tab_key(tab_id))
+            if snapshot:
+                step["xpath"] = snapshot.highlight_to_xpath.get(str(payload["element_id"]))
+        self._recording["steps"].append(step)
+
+    def stop(self, parameters: Optional[dict[str, str]] = None) -> Macro:
+        """Finish the recording; ``parameters`` maps names to recorded values."""
+        if not self._recording:
+            raise ValueError("No macro is being recorded")
+        recording, self._recording = self._recording, None
+        if not recording["steps"]:
+            raise ValueError(f"Macro '{recording['name']}' recorded no actions")
+
+        parameters = parameters or {}
+        # Longest values first so one value inside another is not split
+        literals = dict(sorted(parameters.items(), key=lambda item: -len(str(item[1]))))
+        steps = [
+            {**step, "payload": _parameterize(step["payload"], {k: str(v) for k, v in literals.items()})}
+            for step in recording["steps"]
+        ]
+        macro = Macro(recording["name"], list(parameters), steps)
+        self._macros[macro.name] = macro
+        self._save()
+        return macro
+
+    def get(self, name: str) -> Optional[Macro]:
+        return self._macros.get(name)
+
+    def list(self) -> list[Macro]:
+        return list(self._macros.values())
+
+    def delete(self, name: str) -> bool:
+        removed = self._macros.pop(name, None) is not None
+        if removed:
+            self._save()
+        return removed
+
+    def _save(self):
+        if self.path:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump([asdict(macro) for macro in self._macros.values()], f, indent=2)
+
+
+async def _resolve_element(context: "Context", xpath: str, tab_id: Optional[int]) -> Optional[str]:
+    """Find the current element id of ``xpath`` from a fresh grab_dom.
+
+    The grab is not stored in ``context.dom_cache``, which holds the snapshot
+    the model's next ``grab_dom`` delta is computed against.
+    """
+    payload = {"tab_id": tab_id} if tab_id is not None else {}
+    result = await context.send_socket_message("grab_dom", payload)
+    if not result or not result.get("success"):
+        return None
+    data = result.get("data") or {}
+    highlight_to_xpath = data.get("highlightToXPath") or {}
+    for element_id, candidate in highlight_to_xpath.items():
+        if candidate == xpath:
+            return element_id
+    return None
+
+
+async def _run_step(
+    context: "Context", step: dict, payload: dict, tab_id: Optional[int], error: Optional[str] = None
+) -> dict:
+    """Send one step; on failure re-resolve its element by XPath and retry once.
+
+    ``error`` is the failure of an attempt already made, e.g. inside a batch.
+    """
+    if error is None:
+        try:
+            result = await context.send_socket_message(step["type"], payload)
+            error = None if result and result.get("success") else (result or {}).get("error", "Unknown error")
+        except Exception as e:
+            error = str(e)
+
+    if error and step.get("xpath"):
+        element_id = await _resolve_element(context, step["xpath"], tab_id)
+        if element_id is not None:
+            # Later rows of this run use the new id straight away
+            step["payload"] = {**step["payload"], "element_id": element_id}
+            try:
+                result = await context.send_socket_message(step["type"], {**payload, "element_id": element_id})
+                error = None if result and result.get("success") else (result or {}).get("error", "Unknown error")
+            except Exception as e:
+                error = str(e)
+
+    return {"type": step["type"], "success": error is None, **({"error": error} if error else {})}
+
+
+async def play(context: "Context", macro: Macro, row: dict[str, Any], tab_id: Optional[int] = None) -> dict:
+    """Run every step of ``macro`` for one row; stops at the first failing step.
+
+    Steps whose element was re-resolved keep the new id in ``macro``, so play
+    a ``Macro.copy()`` to share them between the rows of one run only. With
+    ``tab_id``, every step including recorded tab switches targets that tab.
+    """
+    missing = [name for name in macro.parameters if name not in row]
+    if missing:
+        return {"success": False, "error": f"Missing values for {', '.join(missing)}", "steps": []}
+
+    # Imported here as context.py imports this module
+    from context import BATCHABLE_MESSAGE_TYPES
+
+    use_batch = context.supports("batch", tab_id)
+    results: list[dict] = []
+    index = 0
+    while index < len(macro.steps):
+        # Send a run of batchable steps in one message when the extension can
+        end = index
+        while use_batch and end < len(macro.steps) and macro.steps[end]["type"] in BATCHABLE_MESSAGE_TYPES:
+            end += 1
+
+        failed_error = None
+        if end - index > 1:
+            actions = [
+                {"type": step["type"], "payload": _payload(step, row, tab_id)} for step in macro.steps[index:end]
+            ]
+            for step_result in await context.send_batch(actions, stop_on_error=True):
+                if not step_result.get("success"):
+                    failed_error = step_result.get("error", "Unknown error")
+                    break
+                results.append({"type": step_result.get("type"), "success": True})
+                index += 1
+            if index == end:
+                continue
+
+        # A step that failed inside the batch goes straight to re-validation
+        step = macro.steps[index]
+        step_result = await _run_step(context, step, _payload(step, row, tab_id), tab_id, failed_error)
+        results.append(step_result)
+        if not step_result["success"]:
+            return {"success": False, "error": step_result["error"], "steps": results}
+        index += 1
+
+    return {"success": True, "steps": results}
+
+
+def _payload(step: dict, row: dict[str, Any], tab_id: Optional[int]) -> dict:
+    payload = fill(step["payload"], row)
+    if step.get("xpath"):
+        # Extensions that can target by XPath skip the index lookup entirely
+        payload["xpath"] = step["xpath"]
+    if tab_id is not None:
+        payload["tab_id"] = tab_id
+    return payload
@@ -7,15 +7,21 @@ allowing AI models to perform browser actions like getting tabs, taking screensh
 and navigating to URLs.
 """
 
+import argparse
 import asyncio
+import functools
+import inspect
 import logging
 import signal
 import sys
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 from mcp.server.fastmcp import FastMCP
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
 
 from context import Context
+from result_cache import idempotency_key as use_idempotency_key
 from ws_server import start_websocket_server
 from tools.browser import (
     get_tabs_tool, 
@@ -29,9 +35,23 @@ from tools.browser import (
     input_text_tool,
     send_keys_tool,
     grab_dom_tool,
+    query_elements_tool,
     capture_with_highlights_tool,
+    batch_tool,
+    fill_spreadsheet_tool,
+    parallel_map_tool,
+    wait_for_selector_tool,
+    wait_for_navigation_tool,
+    wait_for_network_idle_tool,
+    wait_for_text_tool,
+    start_macro_recording_tool,
+    stop_macro_recording_tool,
+    list_macros_tool,
+    run_macro_tool,
+    get_debug_logs_tool,
     add_assistant_message_tool
 )
+from tools.results import ToolResult
 
 # Configure logging
 logging.basicConfig(
@@ -46,38 +66,100 @@ context = Context()
 ws_server = None
 
 
+def idempotent(tool):
+    """Give an MCP tool an optional ``idempotency_key`` argument.
+
+    A retried call with the same key gets the stored answers of the messages
+    the first call sent (or waits for them if it is still running) instead of
+    repeating its actions.
+    """
+    @functools.wraps(tool)
+    async def wrapper(*args, idempotency_key: Optional[str] = None, **kwargs):
+        with use_idempotency_key(idempotency_key):
+            return await tool(*args, **kwargs)
+
+    signature = inspect.signature(tool)
+    key = inspect.Parameter(
+        "idempotency_key", inspect.Parameter.KEYWORD_ONLY, default=None, annotation=Optional[str]
+    )
+    wrapper.__signature__ = signature.replace(parameters=[*signature.parameters.values(), key])
+    return wrapper
+
+
+def _image_params(max_width, max_height, format, quality, grayscale, crop) -> Dict[str, Any]:
+    """Collect screenshot post-processing options that were actually set."""
+    params = {
+        "max_width": max_width,
+        "max_height": max_height,
+        "format": format,
+        "quality": quality,
+        "grayscale": grayscale,
+        "crop": crop,
+    }
+    return {key: value for key, value in params.items() if value not in (None, False)}
+
+
 @mcp.tool()
-async def get_tabs() -> str:
-    """Get all open browser tabs."""
-    return await get_tabs_tool(context)
+@idempotent
+async def get_tabs(refresh: bool = False) -> ToolResult:
+    """Get all open browser tabs.
+
+    Served from a locally cached tab list when the extension keeps it current;
+    pass refresh=True to ask the browser directly.
+    """
+    return await get_tabs_tool(context, {"refresh": refresh})
 
 
 @mcp.tool()
-async def screenshot() -> str:
-    """Take a screenshot of the active tab."""
-    return await screenshot_tool(context)
+@idempotent
+async def screenshot(
+    max_width: int = None,
+    max_height: int = None,
+    format: str = None,
+    quality: int = None,
+    grayscale: bool = False,
+    crop: List[int] = None,
+    only_if_changed: bool = False,
+    change_threshold: int = 4,
+) -> ToolResult:
+    """Take a screenshot of the active tab.
+
+    Optionally downscale (max_width/max_height), crop ([left, top, width, height]),
+    convert to grayscale or re-encode (format "png", "jpeg" or "webp" with quality).
+    With only_if_changed, returns a short "unchanged" result instead of the image
+    when the page looks the same as in the last screenshot (within
+    change_threshold of 64 perceptual-hash bits).
+    """
+    params = _image_params(max_width, max_height, format, quality, grayscale, crop)
+    if only_if_changed:
+        params.update(only_if_changed=True, change_threshold=change_threshold)
+    return (await screenshot_tool(context, params)).to_mcp()
 
 
 @mcp.tool()
-async def navigate(url: str) -> str:
+@idempotent
+async def navigate(url: str) -> ToolResult:
     """Navigate to a URL in active tab or specified tab."""
     return await navigate_tool(context, {"url": url})
 
 
 @mcp.tool()
-async def navigate_tab(url: str, tab_id: int) -> str:
+@idempotent
+async def navigate_tab(url: str, tab_id: int) -> ToolResult:
     """Navigate to a URL in a specific tab."""
     return await navigate_tool(context, {"url": url, "tab_id": tab_id})
 
 
 @mcp.tool()
-async def select_tab(tab_id: int) -> str:
+@idempotent
+async def select_tab(tab_id: int) -> ToolResult:
     """Switch to a specific browser tab by ID."""
     return await select_tab_tool(context, {"tab_id": tab_id})
 
 
 @mcp.tool()
-async def new_tab(url: str = None) -> str:
+@idempotent
+async def new_tab(url: str = None) -> ToolResult:
     """Create a new browser tab, optionally with a specific URL."""
     params = {}
     if url:
@@ -86,7 +168,8 @@ async def new_tab(url: str = None) -> str:
 
 
 @mcp.tool()
-async def close_tab(tab_id: int = None) -> str:
+@idempotent
+async def close_tab(tab_id: int = None) -> ToolResult:
     """Close a browser tab by ID, or close the active tab if no ID specified."""
     params = {}
     if tab_id is not None:
@@ -95,7 +178,8 @@ async def close_tab(tab_id: int = None) -> str:
 
 
 @mcp.tool()
-async def search_google(query: str, tab_id: int = None) -> str:
+@idempotent
+async def search_google(query: str, tab_id: int = None) -> ToolResult:
     """Perform a Google search in active tab or specified tab."""
     params = {"query": query}
     if tab_id is not None:
@@ -104,7 +188,8 @@ async def search_google(query: str, tab_id: int = None) -> str:
 
 
 @mcp.tool()
-async def click_element(element_id: str, tab_id: int = None) -> str:
+@idempotent
+async def click_element(element_id: str, tab_id: int = None) -> ToolResult:
     """Click on a DOM element by its ID."""
     params = {"element_id": element_id}
     if tab_id is not None:
@@ -113,7 +198,8 @@ async def click_element(element_id: str, tab_id: int = None) -> str:
 
 
 @mcp.tool()
-async def input_text(element_id: str, text: str, tab_id: int = None) -> str:
+@idempotent
+async def input_text(element_id: str, text: str, tab_id: int = None) -> ToolResult:
     """Type text into a DOM element by its ID."""
     params = {"element_id": element_id, "text": text}
     if tab_id is not None:
@@ -122,7 +208,8 @@ async def input_text(element_id: str, text: str, tab_id: int = None) -> str:
 
 
 @mcp.tool()
-async def send_keys(keys: str, tab_id: int = None) -> str:
+@idempotent
+async def send_keys(keys: str, tab_id: int = None) -> ToolResult:
     """Send keyboard shortcuts or key combinations to the page."""
     params = {"keys": keys}
     if tab_id is not None:
@@ -131,28 +218,241 @@ async def send_keys(keys: str, tab_id: int = None) -> str:
 
 
 @mcp.tool()
-async def grab_dom(tab_id: int = None) -> str:
-    """Get formatted DOM structure with XPath mappings for elements."""
-    params = {}
+@idempotent
+async def grab_dom(tab_id: int = None, mode: str = "full", max_tokens: int = 8000) -> ToolResult:
+    """Get formatted DOM structure with XPath mappings for elements.
+
+    Use mode="delta" to get only the elements added, removed or changed since
+    the last grab_dom on the same tab. Pages larger than max_tokens are pruned:
+    hidden and decorative nodes are dropped and repeated rows are collapsed
+    into a count. Pass max_tokens=0 for the unpruned structure.
+    """
+    params = {"mode": mode}
+    if max_tokens:
+        params["max_tokens"] = max_tokens
     if tab_id is not None:
         params["tab_id"] = tab_id
     return await grab_dom_tool(context, params)
 
 
 @mcp.tool()
-async def capture_with_highlights(tab_id: int = None) -> str:
-    """Take a screenshot with element highlights for better AI understanding."""
-    params = {}
+@idempotent
+async def query_elements(
+    css: str = None,
+    xpath: str = None,
+    text: str = None,
+    role: str = None,
+    limit: int = 20,
+    attributes: List[str] = None,
+    tab_id: int = None,
+) -> ToolResult:
+    """Find elements by CSS selector, XPath, contained text or ARIA role.
+
+    Returns only the matches (XPath, text, bounding box and the requested
+    attributes), so it is much cheaper than grab_dom for locating an element.
+    """
+    params = {"css": css, "xpath": xpath, "text": text, "role": role, "limit": limit, "attributes": attributes}
     if tab_id is not None:
         params["tab_id"] = tab_id
-    return await capture_with_highlights_tool(context, params)
+    return await query_elements_tool(context, params)
+
 
 @mcp.tool()
-async def add_assistant_message(message: str) -> str:
+@idempotent
+async def capture_with_highlights(
+    tab_id: int = None,
+    max_width: int = None,
+    max_height: int = None,
+    format: str = None,
+    quality: int = None,
+    grayscale: bool = False,
+    crop: List[int] = None,
+    only_if_changed: bool = False,
+    change_threshold: int = 4,
+) -> ToolResult:
+    """Take a screenshot with element highlights for better AI understanding.
+
+    Accepts the same post-processing and change-detection options as screenshot.
+    """
+    params = _image_params(max_width, max_height, format, quality, grayscale, crop)
+    if only_if_changed:
+        params.update(only_if_changed=True, change_threshold=change_threshold)
+    if tab_id is not None:
+        params["tab_id"] = tab_id
+    return (await capture_with_highlights_tool(context, params)).to_mcp()
+
+
+@mcp.tool()
+@idempotent
+async def batch(actions: List[Dict[str, Any]], stop_on_error: bool = True) -> ToolResult:
+    """Run several actions (navigate, click_element, input_text, send_keys, grab_dom, query_elements) in order.
+
+    Each action is {"type": "<action>", "params": {...}} with the same params as
+    the individual tool. Returns one result per step.
+    """
+    return await batch_tool(context, {"actions": actions, "stop_on_error": stop_on_error})
+
+
+@mcp.tool()
+@idempotent
+async def fill_spreadsheet(
+    rows: List[List[Any]],
+    start_cell: str = "A1",
+    verify: bool = True,
+    chunk_rows: int = None,
+    tab_id: int = None,
+) -> ToolResult:
+    """Fill a block of cells in the open spreadsheet starting at start_cell (A1 notation,
+    optionally with a sheet name like "Sheet1!B2").
+
+    Much faster than input_text per cell: rows are pasted as TSV in large chunks
+    and each chunk is read back once to verify it.
+    """
+    params = {"rows": rows, "start_cell": start_cell, "verify": verify}
+    if chunk_rows is not None:
+        params["chunk_rows"] = chunk_rows
+    if tab_id is not None:
+        params["tab_id"] = tab_id
+    return await fill_spreadsheet_tool(context, params)
+
+
+@mcp.tool()
+@idempotent
+async def parallel_map(
+    action: str,
+    tab_ids: List[int],
+    params: Dict[str, Any] = None,
+    per_tab_params: List[Dict[str, Any]] = None,
+    max_concurrency: int = 10,
+) -> ToolResult:
+    """Run one action (navigate, click_element, input_text, grab_dom, query_elements, wait_for_*, ...)
+    on several tabs concurrently and get one result per tab.
+
+    params are shared by every tab; per_tab_params, if given, has one dict per
+    tab merged over them (e.g. a different url per tab for navigate).
+    """
+    return await parallel_map_tool(
+        context,
+        {
+            "action": action,
+            "tab_ids": tab_ids,
+            "params": params,
+            "per_tab_params": per_tab_params,
+            "max_concurrency": max_concurrency,
+        },
+    )
+
+
+@mcp.tool()
+@idempotent
+async def wait_for_selector(
+    selector: str, state: str = "visible", timeout: float = 10.0, tab_id: int = None
+) -> ToolResult:
+    """Wait until an element matching a CSS selector is attached, visible, hidden or detached.
+
+    The browser extension does the waiting, so this replaces polling with grab_dom.
+    """
+    params = {"selector": selector, "state": state, "timeout": timeout}
+    if tab_id is not None:
+        params["tab_id"] = tab_id
+    return await wait_for_selector_tool(context, params)
+
+
+@mcp.tool()
+@idempotent
+async def wait_for_navigation(url_contains: str = None, timeout: float = 10.0, tab_id: int = None) -> ToolResult:
+    """Wait until the tab finishes loading a new page, optionally one whose URL contains url_contains."""
+    params = {"url_contains": url_contains, "timeout": timeout}
+    if tab_id is not None:
+        params["tab_id"] = tab_id
+    return await wait_for_navigation_tool(context, params)
+
+
+@mcp.tool()
+@idempotent
+async def wait_for_network_idle(idle_ms: int = 500, timeout: float = 10.0, tab_id: int = None) -> ToolResult:
+    """Wait until the page has made no network requests for idle_ms milliseconds."""
+    params = {"idle_ms": idle_ms, "timeout": timeout}
+    if tab_id is not None:
+        params["tab_id"] = tab_id
+    return await wait_for_network_idle_tool(context, params)
+
+
+@mcp.tool()
+@idempotent
+async def wait_for_text(text: str, selector: str = None, timeout: float = 10.0, tab_id: int = None) -> ToolResult:
+    """Wait until text appears on the page, optionally inside elements matching selector."""
+    params = {"text": text, "selector": selector, "timeout": timeout}
+    if tab_id is not None:
+        params["tab_id"] = tab_id
+    return await wait_for_text_tool(context, params)
+
+
+@mcp.tool()
+@idempotent
+async def start_macro_recording(name: str) -> ToolResult:
+    """Start recording the following successful actions (navigate, click_element, input_text,
+    send_keys, wait_for_*) into a macro that run_macro can replay."""
+    return await start_macro_recording_tool(context, {"name": name})
+
+
+@mcp.tool()
+@idempotent
+async def stop_macro_recording(parameters: Dict[str, str] = None) -> ToolResult:
+    """Save the macro being recorded.
+
+    parameters maps a name to a value typed or visited while recording (e.g.
+    {"email": "ann@example.com"}); that value becomes a placeholder filled from
+    each row when the macro runs.
+    """
+    return await stop_macro_recording_tool(context, {"parameters": parameters})
+
+
+@mcp.tool()
+@idempotent
+async def list_macros() -> ToolResult:
+    """List saved macros with their parameters and steps."""
+    return await list_macros_tool(context)
+
+
+@mcp.tool()
+@idempotent
+async def run_macro(
+    name: str, rows: List[Dict[str, Any]] = None, tab_id: int = None, stop_on_error: bool = False
+) -> ToolResult:
+    """Run a saved macro once per row of parameter values, e.g. rows=[{"email": "a@x.com"}, ...].
+
+    Steps run locally without further model decisions; elements that moved are
+    found again by their recorded XPath.
+    """
+    params = {"name": name, "rows": rows, "stop_on_error": stop_on_error}
+    if tab_id is not None:
+        params["tab_id"] = tab_id
+    return await run_macro_tool(context, params)
+
+
+@mcp.tool()
+@idempotent
+async def get_debug_logs(limit: int = 50, source: str = None, level: str = None, contains: str = None) -> ToolResult:
+    """Read recent debug log lines from the browser extension, optionally filtered."""
+    return await get_debug_logs_tool(
+        context, {"limit": limit, "source": source, "level": level, "contains": contains}
+    )
+
+
+@mcp.tool()
+@idempotent
+async def add_assistant_message(message: str) -> ToolResult:
     """Manually add a message from the assistant to the chat."""
     return await add_assistant_message_tool(context, {"message": message})
 
 
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request) -> PlainTextResponse:
+    """Prometheus scrape endpoint served next to the SSE transport."""
+    return PlainTextResponse(context.metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 async def start_background_services():
     """Start background services like WebSocket server."""
     global ws_server
@@ -181,6 +481,16 @@ async def cleanup():
     logger.info("Shutdown complete")
 
 
+async def serve():
+    """Run the WebSocket bridge and the MCP SSE server on the same event loop."""
+    await start_background_services()
+    try:
+        logger.info("Starting MCP server with SSE transport…")
+        await mcp.run_sse_async()
+    finally:
+        await cleanup()
+
+
 # Set up signal handlers for graceful shutdown
 def setup_signal_handlers():
     def signal_handler(signum, frame):
@@ -192,7 +502,24 @@ def setup_signal_handlers():
     signal.signal(signal.SIGTERM, signal_handler)
 
 
-if __name__ == "__main__":
+def run_single_loop():
+    """Serve both the MCP server and the WebSocket bridge from one event loop.
+
+    Tool calls and extension responses share the loop, so requests never have
+    to hop threads. Uvicorn handles SIGINT/SIGTERM and we clean up afterwards.
+    """
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
+
+
+def run_threaded():
+    """Run the MCP server on its own thread and event loop (legacy mode).
+
+    Requests from the MCP thread are dispatched onto the WebSocket loop by
+    ``Context.send_socket_message``.
+    """
     # Set up signal handlers
     setup_signal_handlers()
     
@@ -233,3 +560,35 @@ if __name__ == "__main__":
         loop.stop()
         loop.close()
 
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dex MCP Server")
+    parser.add_argument(
+        "--threaded",
+        action="store_true",
+        help="Run the MCP server on a separate thread with its own event loop",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="Append every extension response to a JSON lines file for fake_extension.py to replay",
+    )
+    parser.add_argument("--max-in-flight", type=int, help="Extension requests awaiting an answer at once (default 128)")
+    parser.add_argument("--max-per-extension", type=int, help="Requests awaiting an answer per extension (default 64)")
+    parser.add_argument("--max-per-tab", type=int, help="Requests awaiting an answer per tab (default 4)")
+    parser.add_argument("--max-queued", type=int, help="Queued requests before new ones are rejected (default 256)")
+    args = parser.parse_args()
+
+    for option in ("max_in_flight", "max_per_extension", "max_per_tab", "max_queued"):
+        if getattr(args, option) is not None:
+            setattr(context.admission, option, getattr(args, option))
+
+    if args.record:
+        from fake_extension import ResponseRecorder
+
+        context.recorder = ResponseRecorder(args.record)
+
+    if args.threaded:
+        run_threaded()
+    else:
+        run_single_loop()
@@ -0,0 +1,189 @@
+"""Minimal Prometheus-style metrics for the extension bridge.
+
+Only what the bridge needs: labelled counters, gauges and fixed-bucket
+histograms rendered in the Prometheus text exposition format.
+"""
+
+import bisect
+import threading
+from typing import Iterable, Optional
+
+# Seconds, from a fast local click up to the longest request timeout
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Bytes, from a tiny command to a full-page DOM dump or screenshot
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 50 * 1024 ** 2)
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing value."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class BridgeMetrics:
+    """Hot-path timings and counters for requests to the browser extension.
+
+    Each request is split into phases: ``queue`` (from the tool call until the
+    frame is handed to the socket), ``send`` (writing the frame), ``turnaround``
+    (until the response arrives) and ``decode`` (parsing the response frame).
+    """
+
+    def __init__(self):
+        self.phase_seconds = Histogram(
+            "dex_request_phase_seconds", "Time spent in each phase of an extension request", ("type", "phase")
+        )
+        self.requests = Counter(
+            "dex_requests_total", "Extension requests by message type and outcome", ("type", "outcome")
+        )
+        self.in_flight = Gauge("dex_requests_in_flight", "Requests awaiting an extension response")
+        self.timeouts = Counter("dex_request_timeouts_total", "Requests that timed out", ("type",))
+        self.cancellations = Counter(
+            "dex_request_cancellations_total", "Cancel messages sent to extensions", ("type", "reason")
+        )
+        self.replays = Counter(
+            "dex_request_replays_total", "Idempotent requests resent after a disconnect", ("type",)
+        )
+        self.orphaned_responses = Counter(
+            "dex_orphaned_responses_total", "Late responses to timed-out or cancelled requests"
+        )
+        self.payload_bytes = Counter(
+            "dex_payload_bytes_total", "Bytes exchanged with extensions", ("direction",)
+        )
+        self.response_bytes = Histogram(
+            "dex_response_bytes", "Size of extension responses", ("type",), buckets=SIZE_BUCKETS
+        )
+        self.connections = Gauge("dex_extension_connections", "Connected browser extensions")
+        self.reconnects = Counter("dex_extension_reconnects_total", "Extension connections after a disconnect")
+
+        self._metrics = [
+            self.phase_seconds,
+            self.requests,
+            self.in_flight,
+            self.timeouts,
+            self.cancellations,
+            self.replays,
+            self.orphaned_responses,
+            self.payload_bytes,
+            self.response_bytes,
+            self.connections,
+            self.reconnects,
+        ]
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Expose an additional metric on the same endpoint."""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format."""
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,204 @@
+"""Cheap, safe retries: cached read-only results and idempotency keys.
+
+``ResultCache`` keeps successful read-only results keyed by the tab they
+describe, its URL and its DOM version. The DOM version comes from the tab
+index and must be pushed by the extension (``dom_version`` on a tab in
+``tab_event`` messages), so a hit is only possible while the page provably
+has not changed. Every mutating action also drops the cached results of its
+tab.
+
+``IdempotencyStore`` remembers what each message sent under an idempotency
+key returned. A retried tool call with the same key joins the original
+request if it is still running, or gets its stored result, so a retried
+``click_element`` never clicks twice.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Hashable, Iterator, Optional
+
+from metrics import Counter
+
+
+def _canonical(payload: dict) -> str:
+    return json.dumps(payload, sort_keys=True, default=str)
+
+
+class ResultCache:
+    """TTL + LRU cache of read-only extension results."""
+
+    def __init__(self, ttl: float = 30.0, capacity: int = 256):
+        """
+        Args:
+            ttl: Seconds a result is served for, even if the DOM version stays the same.
+            capacity: Results kept; the least recently used are evicted first.
+        """
+        self.ttl = ttl
+        self.capacity = capacity
+        self.lookups = Counter("dex_result_cache_total", "Read-only result cache lookups by outcome", ("outcome",))
+        # key -> (expires_at, tab_id, result)
+        self._entries: OrderedDict[Hashable, tuple[float, Any, dict]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(message_type: str, payload: dict, tab: dict) -> Optional[Hashable]:
+        """Cache key for a request on ``tab``, or ``None`` if its DOM version is unknown."""
+        if tab.get("dom_version") is None:
+            return None
+        return (message_type, tab["id"], tab.get("url"), tab["dom_version"], _canonical(payload))
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.lookups.inc(outcome="miss")
+            return None
+        self._entries.move_to_end(key)
+        self.lookups.inc(outcome="hit")
+        # Callers may add fields to the top level of a result
+        return dict(entry[2])
+
+    def put(self, key: Hashable, tab_id: Any, result: dict):
+        self._entries[key] = (time.monotonic() + self.ttl, tab_id, dict(result))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tab_id: Any = None):
+        """Drop the results of one tab, or of every tab when ``tab_id`` is ``None``."""
+        if tab_id is None:
+            self._entries.clear()
+            return
+        for key in [key for key, entry in self._entries.items() if entry[1] == tab_id]:
+            del self._entries[key]
+
+
+class IdempotencyScope:
+    """The idempotency key of one tool call and the messages sent under it.
+
+    Each message is identified by the key, its type and payload, and how many
+    identical messages the call sent before it, so a retry that sends the same
+    messages maps onto the same entries even when some run concurrently.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._seen: dict[tuple[str, str], int] = {}
+
+    def message_key(self, message_type: str, payload: dict) -> tuple:
+        identity = (message_type, _canonical(payload or {}))
+        occurrence = self._seen.get(identity, 0)
+        self._seen[identity] = occurrence + 1
+        return (self.key, *identity, occurrence)
+
+
+# Scope of the tool call being served, if it carries an idempotency key
+current_scope: ContextVar[Optional[IdempotencyScope]] = ContextVar("idempotency_scope", default=None)
+
+
+@contextmanager
+def idempotency_key(key: Optional[str]) -> Iterator[None]:
+    """Send the messages of the enclosed tool call under ``key``; no-op for ``None``."""
+    if not key:
+        yield
+        return
+    token = current_scope.set(IdempotencyScope(key))
+    try:
+        yield
+    finally:
+        current_scope.reset(token)
+
+
+class IdempotencyStore:
+    """Results of messages sent under idempotency keys, kept for ``ttl`` seconds.
+
+    Only answers from the extension are stored: results, and the exceptions
+    the caller passes as ``answers`` (failures the extension reported), which
+    retries re-raise. A request that got no answer (timeout, lost connection,
+    cancellation) is forgotten, so its retry is sent again.
+    """
+
+    def __init__(self, ttl: float = 600.0, capacity: int = 4096):
+        """
+        Args:
+            ttl: Seconds a stored result answers retries.
+            capacity: Results kept; the least recently used are evicted first.
+        """
+        self.ttl = ttl
+        self.capacity = capacity
+        self.lookups = Counter(
+            "dex_idempotent_requests_total", "Requests sent under an idempotency key by outcome", ("outcome",)
+        )
+        self._running: dict[Hashable, asyncio.Future] = {}
+        # key -> (expires_at, result, exception or None)
+        self._done: OrderedDict[Hashable, tuple[float, Any, Optional[Exception]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._running) + len(self._done)
+
+    async def run(
+        self,
+        key: Hashable,
+        send: Callable[[], Awaitable[Any]],
+        answers: tuple[type[Exception], ...] = (),
+    ) -> Any:
+        """Return the stored or in-flight result for ``key``, or ``send()`` it.
+
+        Exceptions of the ``answers`` types raised by ``send`` are stored and
+        re-raised to retries like results are returned.
+        """
+        done = self._done.get(key)
+        if done is not None:
+            if done[0] >= time.monotonic():
+                self._done.move_to_end(key)
+                self.lookups.inc(outcome="replayed")
+                if done[2] is not None:
+                    raise done[2]
+                return done[1]
+            del self._done[key]
+
+        running = self._running.get(key)
+        if running is not None:
+            self.lookups.inc(outcome="joined")
+            try:
+                # A cancelled retry must not cancel the original request
+                return await asyncio.shield(running)
+            except asyncio.CancelledError:
+                if not running.cancelled():
+                    raise
+            # The original was abandoned before an answer; send it ourselves
+            return await self.run(key, send, answers)
+
+        self.lookups.inc(outcome="sent")
+        future = asyncio.get_running_loop().create_future()
+        self._running[key] = future
+        try:
+            result = await send()
+        except asyncio.CancelledError:
+            del self._running[key]
+            future.cancel()
+            raise
+        except Exception as e:
+            del self._running[key]
+            future.set_exception(e)
+            # Only joined retries re-raise it; don't warn when there are none
+            future.exception()
+            if isinstance(e, answers):
+                self._store(key, None, e)
+            raise
+        del self._running[key]
+        future.set_result(result)
+        self._store(key, result, None)
+        return result
+
+    def _store(self, key: Hashable, result: Any, error: Optional[Exception]):
+        self._done[key] = (time.monotonic() + self.ttl, result, error)
+        while len(self._done) > self.capacity:
+            self._done.popitem(last=False)
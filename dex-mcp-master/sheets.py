@@ -0,0 +1,169 @@
+"""A1 ranges, TSV encoding and chunking for bulk spreadsheet fills.
+
+Pasting tab-separated text into a selected range fills thousands of cells in
+one action, where typing them fills one cell per round trip. Rows are split
+into chunks small enough for a single clipboard paste, and each chunk is read
+back once to check what the sheet actually holds.
+"""
+
+import re
+from typing import Any, Iterator, Optional
+
+# "B2", "Sheet1!B2" or "'My Sheet'!B2"
+CELL = re.compile(r"^(?:(?P<sheet>.+)!)?(?P<column>[A-Za-z]{1,3})(?P<row>[1-9]\d*)$")
+
+# Cells whose text would break a TSV row unless quoted
+NEEDS_QUOTES = re.compile(r'[\t\n\r"]')
+
+
+def column_index(name: str) -> int:
+    """Zero-based index of a column name, e.g. ``"A"`` -> 0, ``"AB"`` -> 27."""
+    index = 0
+    for char in name.upper():
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index - 1
+
+
+def column_name(index: int) -> str:
+    """Column name of a zero-based index, e.g. 27 -> ``"AB"``."""
+    name = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(ord("A") + remainder) + name
+    return name
+
+
+def parse_cell(cell: str) -> tuple[Optional[str], int, int]:
+    """Split an A1 cell reference into ``(sheet, row, column)``, zero-based."""
+    match = CELL.match(cell.strip())
+    if not match:
+        raise ValueError(f"Invalid cell reference '{cell}'")
+    return match.group("sheet"), int(match.group("row")) - 1, column_index(match.group("column"))
+
+
+def a1_range(sheet: Optional[str], row: int, column: int, rows: int, columns: int) -> str:
+    """A1 notation of a ``rows`` x ``columns`` block starting at a zero-based cell."""
+    start = f"{column_name(column)}{row + 1}"
+    end = f"{column_name(column + columns - 1)}{row + rows}"
+    cells = start if start == end else f"{start}:{end}"
+    return f"{sheet}!{cells}" if sheet else cells
+
+
+def cell_text(value: Any) -> str:
+    """How a value is typed into a cell."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def to_tsv(rows: list[list[Any]]) -> str:
+    """Encode rows the way spreadsheets parse pasted text.
+
+    Cells containing tabs, line breaks or quotes are wrapped in quotes with
+    inner quotes doubled, so multi-line text lands in a single cell.
+    """
+    lines = []
+    for row in rows:
+        cells = []
+        for value in row:
+            text = cell_text(value)
+            if NEEDS_QUOTES.search(text):
+                text = '"' + text.replace('"', '""') + '"'
+            cells.append(text)
+        lines.append("\t".join(cells))
+    return "\n".join(lines)
+
+
+def parse_tsv(text: str) -> list[list[str]]:
+    """Decode pasted TSV, the inverse of ``to_tsv``."""
+    rows: list[list[str]] = []
+    row: list[str] = []
+    cell = []
+    index = 0
+    quoted = False
+    while index < len(text):
+        char = text[index]
+        if quoted:
+            if char == '"' and text[index + 1 : index + 2] == '"':
+                cell.append('"')
+                index += 1
+            elif char == '"':
+                quoted = False
+            else:
+                cell.append(char)
+        elif char == '"' and not cell:
+            quoted = True
+        elif char == "\t":
+            row.append("".join(cell))
+            cell = []
+        elif char == "\n":
+            row.append("".join(cell))
+            rows.append(row)
+            row, cell = [], []
+        elif char != "\r":
+            cell.append(char)
+        index += 1
+    row.append("".join(cell))
+    rows.append(row)
+    return rows
+
+
+def chunk_rows(rows: list[list[Any]], max_bytes: int, max_rows: int) -> Iterator[tuple[int, list[list[Any]], str]]:
+    """Split rows into ``(offset, rows, tsv)`` chunks of at most ``max_bytes`` and ``max_rows``.
+
+    A single row larger than ``max_bytes`` still forms its own chunk.
+    """
+    start = 0
+    chunk: list[list[Any]] = []
+    lines: list[str] = []
+    size = 0
+    for index, row in enumerate(rows):
+        line = to_tsv([row])
+        line_size = len(line.encode("utf-8")) + 1
+        if chunk and (size + line_size > max_bytes or len(chunk) >= max_rows):
+            yield start, chunk, "\n".join(lines)
+            start, chunk, lines, size = index, [], [], 0
+        chunk.append(row)
+        lines.append(line)
+        size += line_size
+    if chunk:
+        yield start, chunk, "\n".join(lines)
+
+
+def _same(expected: Any, actual: Any) -> bool:
+    expected_text = cell_text(expected).strip()
+    actual_text = cell_text(actual).strip()
+    if expected_text == actual_text:
+        return True
+    if expected_text.upper() in ("TRUE", "FALSE"):
+        return expected_text.upper() == actual_text.upper()
+    try:
+        # Sheets may reformat numbers, e.g. "1.50" as "1.5"
+        return float(expected_text) == float(actual_text.replace(",", ""))
+    except ValueError:
+        return False
+
+
+def mismatches(
+    expected: list[list[Any]], actual: list[list[Any]], sheet: Optional[str], row: int, column: int
+) -> list[dict]:
+    """Cells whose read-back value differs from what was pasted.
+
+    Read-backs may omit trailing empty cells and rows. Formulas are skipped
+    since the sheet holds their results.
+    """
+    found = []
+    for r, expected_row in enumerate(expected):
+        actual_row = actual[r] if r < len(actual) else []
+        for c, value in enumerate(expected_row):
+            if cell_text(value).startswith("="):
+                continue
+            got = actual_row[c] if c < len(actual_row) else ""
+            if not _same(value, got):
+                found.append({"cell": a1_range(sheet, row + r, column + c, 1, 1), "expected": value, "actual": got})
+    return found
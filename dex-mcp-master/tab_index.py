@@ -0,0 +1,100 @@
+"""In-memory index of open tabs kept current by events the extension pushes.
+
+Extensions advertising the ``tab_events`` capability send a ``tab_event``
+message whenever a tab is created, updated, activated or removed. Once an
+extension's full tab list has been loaded (from a ``snapshot`` event or a
+``get_tabs`` reply) its tabs can be listed and validated without a round trip.
+"""
+
+from typing import Iterable, Optional
+
+TAB_EVENTS = {"snapshot", "created", "updated", "activated", "removed"}
+
+
+class TabIndex:
+    """Open tabs of every connected extension, keyed by tab id."""
+
+    def __init__(self):
+        self._tabs: dict[int, dict] = {}
+        self._owners: dict[int, str] = {}
+        self._active: dict[str, int] = {}
+        # Connections whose full tab list has been loaded
+        self._synced: set[str] = set()
+
+    def __contains__(self, tab_id: int) -> bool:
+        return tab_id in self._tabs
+
+    def __len__(self) -> int:
+        return len(self._tabs)
+
+    def is_synced(self, connection_id: str) -> bool:
+        return connection_id in self._synced
+
+    def replace(self, connection_id: str, tabs: Iterable[dict]):
+        """Load an extension's complete tab list, replacing what was known."""
+        self.forget(connection_id)
+        for tab in tabs:
+            if isinstance(tab, dict) and tab.get("id") is not None:
+                self._put(connection_id, tab)
+        self._synced.add(connection_id)
+
+    def apply(self, connection_id: str, event: str, payload: dict) -> Optional[int]:
+        """Apply one pushed event and return the tab id it concerned.
+
+        ``snapshot`` carries ``tabs``; the other events carry ``tab`` (or just
+        ``tab_id`` for ``activated`` and ``removed``).
+        """
+        if event not in TAB_EVENTS:
+            raise ValueError(f"Unknown tab event '{event}'")
+
+        if event == "snapshot":
+            self.replace(connection_id, payload.get("tabs") or [])
+            return None
+
+        tab = payload.get("tab") or {}
+        tab_id = tab.get("id", payload.get("tab_id"))
+        if tab_id is None:
+            raise ValueError(f"Tab event '{event}' without a tab id")
+
+        if event == "removed":
+            self._tabs.pop(tab_id, None)
+            self._owners.pop(tab_id, None)
+            if self._active.get(connection_id) == tab_id:
+                del self._active[connection_id]
+        elif event == "activated":
+            if tab_id in self._tabs or tab:
+                self._put(connection_id, {"id": tab_id, **tab})
+            self._active[connection_id] = tab_id
+        else:
+            self._put(connection_id, tab)
+        return tab_id
+
+    def _put(self, connection_id: str, tab: dict):
+        tab_id = tab["id"]
+        current = self._tabs.get(tab_id, {})
+        self._tabs[tab_id] = {**current, **tab}
+        self._owners[tab_id] = connection_id
+        if tab.get("active"):
+            self._active[connection_id] = tab_id
+
+    def forget(self, connection_id: str):
+        """Drop every tab of an extension, e.g. when it disconnects."""
+        for tab_id in [tab_id for tab_id, owner in self._owners.items() if owner == connection_id]:
+            del self._tabs[tab_id]
+            del self._owners[tab_id]
+        self._active.pop(connection_id, None)
+        self._synced.discard(connection_id)
+
+    def get(self, tab_id: int) -> Optional[dict]:
+        return self._tabs.get(tab_id)
+
+    def owner_of(self, tab_id: int) -> Optional[str]:
+        return self._owners.get(tab_id)
+
+    def active_tab(self, connection_id: str) -> Optional[int]:
+        return self._active.get(connection_id)
+
+    def list(self) -> list[dict]:
+        """All known tabs, with ``active`` set on each extension's active tab."""
+        active = set(self._active.values())
+        return [{**tab, "active": tab_id in active} for tab_id, tab in self._tabs.items()]
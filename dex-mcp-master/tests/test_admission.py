@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from admission import AdmissionControl, OverloadedError
+from context import Context
+from ws_server import start_websocket_server
+
+
+def test_admit_rejects_when_queue_is_full_and_leave_frees_a_place():
+    admission = AdmissionControl(max_queued=2)
+    admission.admit("click_element")
+    admission.admit("click_element")
+    with pytest.raises(OverloadedError) as excinfo:
+        admission.admit("grab_dom")
+    assert excinfo.value.retry_after > 0
+    admission.leave()
+    admission.admit("grab_dom")
+    assert admission.queued.value() == 2
+
+
+def test_interactive_requests_overtake_bulk_until_bulk_has_aged():
+    async def scenario(aging):
+        admission = AdmissionControl(max_in_flight=1, aging=aging)
+        order = []
+
+        async def request(message_type):
+            admission.admit(message_type)
+            async with admission.slot(message_type, "ext", None):
+                order.append(message_type)
+                await asyncio.sleep(0)
+            admission.leave()
+
+        blocker = await admission.acquire("navigate", "ext", None)
+        bulk = asyncio.create_task(request("grab_dom"))
+        await asyncio.sleep(0.05)
+        click = asyncio.create_task(request("click_element"))
+        await asyncio.sleep(0)
+        admission.release("ext", None, blocker)
+        await asyncio.gather(bulk, click)
+        return order
+
+    assert asyncio.run(scenario(aging=60.0)) == ["click_element", "grab_dom"]
+    # Waiting 50ms at 10ms per level lifts grab_dom past the click
+    assert asyncio.run(scenario(aging=0.01)) == ["grab_dom", "click_element"]
+
+
+def test_per_tab_limit_does_not_hold_up_other_tabs():
+    async def scenario():
+        admission = AdmissionControl(max_per_tab=1)
+        first = await admission.acquire("click_element", "ext", 1)
+        same_tab = asyncio.create_task(admission.acquire("click_element", "ext", 1))
+        other_tab = asyncio.create_task(admission.acquire("click_element", "ext", 2))
+        await asyncio.sleep(0.01)
+        assert not same_tab.done() and other_tab.done()
+        admission.release("ext", 1, first)
+        await asyncio.wait_for(same_tab, 1)
+        admission.release("ext", 1, same_tab.result())
+        admission.release("ext", 2, other_tab.result())
+        assert admission.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        admission = AdmissionControl(max_in_flight=1)
+        held = await admission.acquire("grab_dom", "ext", None)
+        cancelled = asyncio.create_task(admission.acquire("grab_dom", "ext", None))
+        waiting = asyncio.create_task(admission.acquire("grab_dom", "ext", None))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        assert cancelled.cancelled()
+        admission.release("ext", None, held)
+        await asyncio.wait_for(waiting, 1)
+        assert admission.in_flight == 1 and not admission._waiters
+        admission.release("ext", None, waiting.result())
+        assert admission.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+async def streaming_extension(url: str, release: asyncio.Event):
+    """Answer grab_dom with one part, then the final response once ``release`` is set."""
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({"type": "hello", "payload": {"capabilities": []}}))
+        async for frame in ws:
+            message = json.loads(frame)
+            if message.get("type") == "grab_dom":
+                await ws.send(json.dumps({"id": message["id"], "chunk": {"part": 1}}))
+                await release.wait()
+                await ws.send(json.dumps({"id": message["id"], "result": {"success": True}}))
+
+
+@pytest.mark.parametrize("read_to_end", [True, False])
+def test_streamed_requests_hold_an_admission_slot(read_to_end):
+    async def scenario():
+        context = Context(reconnect_grace=5, admission=AdmissionControl())
+        server = await start_websocket_server(context, port=0)
+        port = server.sockets[0].getsockname()[1]
+        release = asyncio.Event()
+        extension = asyncio.create_task(streaming_extension(f"ws://127.0.0.1:{port}", release))
+        try:
+            async with context.stream_socket_message("grab_dom", {"tab_id": 1}) as stream:
+                assert await stream.__anext__() == {"part": 1}
+                assert context.admission.in_flight == 1
+                if read_to_end:
+                    release.set()
+                    assert [chunk async for chunk in stream] == []
+                    assert stream.result == {"success": True}
+            assert context.admission.in_flight == 0
+            assert context.admission.queued.value() == 0
+        finally:
+            extension.cancel()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_streamed_request_is_rejected_when_overloaded():
+    async def scenario():
+        context = Context(reconnect_grace=0, admission=AdmissionControl(max_queued=0))
+        with pytest.raises(OverloadedError):
+            async with context.stream_socket_message("grab_dom", {"tab_id": 1}) as stream:
+                await stream.__anext__()
+        assert context.admission.queued.value() == 0
+
+    asyncio.run(scenario())
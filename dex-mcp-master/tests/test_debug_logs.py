@@ -0,0 +1,68 @@
+import logging
+import threading
+import time
+
+from debug_logs import DebugLogSink
+
+
+class ThreadRecorder(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+        self.lines = []
+
+    def emit(self, record):
+        self.threads.append(threading.current_thread())
+        self.lines.append(self.format(record))
+
+
+def test_records_are_built_and_written_on_the_listener_thread():
+    recorder = ThreadRecorder()
+    sink = DebugLogSink(handlers=[recorder])
+    try:
+        assert sink.submit("ext-1", {"level": "warn", "message": "slow frame", "source": "content"})
+    finally:
+        sink.stop()
+    assert recorder.lines == ["[DEBUG_LOG content] slow frame"]
+    assert recorder.threads[0] is not threading.current_thread()
+    [entry] = sink.query()
+    assert entry["source"] == "content" and entry["level"] == "warning" and entry["message"] == "slow frame"
+
+
+def test_rate_limit_applies_per_connection_whatever_the_source():
+    sink = DebugLogSink(rate_per_connection=0.001, burst_per_connection=5.0, handlers=[])
+    try:
+        kept = [sink.submit("ext-1", {"source": f"worker-{index}", "message": "hi"}) for index in range(50)]
+        assert kept.count(True) == 5
+        assert sink.submit("ext-2", {"source": "worker-0", "message": "hi"})
+        assert sink.dropped()["rate_limited"] == 45
+    finally:
+        sink.stop()
+
+
+def test_only_refilled_buckets_are_forgotten():
+    sink = DebugLogSink(rate_per_connection=1000.0, burst_per_connection=1.0, handlers=[])
+    try:
+        for index in range(50):
+            sink.submit(f"ext-{index}", {"message": "hi"})
+        # Every bucket refills within a millisecond
+        time.sleep(0.01)
+        sink._bucket("ext-0")
+        assert list(sink._buckets) == ["ext-0"]
+
+        throttled = DebugLogSink(rate_per_connection=0.001, burst_per_connection=1.0, handlers=[])
+        for index in range(50):
+            throttled.submit(f"ext-{index}", {"message": "hi"})
+        assert len(throttled._buckets) == 50
+        throttled.stop()
+    finally:
+        sink.stop()
+
+
+def test_lines_are_dropped_while_the_queue_is_full():
+    sink = DebugLogSink(handlers=[], max_queued=3)
+    # Not started, so nothing drains the queue
+    sink.start = lambda: None
+    kept = [sink.submit("ext-1", {"message": f"line {index}"}) for index in range(5)]
+    assert kept == [True, True, True, False, False]
+    assert sink.dropped()["queue_full"] == 2
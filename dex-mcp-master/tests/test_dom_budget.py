@@ -0,0 +1,73 @@
+import re
+
+from dom_budget import LINE, cut_lines, dedupe_attributes, estimate_tokens, prune_dom, shorten_lines, split_legend
+
+STYLE = 'class="btn btn-primary btn-large shadow-sm rounded-pill"'
+FORM = 'class="form-control form-control-lg border-secondary"'
+
+
+def page(sections: int = 60) -> tuple[str, dict[str, str]]:
+    """Varied sections so repeats don't collapse, with long shared attributes to dedupe."""
+    lines = []
+    xpaths = {}
+    index = 0
+    for section in range(sections):
+        lines.append(f'<section id="s{section}">')
+        lines.append(f"  <h2>Section {section} heading with some descriptive text</h2>")
+        lines.append(f'  <div aria-hidden="true">hidden {section}</div>')
+        for tag, style in (("button", STYLE), ("input", FORM), ("a" * (section % 5 + 1), STYLE)):
+            lines.append(f"  [{index}]<{tag} {style} name=\"field{section}\">Item {section}</{tag}>")
+            xpaths[str(index)] = f"/html/body/section[{section + 1}]/{tag}[1]"
+            index += 1
+        lines.append(f"  <p>Paragraph {section} " + "lorem ipsum " * (section % 7 + 1) + "</p>")
+    return "\n".join(lines), xpaths
+
+
+def references_resolve(lines: list[str]) -> bool:
+    legend, body = split_legend(lines)
+    used = {ref for line in body for ref in re.findall(r"&\d+(?!\d)", line)}
+    return used <= set(legend) and set(legend) <= used
+
+
+def test_same_input_and_budget_give_the_same_output():
+    text, xpaths = page()
+    first = prune_dom(text, xpaths, 600)
+    second = prune_dom(text, xpaths, 600)
+    assert first.text == second.text and first.highlight_to_xpath == second.highlight_to_xpath
+    assert first.passes == second.passes
+
+
+def test_result_fits_the_budget_and_keeps_xpaths_of_shown_elements():
+    text, xpaths = page()
+    for max_tokens in (2000, 600, 150):
+        pruned = prune_dom(text, xpaths, max_tokens)
+        assert pruned.tokens <= max_tokens
+        assert estimate_tokens(pruned.text) == pruned.tokens
+        shown = {LINE.match(line).group("index") for line in pruned.text.splitlines()} - {None}
+        assert set(pruned.highlight_to_xpath) == shown
+        assert all(pruned.highlight_to_xpath[index] == xpaths[index] for index in shown)
+        assert references_resolve(pruned.text.splitlines())
+    assert "cut_lines" in prune_dom(text, xpaths, 150).passes
+
+
+def test_cut_lines_keeps_the_legend_entries_kept_lines_use():
+    text, _ = page(20)
+    lines = dedupe_attributes(text.splitlines())
+    legend, _ = split_legend(lines)
+    assert len(legend) == 2
+    # Interactive lines are preferred over the rest
+    kept, _ = cut_lines(lines, 300)
+    assert all(LINE.match(line).group("index") is not None for line in split_legend(kept)[1][:-1])
+    for budget in (200, 400, 1000):
+        kept, cut = cut_lines(lines, budget)
+        assert cut
+        assert sum(len(line) + 1 for line in kept) <= budget
+        assert references_resolve(kept[:-1])
+
+
+def test_shorten_lines_keeps_the_legend_whole_and_references_intact():
+    legend = "&12 = " + 'class="' + "x" * 200 + '"'
+    line = "[1]<div " + "y" * 40 + " &12 z>"
+    shortened = shorten_lines([legend, line], max_length=len("[1]<div " + "y" * 40 + " &1"))
+    assert shortened[0] == legend
+    assert shortened[1] == "[1]<div " + "y" * 40 + " ..."
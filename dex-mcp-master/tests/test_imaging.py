@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import io
+from types import SimpleNamespace
+
+import pytest
+
+PIL = pytest.importorskip("PIL.Image")
+
+from imaging import CropError, ImageError, ImageOptions, ImagePipeline, perceptual_hash, transform_image
+from tools import browser
+from tools.results import ACTION_FAILED, INVALID_PARAMS, ToolResult
+
+
+def png(width=40, height=30) -> bytes:
+    output = io.BytesIO()
+    PIL.new("RGB", (width, height), (200, 10, 10)).save(output, format="PNG")
+    return output.getvalue()
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"format": "gif"},
+        {"quality": 0},
+        {"quality": 101},
+        {"crop": [0, 0, 0, 10]},
+        {"crop": [-1, 0, 10, 10]},
+        {"crop": [0, 0, 10]},
+        {"max_width": -5},
+        {"change_threshold": 65},
+    ],
+)
+def test_invalid_params_are_rejected_before_capturing(params):
+    result = browser._check_image_params(params)
+    assert result is not None and result.error_code == INVALID_PARAMS
+
+
+def test_valid_params_pass():
+    assert browser._check_image_params({"format": "jpg", "quality": 80, "crop": [0, 0, 10, 10]}) is None
+    assert browser._check_image_params(None) is None
+
+
+def test_crop_past_the_edges_raises_crop_error():
+    with pytest.raises(CropError):
+        transform_image(png(), ImageOptions(crop=(30, 0, 20, 10)))
+    data, mime_type = transform_image(png(), ImageOptions(crop=(20, 0, 20, 10)))
+    assert mime_type == "image/png" and PIL.open(io.BytesIO(data)).size == (20, 10)
+
+
+def test_undecodable_capture_raises_image_error():
+    with pytest.raises(ImageError):
+        transform_image(b"not an image", ImageOptions(format="jpeg"))
+    with pytest.raises(ImageError):
+        transform_image(png()[:60], ImageOptions(format="jpeg"))
+    with pytest.raises(ImageError):
+        perceptual_hash(b"not an image")
+
+
+def capture_context(data_url: str) -> SimpleNamespace:
+    async def run_action(*args, **kwargs):
+        return ToolResult(success=True, message="Screenshot captured", action="screenshot"), {"data": data_url}
+
+    return SimpleNamespace(images=ImagePipeline(), run_action=run_action)
+
+
+@pytest.mark.parametrize(
+    "data_url, params, error_code",
+    [
+        ("data:image/png;base64,bm90IGFuIGltYWdl", {"format": "jpeg"}, ACTION_FAILED),
+        ("data:image/png;base64,!!!", {"format": "jpeg"}, ACTION_FAILED),
+        ("data:image/png;base64,bm90IGFuIGltYWdl", {"only_if_changed": True}, ACTION_FAILED),
+        ("data:image/png;base64," + base64.b64encode(png()).decode(), {"crop": [0, 0, 100, 10]}, INVALID_PARAMS),
+    ],
+)
+def test_screenshot_returns_failure_for_bad_captures(monkeypatch, data_url, params, error_code):
+    context = capture_context(data_url)
+    monkeypatch.setattr(browser, "_run_action", context.run_action)
+    result = asyncio.run(browser.screenshot_tool(context, params))
+    assert not result.success and result.error_code == error_code
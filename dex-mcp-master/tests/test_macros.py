@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+from dom_cache import DomCache
+from macros import MacroStore, play
+from tools.browser import run_macro_tool
+
+
+class ScriptedContext(SimpleNamespace):
+    """Records sent messages; clicks on element "7" fail as if it had moved."""
+
+    def __init__(self):
+        super().__init__(dom_cache=DomCache(), sent=[])
+
+    def supports(self, capability, tab_id=None):
+        return False
+
+    async def send_socket_message(self, message_type, payload=None):
+        self.sent.append((message_type, payload))
+        if message_type == "grab_dom":
+            return {"success": True, "data": {"highlightToXPath": {"9": "/html/body/button"}}}
+        if payload.get("element_id") == "7":
+            return {"success": False, "error": "Element not found"}
+        return {"success": True}
+
+
+def test_select_tab_keeps_its_recorded_tab_unless_playback_targets_one():
+    context = ScriptedContext()
+    macros = MacroStore()
+    macros.start("switch")
+    macros.observe(context, "select_tab", {"tab_id": 3})
+    macros.observe(context, "input_text", {"tab_id": 3, "element_id": "2", "text": "Ada"})
+    macro = macros.stop({"name": "Ada"})
+    assert macro.steps[0]["payload"] == {"tab_id": 3}
+    assert "tab_id" not in macro.steps[1]["payload"]
+
+    assert asyncio.run(play(context, macro, {"name": "Grace"}))["success"]
+    assert context.sent == [
+        ("select_tab", {"tab_id": 3}),
+        ("input_text", {"element_id": "2", "text": "Grace"}),
+    ]
+
+    context.sent.clear()
+    assert asyncio.run(play(context, macro, {"name": "Grace"}, tab_id=5))["success"]
+    assert context.sent == [
+        ("select_tab", {"tab_id": 5}),
+        ("input_text", {"element_id": "2", "text": "Grace", "tab_id": 5}),
+    ]
+
+
+def test_re_resolving_an_element_leaves_the_dom_cache_alone():
+    context = ScriptedContext()
+    baseline = context.dom_cache.store("active", {"1": "<button>"}, {"7": "/html/body/button"}, "v1")
+    macros = MacroStore()
+    macros.start("click")
+    macros.observe(context, "click_element", {"element_id": "7"})
+    macro = macros.stop()
+
+    result = asyncio.run(play(context, macro, {}))
+    assert result["success"]
+    assert context.sent[-1] == ("click_element", {"element_id": "9", "xpath": "/html/body/button"})
+    assert context.dom_cache.get("active") is baseline
+
+
+def test_re_resolved_ids_stay_within_one_run():
+    context = ScriptedContext()
+    context.dom_cache.store("active", {"1": "<button>"}, {"7": "/html/body/button"}, "v1")
+    context.macros = MacroStore()
+    context.macros.start("click")
+    context.macros.observe(context, "click_element", {"element_id": "7"})
+    context.macros.stop()
+
+    result = asyncio.run(run_macro_tool(context, {"name": "click", "rows": [{}, {}]}))
+    assert result.success
+    # The second row reuses the id found in the first without another grab_dom
+    assert [message_type for message_type, _ in context.sent] == [
+        "click_element",
+        "grab_dom",
+        "click_element",
+        "click_element",
+    ]
+    assert context.macros.get("click").steps[0]["payload"] == {"element_id": "7"}
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from tools import browser
+from tools.results import INVALID_PARAMS, ToolResult
+
+
+@pytest.mark.parametrize(
+    "params, error",
+    [
+        ({"tab_ids": 3}, "tab_ids"),
+        ({"tab_ids": [1, 2], "per_tab_params": [{}, 5]}, "per_tab_params"),
+        ({"tab_ids": [1, 2], "per_tab_params": {"1": {}}}, "per_tab_params"),
+        ({"tab_ids": [1], "params": ["url"]}, "params"),
+        ({"tab_ids": [1], "max_concurrency": True}, "max_concurrency"),
+    ],
+)
+def test_malformed_fan_out_is_rejected_before_any_call(monkeypatch, params, error):
+    calls = []
+
+    async def navigate(context, params):
+        calls.append(params)
+        return ToolResult(success=True, message="ok", action="navigate")
+
+    monkeypatch.setitem(browser.PARALLEL_ACTIONS, "navigate", navigate)
+    result = asyncio.run(browser.parallel_map_tool(None, {"action": "navigate", **params}))
+    assert result.error_code == INVALID_PARAMS and error in result.message
+    assert calls == []
+
+
+def test_per_tab_params_are_merged_over_shared_params(monkeypatch):
+    async def navigate(context, params):
+        return ToolResult(success=True, message="ok", action="navigate", data=params)
+
+    monkeypatch.setitem(browser.PARALLEL_ACTIONS, "navigate", navigate)
+    result = asyncio.run(
+        browser.parallel_map_tool(
+            None,
+            {
+                "action": "navigate",
+                "tab_ids": [1, 2],
+                "params": {"url": "https://example.com"},
+                "per_tab_params": [None, {"url": "https://example.org"}],
+            },
+        )
+    )
+    assert result.success
+    assert [entry["data"] for entry in result.data] == [
+        {"url": "https://example.com", "tab_id": 1},
+        {"url": "https://example.org", "tab_id": 2},
+    ]
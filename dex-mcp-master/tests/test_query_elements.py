@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+
+from dom_cache import DomCache
+from fake_extension import _synthetic_dom
+from tools import browser
+from tools.results import ToolResult
+
+
+def test_grab_dom_fallback_leaves_the_delta_baseline_alone(monkeypatch):
+    async def run_action(context, message_type, payload, done, failed, **kwargs):
+        assert message_type == "grab_dom"
+        result = {"success": True, "data": _synthetic_dom(30)}
+        return ToolResult(success=True, message=done, action=message_type, data=result["data"]), result
+
+    context = SimpleNamespace(dom_cache=DomCache(), supports=lambda capability, tab_id=None: False)
+    baseline = context.dom_cache.store("active", {}, {}, "v1")
+    monkeypatch.setattr(browser, "_run_action", run_action)
+
+    result = asyncio.run(browser.query_elements_tool(context, {"text": "Contact 2", "limit": 5}))
+    assert result.success and result.data["total"] == 11
+    assert context.dom_cache.get("active") is baseline
+
+
+def test_grab_dom_fallback_says_attributes_were_not_applied(monkeypatch):
+    async def run_action(context, message_type, payload, done, failed, **kwargs):
+        data = _synthetic_dom(3)
+        return ToolResult(success=True, message=done, action=message_type, data=data), {"data": data}
+
+    context = SimpleNamespace(dom_cache=DomCache(), supports=lambda capability, tab_id=None: False)
+    monkeypatch.setattr(browser, "_run_action", run_action)
+
+    result = asyncio.run(
+        browser.query_elements_tool(context, {"text": "Contact 1", "attributes": ["aria-label"]})
+    )
+    assert result.success
+    assert result.data["source"] == "grab_dom"
+    assert [set(element) for element in result.data["elements"]] == [{"xpath", "text"}]
+    assert "attributes" in result.message and "query_elements capability" in result.message
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+import pytest
+
+from context import Context, ExtensionReportedError, ExtensionTimeoutError
+from fake_extension import FakeExtension
+from result_cache import IdempotencyStore
+from ws_server import start_websocket_server
+
+
+class Sender:
+    """Counts sends; each one waits for ``release`` and then returns or raises ``outcome``."""
+
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+def test_retry_joins_the_request_in_flight():
+    async def scenario():
+        store = IdempotencyStore()
+        send = Sender({"success": True})
+        first = asyncio.create_task(store.run("key", send))
+        retry = asyncio.create_task(store.run("key", send))
+        await asyncio.sleep(0)
+        send.release.set()
+        assert await first == await retry == {"success": True}
+        assert send.calls == 1
+        assert store.lookups.value(outcome="joined") == 1
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_completion_replays_the_result():
+    async def scenario():
+        store = IdempotencyStore()
+        send = Sender({"success": True, "clicked": 1})
+        send.release.set()
+        assert await store.run("key", send) == await store.run("key", send)
+        assert send.calls == 1
+        assert store.lookups.value(outcome="replayed") == 1
+
+    asyncio.run(scenario())
+
+
+def test_reported_failures_are_replayed_and_unanswered_requests_resent():
+    async def scenario():
+        store = IdempotencyStore()
+        reported = Sender(ExtensionReportedError("Browser extension error: Element not found"))
+        reported.release.set()
+        for _ in range(2):
+            with pytest.raises(ExtensionReportedError, match="Element not found"):
+                await store.run("reported", reported, answers=(ExtensionReportedError,))
+        assert reported.calls == 1
+
+        timed_out = Sender(ExtensionTimeoutError("Timeout"))
+        timed_out.release.set()
+        for _ in range(2):
+            with pytest.raises(ExtensionTimeoutError):
+                await store.run("timed out", timed_out, answers=(ExtensionReportedError,))
+        assert timed_out.calls == 2
+
+    asyncio.run(scenario())
+
+
+async def connect(extension: FakeExtension) -> tuple[Context, object, asyncio.Task]:
+    context = Context(reconnect_grace=5)
+    server = await start_websocket_server(context, port=0)
+    extension.url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    connected = asyncio.Event()
+    task = asyncio.create_task(extension.run(connected))
+    await connected.wait()
+    while not context.tabs.get(1):
+        await asyncio.sleep(0.01)
+    return context, server, task
+
+
+async def push_tab(context: Context, extension: FakeExtension, **changes):
+    """Push an ``updated`` event for tab 1 and wait until the index has it."""
+    await extension._ws.send(json.dumps({"type": "tab_event", "payload": {"event": "updated", "tab": {"id": 1, **changes}}}))
+    while any(context.tabs.get(1).get(name) != value for name, value in changes.items()):
+        await asyncio.sleep(0.01)
+
+
+def test_result_cache_follows_dom_version_url_and_actions():
+    async def scenario():
+        extension = FakeExtension(capabilities=["tab_events"], tabs=2)
+        extension.tabs[0]["dom_version"] = 1
+        context, server, task = await connect(extension)
+
+        async def grab():
+            await context.send_socket_message("grab_dom", {"tab_id": 1})
+            return extension.requests
+
+        try:
+            sent = await grab()
+            assert await grab() == sent
+            await push_tab(context, extension, dom_version=2)
+            assert await grab() == sent + 1
+            assert await grab() == sent + 1
+            await push_tab(context, extension, url="https://example.com/other")
+            assert await grab() == sent + 2
+            await context.send_socket_message("click_element", {"tab_id": 1, "element_id": "1"})
+            assert await grab() == sent + 4
+            # Another tab's actions leave tab 1's results alone
+            await context.send_socket_message("click_element", {"tab_id": 2, "element_id": "1"})
+            assert await grab() == sent + 5
+        finally:
+            task.cancel()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(scenario())
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from sheets import a1_range, chunk_rows, column_index, column_name, mismatches, parse_cell, parse_tsv, to_tsv
+from tools import browser
+from tools.results import INVALID_PARAMS
+
+
+@pytest.mark.parametrize(
+    "cell, expected",
+    [
+        ("A1", (None, 0, 0)),
+        ("b2", (None, 1, 1)),
+        ("AB10", (None, 9, 27)),
+        ("Sheet1!C3", ("Sheet1", 2, 2)),
+        ("'My Sheet'!A1", ("'My Sheet'", 0, 0)),
+    ],
+)
+def test_parse_cell(cell, expected):
+    assert parse_cell(cell) == expected
+
+
+@pytest.mark.parametrize("cell", ["", "A0", "1A", "ABCD1", "A1:B2"])
+def test_parse_cell_rejects_invalid_references(cell):
+    with pytest.raises(ValueError):
+        parse_cell(cell)
+
+
+def test_column_names_round_trip():
+    for index in (0, 25, 26, 27, 701, 702, 16383):
+        assert column_index(column_name(index)) == index
+    assert column_name(27) == "AB"
+
+
+def test_a1_range():
+    assert a1_range(None, 0, 0, 1, 1) == "A1"
+    assert a1_range(None, 1, 1, 3, 2) == "B2:C4"
+    assert a1_range("Sheet1", 0, 25, 2, 2) == "Sheet1!Z1:AA2"
+
+
+def test_tsv_round_trip():
+    rows = [
+        ["Name", "Note", "Score"],
+        ["Ann", 'says "hi"', 4],
+        ["Bob", "line one\nline two", 2.0],
+        ["Tab\there", "", True],
+        [None, "plain", "=SUM(C2:C3)"],
+    ]
+    tsv = to_tsv(rows)
+    assert tsv.splitlines()[1] == 'Ann\t"says ""hi"""\t4'
+    assert parse_tsv(tsv) == [
+        ["Name", "Note", "Score"],
+        ["Ann", 'says "hi"', "4"],
+        ["Bob", "line one\nline two", "2"],
+        ["Tab\there", "", "TRUE"],
+        ["", "plain", "=SUM(C2:C3)"],
+    ]
+
+
+def test_chunk_rows_respects_byte_and_row_limits():
+    rows = [[f"row {i}", "x" * 10] for i in range(100)]
+    chunks = list(chunk_rows(rows, max_bytes=200, max_rows=7))
+    assert [row for _, chunk, _ in chunks for row in chunk] == rows
+    offset = 0
+    for start, chunk, tsv in chunks:
+        assert start == offset
+        assert len(chunk) <= 7
+        assert len(tsv.encode("utf-8")) + 1 <= 200
+        assert parse_tsv(tsv) == [[str(cell) for cell in row] for row in chunk]
+        offset += len(chunk)
+
+
+def test_oversized_row_forms_its_own_chunk():
+    rows = [["a"], ["b" * 500], ["c"]]
+    assert [chunk for _, chunk, _ in chunk_rows(rows, max_bytes=100, max_rows=10)] == [[["a"]], [["b" * 500]], [["c"]]]
+
+
+def test_mismatches():
+    expected = [["Ann", 1.5, True, "=A1"], ["Bob", 1000, "", "x"]]
+    actual = [["Ann", "1.50", "true", "42"], ["Bob", "1,000"]]
+    assert mismatches(expected, actual, "Sheet1", 4, 1) == [
+        {"cell": "Sheet1!E6", "expected": "x", "actual": ""},
+    ]
+    assert mismatches([["a"], ["b"]], [["a"]], None, 0, 0) == [{"cell": "A2", "expected": "b", "actual": ""}]
+
+
+@pytest.mark.parametrize(
+    "params, error",
+    [
+        ({"retries": -1}, "retries"),
+        ({"retries": "2"}, "retries"),
+        ({"retries": True}, "retries"),
+        ({"chunk_bytes": 0}, "chunk_bytes"),
+        ({"chunk_rows": -5}, "chunk_rows"),
+        ({"chunk_rows": 2.5}, "chunk_rows"),
+        ({"verify": "no"}, "verify"),
+    ],
+)
+def test_fill_spreadsheet_rejects_invalid_options(params, error):
+    result = asyncio.run(browser.fill_spreadsheet_tool(None, {"rows": [["a"]], **params}))
+    assert result.error_code == INVALID_PARAMS and error in result.message
@@ -0,0 +1,147 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+import websockets
+
+from context import STREAM_MAX_UNREAD, STREAM_WINDOW, Context, ExtensionError
+from dom_cache import DomCache
+from tools.browser import grab_dom_tool
+from tools.results import INVALID_PARAMS
+from ws_server import start_websocket_server
+
+
+class StreamingExtension:
+    """Streams ``parts`` grab_dom parts, honouring the window unless ``greedy``."""
+
+    def __init__(self, parts: int, greedy: bool = False):
+        self.parts = parts
+        self.greedy = greedy
+        self.acknowledged = 0
+        self.cancelled = []
+        self._credit = asyncio.Condition()
+
+    async def run(self, url: str):
+        async with websockets.connect(url) as ws:
+            await ws.send(json.dumps({"type": "hello", "payload": {"capabilities": ["stream"]}}))
+            tasks = set()
+            async for frame in ws:
+                message = json.loads(frame)
+                if message["type"] == "stream_ack":
+                    async with self._credit:
+                        self.acknowledged += message["payload"]["parts"]
+                        self._credit.notify_all()
+                elif message["type"] == "cancel":
+                    self.cancelled.append(message["payload"]["reason"])
+                elif message["type"] == "grab_dom":
+                    task = asyncio.create_task(self._stream(ws, message))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    await ws.send(json.dumps({"id": message["id"], "result": {"success": True, "data": []}}))
+
+    async def _stream(self, ws, message):
+        window = message["payload"]["window"]
+        for part in range(self.parts):
+            if not self.greedy:
+                async with self._credit:
+                    await self._credit.wait_for(lambda: part < self.acknowledged + window)
+            await ws.send(json.dumps({"id": message["id"], "chunk": {"part": part}}))
+        await ws.send(json.dumps({"id": message["id"], "result": {"success": True}}))
+
+
+async def serve(extension: StreamingExtension):
+    context = Context(reconnect_grace=5)
+    server = await start_websocket_server(context, port=0)
+    port = server.sockets[0].getsockname()[1]
+    task = asyncio.create_task(extension.run(f"ws://127.0.0.1:{port}"))
+    return context, server, task
+
+
+async def shutdown(server, task):
+    task.cancel()
+    server.close()
+    await server.wait_closed()
+
+
+def test_stalled_stream_does_not_hold_up_other_replies():
+    async def scenario():
+        extension = StreamingExtension(parts=3 * STREAM_WINDOW)
+        context, server, task = await serve(extension)
+        try:
+            async with context.stream_socket_message("grab_dom") as stream:
+                assert await stream.__anext__() == {"part": 0}
+                # The consumer stops reading; the extension fills its window
+                await asyncio.sleep(0.1)
+                assert await asyncio.wait_for(context.send_socket_message("get_tabs"), 1) == {
+                    "success": True,
+                    "data": [],
+                }
+                parts = [1] + [chunk["part"] async for chunk in stream]
+            assert len(parts) == 3 * STREAM_WINDOW
+            assert stream.result == {"success": True}
+            assert extension.acknowledged >= 2 * STREAM_WINDOW
+        finally:
+            await shutdown(server, task)
+
+    asyncio.run(scenario())
+
+
+def test_extension_ignoring_the_window_is_cancelled():
+    async def scenario():
+        extension = StreamingExtension(parts=STREAM_MAX_UNREAD + 10, greedy=True)
+        context, server, task = await serve(extension)
+        try:
+            with pytest.raises(ExtensionError, match="unacknowledged"):
+                async with context.stream_socket_message("grab_dom") as stream:
+                    await stream.__anext__()
+                    await asyncio.sleep(0.2)
+                    async for _ in stream:
+                        pass
+            await asyncio.sleep(0.05)
+            assert extension.cancelled == ["overflow"]
+            assert not context._pending_requests
+        finally:
+            await shutdown(server, task)
+
+    asyncio.run(scenario())
+
+
+class StreamedGrabContext(SimpleNamespace):
+    """Knows tab 1 only; streams one grab_dom part and records what reaches the macros."""
+
+    def __init__(self):
+        super().__init__(dom_cache=DomCache(), tabs={1: {"id": 1}}, streamed=[], observed=[])
+        self.macros = SimpleNamespace(observe=lambda context, message_type, payload: self.observed.append(message_type))
+
+    def supports(self, capability, tab_id=None):
+        return capability == "stream"
+
+    def tabs_synced(self):
+        return True
+
+    @asynccontextmanager
+    async def stream_socket_message(self, message_type, payload=None):
+        self.streamed.append(payload)
+        yield OnePartStream()
+
+
+class OnePartStream:
+    result = {"success": True, "data": {}}
+
+    async def __aiter__(self):
+        yield {"processedOutput": "[0]<button>", "highlightToXPath": {"0": "/html/body/button"}}
+
+
+def test_streamed_grab_dom_checks_the_tab_and_is_observed():
+    context = StreamedGrabContext()
+    result = asyncio.run(grab_dom_tool(context, {"tab_id": 2}))
+    assert result.error_code == INVALID_PARAMS and "Unknown tab_id 2" in result.message
+    assert context.streamed == [] and context.observed == []
+
+    result = asyncio.run(grab_dom_tool(context, {"tab_id": 1}))
+    assert result.success and result.data["processedOutput"] == "[0]<button>"
+    assert context.streamed == [{"tab_id": 1}]
+    assert context.observed == ["grab_dom"]
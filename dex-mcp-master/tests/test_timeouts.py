@@ -0,0 +1,41 @@
+from timeouts import AdaptiveTimeouts
+
+
+def test_fast_responses_stop_at_a_per_action_floor():
+    timeouts = AdaptiveTimeouts()
+    for _ in range(25):
+        timeouts.observe("navigate", 0.05)
+        timeouts.observe("get_tabs", 0.05)
+
+    assert timeouts.timeout_for("navigate") == 45.0 * 0.25
+    assert timeouts.timeout_for("get_tabs") == 2.0
+
+
+def test_timeouts_back_off():
+    timeouts = AdaptiveTimeouts()
+    for _ in range(25):
+        timeouts.observe("click_element", 0.5)
+    assert timeouts.timeout_for("click_element") == 3.75
+
+    timeouts.observe_timeout("click_element", 3.75)
+    assert timeouts.timeout_for("click_element") == 3.75 * 3
+
+
+def test_default_applies_until_enough_samples():
+    timeouts = AdaptiveTimeouts(min_samples=5)
+    for _ in range(4):
+        timeouts.observe("screenshot", 0.1)
+    assert timeouts.timeout_for("screenshot") == 20.0
+
+
+def test_only_full_length_timeouts_count_against_the_extension():
+    from types import SimpleNamespace
+
+    from context import Context
+
+    context = Context()
+    connection = SimpleNamespace(failures=0)
+    context._count_timeout(connection, "navigate", 11.25)
+    assert connection.failures == 0
+    context._count_timeout(connection, "navigate", 45.0)
+    assert connection.failures == 1
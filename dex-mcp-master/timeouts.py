@@ -0,0 +1,97 @@
+"""Per-action request timeouts that adapt to observed extension latency."""
+
+from collections import deque
+from typing import Optional
+
+# Starting timeouts in seconds, used until enough samples have been observed
+DEFAULT_TIMEOUTS = {
+    "get_tabs": 5.0,
+    "select_tab": 5.0,
+    "close_tab": 5.0,
+    "new_tab": 10.0,
+    "send_keys": 10.0,
+    "select_range": 10.0,
+    "add_assistant_message": 10.0,
+    "click_element": 15.0,
+    "input_text": 15.0,
+    "query_elements": 15.0,
+    "paste_text": 30.0,
+    "read_range": 30.0,
+    "screenshot": 20.0,
+    "grab_dom": 30.0,
+    "capture_with_highlights": 30.0,
+    "navigate": 45.0,
+    "search_google": 45.0,
+}
+FALLBACK_TIMEOUT = 30.0
+
+
+class AdaptiveTimeouts:
+    """Derive each action's timeout from a high percentile of recent latencies.
+
+    Until ``min_samples`` responses have been seen for an action its default
+    applies. After that the timeout is ``multiplier`` times the
+    ``percentile`` latency over the last ``window`` responses, clamped to
+    ``[floor_for(type), ceiling]``, so fast actions fail fast and slow ones
+    get room. The floor is a fraction of the action's default, so a run of
+    fast navigations cannot squeeze a 45 s default down to a couple of
+    seconds. A request that times out counts as a sample at its timeout,
+    which pushes the next timeout up instead of leaving it stuck low.
+    """
+
+    def __init__(
+        self,
+        defaults: Optional[dict[str, float]] = None,
+        window: int = 200,
+        percentile: float = 0.99,
+        multiplier: float = 3.0,
+        min_samples: int = 20,
+        floor: float = 2.0,
+        floor_fraction: float = 0.25,
+        ceiling: float = 120.0,
+    ):
+        self.defaults = {**DEFAULT_TIMEOUTS, **(defaults or {})}
+        self.window = window
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.floor = floor
+        self.floor_fraction = floor_fraction
+        self.ceiling = ceiling
+        self._samples: dict[str, deque] = {}
+
+    def default_for(self, message_type: str) -> float:
+        return self.defaults.get(message_type, FALLBACK_TIMEOUT)
+
+    def floor_for(self, message_type: str) -> float:
+        """Lowest timeout an action can adapt down to."""
+        return max(self.floor, self.default_for(message_type) * self.floor_fraction)
+
+    def observe(self, message_type: str, seconds: float):
+        """Record how long a successful request took."""
+        samples = self._samples.get(message_type)
+        if samples is None:
+            samples = self._samples[message_type] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def observe_timeout(self, message_type: str, timeout: float):
+        """Record a request that got no answer within ``timeout``."""
+        # At least as slow as the timeout; a high percentile then backs off
+        self.observe(message_type, timeout)
+
+    def latency(self, message_type: str, percentile: Optional[float] = None) -> Optional[float]:
+        """Observed latency at ``percentile``, or ``None`` without samples."""
+        samples = self._samples.get(message_type)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * (percentile or self.percentile)))
+        return ordered[index]
+
+    def timeout_for(self, message_type: str) -> float:
+        """Timeout to apply to the next request of ``message_type``."""
+        samples = self._samples.get(message_type)
+        if not samples or len(samples) < self.min_samples:
+            return self.default_for(message_type)
+        adaptive = self.latency(message_type) * self.multiplier
+        return max(self.floor_for(message_type), min(self.ceiling, adaptive))
@@ -1,59 +1,327 @@
 """Browser tools for interacting with the browser extension."""
 
-from typing import Any, Dict
-from context import Context
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
 
+from mcp.server.fastmcp import Image
+from mcp.types import ImageContent
 
-async def get_tabs_tool(context: Context, params: Dict[str, Any] = None) -> str:
+from admission import OverloadedError
+from context import ConnectionLostError, Context, ExtensionError, ExtensionTimeoutError, NoConnectionError
+from debug_logs import LEVELS as DEBUG_LOG_LEVELS
+from dom_budget import prune_dom
+from dom_cache import apply_delta, diff_nodes, index_nodes, query_nodes
+from macros import play as play_macro
+from sheets import a1_range, chunk_rows, mismatches, parse_cell
+from imaging import CropError, ImageError, ImageOptions, decode_data_url
+from tools.results import (
+    ACTION_FAILED,
+    CONNECTION_LOST,
+    EXTENSION_ERROR,
+    INTERNAL_ERROR,
+    INVALID_PARAMS,
+    NO_CONNECTION,
+    OVERLOADED,
+    TIMEOUT,
+    ToolResult,
+)
+
+# Differing perceptual-hash bits (out of 64) still treated as "no change"
+DEFAULT_CHANGE_THRESHOLD = 4
+
+# Wait tools: the extension enforces the caller's deadline, the server allows
+# a little extra for the completion message to arrive
+DEFAULT_WAIT_TIMEOUT = 10.0
+MAX_WAIT_TIMEOUT = 120.0
+WAIT_RESPONSE_GRACE = 2.0
+SELECTOR_STATES = ("attached", "visible", "hidden", "detached")
+
+DEFAULT_QUERY_LIMIT = 20
+MAX_QUERY_LIMIT = 200
+
+DEFAULT_PARALLEL_CONCURRENCY = 10
+
+# Spreadsheet fills: one clipboard paste per chunk
+DEFAULT_PASTE_BYTES = 64 * 1024
+DEFAULT_PASTE_ROWS = 500
+MAX_REPORTED_MISMATCHES = 20
+
+
+def _image_content(data: Any, mime_type: Optional[str] = None) -> Optional[ImageContent]:
+    """Turn a capture into MCP image content without decoding it.
+
+    Raw bytes from a binary frame are base64-encoded once for MCP. A data URL
+    from a JSON reply already holds base64, so it is passed through untouched.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        image_format = (mime_type or "image/png").split("/")[-1]
+        return Image(data=bytes(data), format=image_format).to_image_content()
+
+    if isinstance(data, str) and data.startswith("data:") and ";base64," in data:
+        header, encoded = data.split(",", 1)
+        return ImageContent(type="image", data=encoded, mimeType=header[5:].split(";")[0])
+
+    return None
+
+
+def _image_options(params: Optional[Dict[str, Any]]) -> ImageOptions:
+    """Read per-call image post-processing options from tool params."""
+    params = params or {}
+    crop = params.get("crop")
+    return ImageOptions(
+        max_width=params.get("max_width"),
+        max_height=params.get("max_height"),
+        format=params.get("format"),
+        quality=params.get("quality"),
+        grayscale=bool(params.get("grayscale")),
+        crop=tuple(crop) if isinstance(crop, (list, tuple)) else crop,
+    )
+
+
+def _check_image_params(params: Optional[Dict[str, Any]]) -> Optional[ToolResult]:
+    """Reject post-processing or change-detection params before capturing anything."""
+    try:
+        _image_options(params).validate()
+    except ValueError as e:
+        return ToolResult.invalid(str(e))
+    threshold = (params or {}).get("change_threshold", DEFAULT_CHANGE_THRESHOLD)
+    if isinstance(threshold, bool) or not isinstance(threshold, int) or not 0 <= threshold <= 64:
+        return ToolResult.invalid("change_threshold must be an integer from 0 to 64")
+    return None
+
+
+def _image_failure(tool_result: ToolResult, error: ImageError) -> ToolResult:
+    """Failure result for a capture that could not be decoded, hashed or transformed."""
+    error_code = INVALID_PARAMS if isinstance(error, CropError) else ACTION_FAILED
+    return ToolResult.failure(
+        f"{tool_result.message}, but processing it failed: {error}",
+        error_code,
+        str(error),
+        action=tool_result.action,
+        elapsed_ms=tool_result.elapsed_ms,
+    )
+
+
+async def _prepare_image(
+    context: Context,
+    data: Any,
+    mime_type: Optional[str],
+    params: Optional[Dict[str, Any]],
+    tab_id: Any = None,
+    url: Optional[str] = None,
+) -> Optional[ImageContent]:
+    """Post-process a capture if requested and turn it into MCP image content.
+
+    Without any processing options the capture is passed through untouched.
+    Raises ``ImageError`` for a capture that can't be decoded or transformed.
+    """
+    options = context.images.resolve(_image_options(params))
+    if options.is_noop() or not context.images.available:
+        return _image_content(data, mime_type)
+
+    if isinstance(data, str) and data.startswith("data:"):
+        data, mime_type = decode_data_url(data)
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        return None
+
+    processed, processed_mime = await context.images.process(bytes(data), options, tab_id, url)
+    return _image_content(processed, processed_mime or mime_type)
+
+
+async def _skip_if_unchanged(
+    context: Context,
+    tool_result: ToolResult,
+    key: Any,
+    data: Any,
+    params: Optional[Dict[str, Any]],
+) -> bool:
+    """Turn ``tool_result`` into an "unchanged" answer if the capture matches the last one.
+
+    Only applies when the caller passed ``only_if_changed``. Returns True when
+    the image should be left out. Raises ``ImageError`` for a capture that
+    can't be decoded.
+    """
+    if not params or not params.get("only_if_changed"):
+        return False
+
+    if isinstance(data, str) and data.startswith("data:"):
+        data, _ = decode_data_url(data)
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        return False
+
+    threshold = params.get("change_threshold", DEFAULT_CHANGE_THRESHOLD)
+    changed, distance, since = await context.images.compare_to_last(key, bytes(data), threshold)
+    if changed:
+        return False
+
+    since_iso = datetime.fromtimestamp(since, timezone.utc).isoformat()
+    tool_result.message = f"Unchanged since {since_iso}"
+    tool_result.data = {"unchanged": True, "since": since_iso, "distance": distance}
+    return True
+
+
+def _check_tab(context: Context, tab_id: Optional[int]) -> Optional[ToolResult]:
+    """Reject a tab_id the up-to-date tab index has never seen, without a round trip."""
+    if tab_id is None or tab_id in context.tabs or not context.tabs_synced():
+        return None
+    return ToolResult.invalid(f"Unknown tab_id {tab_id}; call get_tabs(refresh=True) if the tab was just opened")
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _error_result(failed: str, error: Exception, start: float) -> ToolResult:
+    """Map an exception from the extension bridge to a ToolResult."""
+    if isinstance(error, OverloadedError):
+        return ToolResult.failure(
+            f"{failed}: {error}",
+            OVERLOADED,
+            str(error),
+            data={"retry_after": error.retry_after},
+            elapsed_ms=_elapsed_ms(start),
+        )
+    if isinstance(error, NoConnectionError):
+        error_code = NO_CONNECTION
+    elif isinstance(error, ExtensionTimeoutError):
+        error_code = TIMEOUT
+    elif isinstance(error, ConnectionLostError):
+        error_code = CONNECTION_LOST
+    elif isinstance(error, ExtensionError):
+        error_code = EXTENSION_ERROR
+    elif isinstance(error, ValueError):
+        error_code = INVALID_PARAMS
+    else:
+        error_code = INTERNAL_ERROR
+    return ToolResult.failure(f"{failed}: {error}", error_code, str(error), elapsed_ms=_elapsed_ms(start))
+
+
+async def _run_action(
+    context: Context,
+    message_type: str,
+    payload: Dict[str, Any],
+    done: str,
+    failed: str,
+    timeout: Optional[float] = None,
+) -> tuple[ToolResult, Optional[dict]]:
+    """Send one action to the extension and wrap the outcome in a ToolResult.
+
+    Returns the ToolResult and the extension's raw result (``None`` when the
+    call itself failed) so callers can post-process successful replies.
+    ``timeout`` overrides the action's adaptive timeout.
+    """
+    start = time.perf_counter()
+    unknown_tab = _check_tab(context, payload.get("tab_id"))
+    if unknown_tab:
+        return unknown_tab, None
+    try:
+        result = await context.send_socket_message(message_type, payload, timeout=timeout)
+    except Exception as e:
+        return _error_result(failed, e, start), None
+
+    if not result:
+        return ToolResult.failure(failed, ACTION_FAILED, elapsed_ms=_elapsed_ms(start)), None
+
+    if not result.get("success"):
+        error = result.get("error", "Unknown error")
+        return ToolResult.failure(
+            f"{failed}: {error}", ACTION_FAILED, error, action=result.get("action"), elapsed_ms=_elapsed_ms(start)
+        ), result
+
+    context.macros.observe(context, message_type, payload)
+    return ToolResult(
+        success=True,
+        message=done,
+        action=result.get("action", message_type),
+        data=result.get("data"),
+        elapsed_ms=_elapsed_ms(start),
+    ), result
+
+
+async def get_tabs_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Get all open browser tabs.
     
-    Params: None
+    Answered from the local tab index when every connected extension pushes
+    tab events, otherwise (or with ``refresh``) by asking the extension, which
+    also resyncs the index.
+    
+    Params:
+        refresh (bool): Optional - Ask the extension even if the index is current
     """
-    try:
-        result = await context.send_socket_message("get_tabs", {})
-        
-        if not result or "tabs" not in result:
-            return "No tabs found or unable to fetch tabs."
-        
-        tabs = result["tabs"]
-        if not tabs:
-            return "No open tabs found."
-        
-        # Format tabs into readable text
-        tab_list = []
-        for tab in tabs:
-            tab_info = f"Tab {tab.get('id', 'Unknown')}: {tab.get('title', 'Untitled')}"
-            if tab.get('url'):
-                tab_info += f"\n  URL: {tab['url']}"
-            tab_list.append(tab_info)
-        
-        return f"Found {len(tabs)} open tabs:\n\n" + "\n\n".join(tab_list)
+    start = time.perf_counter()
+    refresh = bool(params and params.get("refresh"))
+    
+    if not refresh and context.tabs_synced():
+        tabs = context.tabs.list()
+    else:
+        try:
+            result = await context.send_socket_message("get_tabs", {})
+        except Exception as e:
+            return _error_result("Error getting tabs", e, start)
         
-    except Exception as e:
-        return f"Error getting tabs: {str(e)}"
+        tabs = (result or {}).get("tabs")
+        if tabs is None:
+            tabs = (result or {}).get("data")
+        if not isinstance(tabs, list):
+            return ToolResult.failure(
+                "No tabs found or unable to fetch tabs.", ACTION_FAILED, elapsed_ms=_elapsed_ms(start)
+            )
+    elapsed_ms = _elapsed_ms(start)
+    
+    tabs = [
+        {"id": tab.get("id"), "title": tab.get("title", "Untitled"), "url": tab.get("url")}
+        for tab in tabs
+    ]
+    message = f"Found {len(tabs)} open tabs" if tabs else "No open tabs found."
+    return ToolResult(success=True, message=message, action="get_tabs", data=tabs, elapsed_ms=elapsed_ms)
 
 
-async def screenshot_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def screenshot_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Take a screenshot of the active tab.
     
-    Params: None
+    The capture is attached as MCP image content; ``data`` only carries its
+    MIME type.
+    
+    Params:
+        max_width (int): Optional - Downscale to at most this width
+        max_height (int): Optional - Downscale to at most this height
+        format (str): Optional - Re-encode as "png", "jpeg" or "webp"
+        quality (int): Optional - JPEG/WebP quality, 1-100
+        grayscale (bool): Optional - Convert to grayscale
+        crop (list): Optional - [left, top, width, height] region to keep
+        only_if_changed (bool): Optional - Skip the image if it looks the same as
+            the last one returned
+        change_threshold (int): Optional - Differing hash bits (0-64) still
+            counted as unchanged, defaults to 4
     """
+    invalid = _check_image_params(params)
+    if invalid:
+        return invalid
+    
+    tool_result, result = await _run_action(
+        context, "screenshot", {}, "Screenshot captured", "Failed to take screenshot"
+    )
+    if not tool_result.success:
+        return tool_result
+    
     try:
-        result = await context.send_socket_message("screenshot", {})
-        
-        if not result:
-            return "Failed to take screenshot."
-        
-        if result.get("success"):
-            return result
-        else:
-            return f"Failed to take screenshot: {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error taking screenshot: {str(e)}"
+        if await _skip_if_unchanged(context, tool_result, ("screenshot", "active"), result.get("data"), params):
+            return tool_result
+        image = await _prepare_image(
+            context, result.get("data"), result.get("mimeType"), params, url=result.get("url")
+        )
+    except ImageError as e:
+        return _image_failure(tool_result, e)
+    if not image:
+        return tool_result
+    
+    tool_result.data = {"mimeType": image.mimeType}
+    return tool_result.with_images(image)
 
 
-async def navigate_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def navigate_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Navigate to a URL in active tab or specified tab.
     
     Params:
@@ -61,7 +329,7 @@ async def navigate_tool(context: Context, params: Dict[str, Any] = None) -> str:
         tab_id (int): Optional - Specific tab ID, defaults to active tab
     """
     if not params or "url" not in params:
-        return "Error: URL parameter is required"
+        return ToolResult.invalid("URL parameter is required")
     
     url = params["url"]
     tab_id = params.get("tab_id")
@@ -70,52 +338,30 @@ async def navigate_tool(context: Context, params: Dict[str, Any] = None) -> str:
     if tab_id is not None:
         payload["tab_id"] = tab_id
     
-    try:
-        result = await context.send_socket_message("navigate", payload)
-        
-        if not result:
-            return f"Failed to navigate to {url}"
-        
-        if result.get("success"):
-            message = result.get("message", f"Navigated to {url}")
-            action = result.get("action", "go_to_url")
-            return f"Successfully navigated to {url}\nAction: {action} - {message}"
-        else:
-            return f"Failed to navigate to {url}: {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error navigating to {url}: {str(e)}"
+    tool_result, _ = await _run_action(
+        context, "navigate", payload, f"Navigated to {url}", f"Failed to navigate to {url}"
+    )
+    return tool_result
 
 
-async def select_tab_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def select_tab_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Switch to a specific browser tab by ID.
     
     Params:
         tab_id (int): Required - Tab ID to switch to
     """
     if not params or "tab_id" not in params:
-        return "Error: tab_id parameter is required"
+        return ToolResult.invalid("tab_id parameter is required")
     
     tab_id = params["tab_id"]
     
-    try:
-        result = await context.send_socket_message("select_tab", {"tab_id": tab_id})
-        
-        if not result:
-            return f"Failed to select tab {tab_id}"
-        
-        if result.get("success"):
-            message = result.get("message", "Tab selected")
-            action = result.get("action", "select_tab")
-            return f"Successfully switched to tab {tab_id}\nAction: {action} - {message}"
-        else:
-            return f"Failed to select tab {tab_id}: {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error selecting tab {tab_id}: {str(e)}"
+    tool_result, _ = await _run_action(
+        context, "select_tab", {"tab_id": tab_id}, f"Switched to tab {tab_id}", f"Failed to select tab {tab_id}"
+    )
+    return tool_result
 
 
-async def new_tab_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def new_tab_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Create a new browser tab, optionally with a specific URL.
     
     Params:
@@ -127,29 +373,14 @@ async def new_tab_tool(context: Context, params: Dict[str, Any] = None) -> str:
     if url:
         payload["url"] = url
     
-    try:
-        result = await context.send_socket_message("new_tab", payload)
-        
-        if not result:
-            return "Failed to create new tab"
-        
-        if result.get("success"):
-            tab_id = result.get("data", {}).get("id")
-            message = result.get("message", "New tab created")
-            action = result.get("action", "new_tab")
-            
-            if url:
-                return f"Successfully created new tab (ID: {tab_id}) with URL: {url}\nAction: {action} - {message}"
-            else:
-                return f"Successfully created new tab (ID: {tab_id})\nAction: {action} - {message}"
-        else:
-            return f"Failed to create new tab: {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error creating new tab: {str(e)}"
+    tool_result, _ = await _run_action(context, "new_tab", payload, "Created new tab", "Failed to create new tab")
+    if tool_result.success:
+        tab_id = (tool_result.data or {}).get("id")
+        tool_result.message = f"Created new tab (ID: {tab_id})" + (f" with URL: {url}" if url else "")
+    return tool_result
 
 
-async def close_tab_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def close_tab_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Close a browser tab by ID, or close the active tab if no ID specified.
     
     Params:
@@ -161,24 +392,14 @@ async def close_tab_tool(context: Context, params: Dict[str, Any] = None) -> str
     if tab_id is not None:
         payload["tab_id"] = tab_id
     
-    try:
-        result = await context.send_socket_message("close_tab", payload)
-        
-        if not result:
-            return f"Failed to close tab {tab_id if tab_id else '(active)'}"
-        
-        if result.get("success"):
-            message = result.get("message", "Tab closed")
-            action = result.get("action", "close_tab")
-            return f"Successfully closed tab {tab_id if tab_id else '(active)'}\nAction: {action} - {message}"
-        else:
-            return f"Failed to close tab: {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error closing tab: {str(e)}"
+    label = tab_id if tab_id is not None else "(active)"
+    tool_result, _ = await _run_action(
+        context, "close_tab", payload, f"Closed tab {label}", f"Failed to close tab {label}"
+    )
+    return tool_result
 
 
-async def search_google_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def search_google_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Perform a Google search in active tab or specified tab.
     
     Params:
@@ -186,7 +407,7 @@ async def search_google_tool(context: Context, params: Dict[str, Any] = None) ->
         tab_id (int): Optional - Specific tab ID, defaults to active tab
     """
     if not params or "query" not in params:
-        return "Error: query parameter is required"
+        return ToolResult.invalid("query parameter is required")
     
     query = params["query"]
     tab_id = params.get("tab_id")
@@ -195,24 +416,17 @@ async def search_google_tool(context: Context, params: Dict[str, Any] = None) ->
     if tab_id is not None:
         payload["tab_id"] = tab_id
     
-    try:
-        result = await context.send_socket_message("search_google", payload)
-        
-        if not result:
-            return f"Failed to search Google for '{query}'"
-        
-        if result.get("success"):
-            message = result.get("message", f"Searched Google for {query}")
-            action = result.get("action", "search_google")
-            return f"Successfully searched Google for '{query}'\nAction: {action} - {message}"
-        else:
-            return f"Failed to search Google for '{query}': {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error searching Google for '{query}': {str(e)}"
+    tool_result, _ = await _run_action(
+        context,
+        "search_google",
+        payload,
+        f"Searched Google for '{query}'",
+        f"Failed to search Google for '{query}'",
+    )
+    return tool_result
 
 
-async def click_element_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def click_element_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Click on a DOM element by its ID.
     
     Params:
@@ -220,7 +434,7 @@ async def click_element_tool(context: Context, params: Dict[str, Any] = None) ->
         tab_id (int): Optional - Specific tab ID, defaults to active tab
     """
     if not params or "element_id" not in params:
-        return "Error: element_id parameter is required"
+        return ToolResult.invalid("element_id parameter is required")
     
     element_id = params["element_id"]
     tab_id = params.get("tab_id")
@@ -229,24 +443,17 @@ async def click_element_tool(context: Context, params: Dict[str, Any] = None) ->
     if tab_id is not None:
         payload["tab_id"] = tab_id
     
-    try:
-        result = await context.send_socket_message("click_element", payload)
-        
-        if not result:
-            return f"Failed to click element '{element_id}'"
-        
-        if result.get("success"):
-            message = result.get("message", f"Clicked element '{element_id}'")
-            action = result.get("action", "click_element")
-            return f"Successfully clicked element '{element_id}'\nAction: {action} - {message}"
-        else:
-            return f"Failed to click element '{element_id}': {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error clicking element '{element_id}': {str(e)}"
+    tool_result, _ = await _run_action(
+        context,
+        "click_element",
+        payload,
+        f"Clicked element '{element_id}'",
+        f"Failed to click element '{element_id}'",
+    )
+    return tool_result
 
 
-async def input_text_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def input_text_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Type text into a DOM element by its ID.
     
     Params:
@@ -255,7 +462,7 @@ async def input_text_tool(context: Context, params: Dict[str, Any] = None) -> st
         tab_id (int): Optional - Specific tab ID, defaults to active tab
     """
     if not params or "element_id" not in params or "text" not in params:
-        return "Error: element_id and text parameters are required"
+        return ToolResult.invalid("element_id and text parameters are required")
     
     element_id = params["element_id"]
     text = params["text"]
@@ -265,24 +472,17 @@ async def input_text_tool(context: Context, params: Dict[str, Any] = None) -> st
     if tab_id is not None:
         payload["tab_id"] = tab_id
     
-    try:
-        result = await context.send_socket_message("input_text", payload)
-        
-        if not result:
-            return f"Failed to input text into element '{element_id}'"
-        
-        if result.get("success"):
-            message = result.get("message", f"Input text into element '{element_id}'")
-            action = result.get("action", "input_text")
-            return f"Successfully input text '{text}' into element '{element_id}'\nAction: {action} - {message}"
-        else:
-            return f"Failed to input text into element '{element_id}': {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error inputting text into element '{element_id}': {str(e)}"
+    tool_result, _ = await _run_action(
+        context,
+        "input_text",
+        payload,
+        f"Input text '{text}' into element '{element_id}'",
+        f"Failed to input text into element '{element_id}'",
+    )
+    return tool_result
 
 
-async def send_keys_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def send_keys_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Send keyboard shortcuts or key combinations to the page.
     
     Params:
@@ -290,7 +490,7 @@ async def send_keys_tool(context: Context, params: Dict[str, Any] = None) -> str
         tab_id (int): Optional - Specific tab ID, defaults to active tab
     """
     if not params or "keys" not in params:
-        return "Error: keys parameter is required"
+        return ToolResult.invalid("keys parameter is required")
     
     keys = params["keys"]
     tab_id = params.get("tab_id")
@@ -299,98 +499,805 @@ async def send_keys_tool(context: Context, params: Dict[str, Any] = None) -> str
     if tab_id is not None:
         payload["tab_id"] = tab_id
     
-    try:
-        result = await context.send_socket_message("send_keys", payload)
-        
-        if not result:
-            return f"Failed to send keys '{keys}'"
-        
-        if result.get("success"):
-            message = result.get("message", f"Sent keys '{keys}'")
-            action = result.get("action", "send_keys")
-            return f"Successfully sent keys '{keys}'\nAction: {action} - {message}"
-        else:
-            return f"Failed to send keys '{keys}': {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error sending keys '{keys}': {str(e)}"
+    tool_result, _ = await _run_action(
+        context, "send_keys", payload, f"Sent keys '{keys}'", f"Failed to send keys '{keys}'"
+    )
+    return tool_result
 
 
-async def grab_dom_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def grab_dom_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Get formatted DOM structure with XPath mappings for elements.
     
+    In ``delta`` mode only the interactive nodes (keyed by XPath) that were
+    added, removed or changed since the previous call on the same tab are
+    returned, along with the current highlight-to-XPath map. The first call on
+    a tab always returns the full structure.
+    
+    A full structure larger than ``max_tokens`` is pruned to fit (see
+    ``dom_budget.prune_dom``); the cached snapshot always keeps every node.
+    
     Params:
         tab_id (int): Optional - Specific tab ID, defaults to active tab
+        mode (str): Optional - "full" (default) or "delta"
+        max_tokens (int): Optional - Token budget for the full structure, no limit by default
     """
     tab_id = params.get("tab_id") if params else None
+    mode = params.get("mode", "full") if params else "full"
+    max_tokens = params.get("max_tokens") if params else None
+    
+    if mode not in ("full", "delta"):
+        return ToolResult.invalid(f"unknown mode '{mode}', expected 'full' or 'delta'")
+    if max_tokens is not None and (not isinstance(max_tokens, int) or max_tokens <= 0):
+        return ToolResult.invalid("max_tokens must be a positive integer")
     
     payload = {}
     if tab_id is not None:
         payload["tab_id"] = tab_id
     
+    cache_key = tab_id if tab_id is not None else "active"
+    base = context.dom_cache.get(cache_key) if mode == "delta" else None
+    if base and base.extension_version is not None and context.supports("dom_delta", tab_id):
+        payload["since_version"] = base.extension_version
+    
+    if context.supports("stream", tab_id):
+        tool_result = await _grab_dom_streamed(context, payload)
+    else:
+        tool_result, _ = await _run_action(
+            context, "grab_dom", payload, "Grabbed DOM structure", "Failed to grab DOM"
+        )
+    if not tool_result.success:
+        return tool_result
+    
+    data = tool_result.data or {}
+    if base and "delta" in data:
+        # The extension computed the delta itself
+        delta = data["delta"]
+        nodes = apply_delta(base.nodes, delta)
+    else:
+        nodes = index_nodes(data)
+        delta = diff_nodes(base.nodes, nodes) if base else None
+    
+    highlight_to_xpath = data.get("highlightToXPath") or {}
+    snapshot = context.dom_cache.store(cache_key, nodes, highlight_to_xpath, data.get("version"))
+    
+    if delta is None:
+        tool_result.data = {**data, "mode": "full", "version": snapshot.version}
+        if max_tokens and data.get("processedOutput"):
+            # Pruning a very large page takes a noticeable fraction of a second
+            pruned = await asyncio.to_thread(prune_dom, data["processedOutput"], highlight_to_xpath, max_tokens)
+            if pruned.passes:
+                tool_result.message = (
+                    f"Grabbed DOM structure, pruned from ~{pruned.original_tokens} to ~{pruned.tokens} tokens"
+                )
+                tool_result.data.update(
+                    processedOutput=pruned.text,
+                    highlightToXPath=pruned.highlight_to_xpath,
+                    pruning=pruned.stats(),
+                )
+        return tool_result
+    
+    tool_result.message = (
+        f"DOM changes since version {base.version}: {len(delta.get('added') or {})} added, "
+        f"{len(delta.get('removed') or [])} removed, {len(delta.get('changed') or {})} changed"
+    )
+    tool_result.data = {
+        **delta,
+        "mode": "delta",
+        "version": snapshot.version,
+        "baseVersion": base.version,
+        "highlightToXPath": highlight_to_xpath,
+    }
+    return tool_result
+
+
+async def _grab_dom_streamed(context: Context, payload: Dict[str, Any]) -> ToolResult:
+    """Collect a streamed grab_dom reply into the shape of a single-message one.
+    
+    Parts are decoded one message at a time as they arrive and only their
+    text and XPath entries are kept. Checks the tab and records the grab for
+    macros the same way ``_run_action`` does.
+    """
+    start = time.perf_counter()
+    unknown_tab = _check_tab(context, payload.get("tab_id"))
+    if unknown_tab:
+        return unknown_tab
+    output_parts = []
+    highlight_to_xpath = {}
     try:
-        result = await context.send_socket_message("grab_dom", payload)
-        
-        if not result:
-            return "Failed to grab DOM structure"
-        
-        if result.get("success"):
-            return result
-        else:
-            return f"Failed to grab DOM: {result.get('error', 'Unknown error')}"
-            
+        async with context.stream_socket_message("grab_dom", payload) as stream:
+            async for chunk in stream:
+                if chunk.get("processedOutput"):
+                    output_parts.append(chunk["processedOutput"])
+                highlight_to_xpath.update(chunk.get("highlightToXPath") or {})
+            result = stream.result
     except Exception as e:
-        return f"Error grabbing DOM: {str(e)}"
+        return _error_result("Failed to grab DOM", e, start)
+    
+    if not result or not result.get("success"):
+        error = (result or {}).get("error", "Unknown error")
+        return ToolResult.failure(f"Failed to grab DOM: {error}", ACTION_FAILED, error, elapsed_ms=_elapsed_ms(start))
+    
+    data = {**(result.get("data") or {})}
+    if output_parts:
+        data["processedOutput"] = "\n".join(output_parts)
+    if highlight_to_xpath:
+        data["highlightToXPath"] = highlight_to_xpath
+    context.macros.observe(context, "grab_dom", payload)
+    return ToolResult(
+        success=True,
+        message="Grabbed DOM structure",
+        action=result.get("action", "grab_dom"),
+        data=data,
+        elapsed_ms=_elapsed_ms(start),
+    )
 
 
-async def capture_with_highlights_tool(context: Context, params: Dict[str, Any] = None) -> str:
+async def query_elements_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Find the elements matching some filters instead of returning the whole DOM.
+    
+    Extensions with the ``query_elements`` capability run the query in the
+    page and return each match's XPath, tag, text, bounding box and the
+    requested attributes. Otherwise the DOM is grabbed once and the
+    interactive nodes are filtered here by XPath prefix, text and role; CSS
+    selectors need the capability. Those matches carry only XPath and text,
+    and ``data["source"]`` is ``"grab_dom"`` to say so.
+    
+    Params:
+        css (str): Optional - CSS selector
+        xpath (str): Optional - XPath expression (an XPath prefix without the capability)
+        text (str): Optional - Case-insensitive text the element must contain
+        role (str): Optional - ARIA role, explicit or implied by the tag
+        limit (int): Optional - Maximum number of matches, defaults to 20
+        attributes (list): Optional - Attribute names to include for each match
+        tab_id (int): Optional - Specific tab ID, defaults to active tab
+    """
+    params = params or {}
+    filters = {key: params[key] for key in ("css", "xpath", "text", "role") if params.get(key)}
+    if not filters:
+        return ToolResult.invalid("at least one of css, xpath, text or role is required")
+    
+    limit = params.get("limit", DEFAULT_QUERY_LIMIT)
+    if not isinstance(limit, int) or limit <= 0:
+        return ToolResult.invalid("limit must be a positive integer")
+    limit = min(limit, MAX_QUERY_LIMIT)
+    
+    tab_id = params.get("tab_id")
+    
+    if not context.supports("query_elements", tab_id):
+        if "css" in filters:
+            return ToolResult.failure(
+                "CSS queries need an extension with the query_elements capability",
+                ACTION_FAILED,
+                "query_elements not supported",
+            )
+        return await _query_grabbed_dom(context, filters, limit, tab_id, bool(params.get("attributes")))
+    
+    payload = {**filters, "limit": limit}
+    if params.get("attributes"):
+        payload["attributes"] = list(params["attributes"])
+    if tab_id is not None:
+        payload["tab_id"] = tab_id
+    
+    tool_result, _ = await _run_action(
+        context, "query_elements", payload, "Queried elements", "Failed to query elements"
+    )
+    if not tool_result.success:
+        return tool_result
+    
+    data = tool_result.data or {}
+    elements = data.get("elements") or []
+    total = data.get("total", len(elements))
+    tool_result.message = f"Found {total} matching elements" + (
+        f", returning {len(elements)}" if total > len(elements) else ""
+    )
+    tool_result.data = {"elements": elements, "total": total}
+    return tool_result
+
+
+async def _query_grabbed_dom(
+    context: Context, filters: Dict[str, Any], limit: int, tab_id: Optional[int], attributes: bool = False
+) -> ToolResult:
+    """Fallback for query_elements: filter a fresh grab_dom snapshot on the server.
+    
+    The snapshot is not kept in ``context.dom_cache``; that stays the one the
+    model's next ``grab_dom`` delta is computed against.
+    """
+    payload = {}
+    if tab_id is not None:
+        payload["tab_id"] = tab_id
+    
+    tool_result, _ = await _run_action(
+        context, "grab_dom", payload, "Queried elements", "Failed to query elements"
+    )
+    if not tool_result.success:
+        return tool_result
+    
+    data = tool_result.data or {}
+    nodes = index_nodes(data)
+    elements, total = query_nodes(
+        nodes, xpath=filters.get("xpath"), text=filters.get("text"), role=filters.get("role"), limit=limit
+    )
+    tool_result.action = "query_elements"
+    tool_result.message = f"Found {total} matching elements" + (
+        f", returning {len(elements)}" if total > len(elements) else ""
+    )
+    tool_result.message += " (from grab_dom: XPath and text only" + (
+        ", attributes and bounding boxes need the query_elements capability)" if attributes else ")"
+    )
+    tool_result.data = {"elements": elements, "total": total, "source": "grab_dom"}
+    return tool_result
+
+
+async def capture_with_highlights_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Take a screenshot with element highlights for better AI understanding.
     
+    The capture is attached as MCP image content; ``data`` carries the MIME
+    type and highlight count.
+    
     Params:
         tab_id (int): Optional - Specific tab ID, defaults to active tab
+        max_width, max_height, format, quality, grayscale, crop: Optional -
+            Post-processing options, as for screenshot_tool
+        only_if_changed, change_threshold: Optional - Change detection, as for
+            screenshot_tool
     """
+    invalid = _check_image_params(params)
+    if invalid:
+        return invalid
+    
     tab_id = params.get("tab_id") if params else None
     
     payload = {}
     if tab_id is not None:
         payload["tab_id"] = tab_id
     
+    tool_result, result = await _run_action(
+        context,
+        "capture_with_highlights",
+        payload,
+        "Screenshot captured with highlight data",
+        "Failed to capture screenshot with highlights",
+    )
+    if not tool_result.success:
+        return tool_result
+    
+    data = tool_result.data or {}
+    key = ("capture_with_highlights", tab_id if tab_id is not None else "active")
     try:
-        result = await context.send_socket_message("capture_with_highlights", payload)
-        
-        if not result:
-            return "Failed to capture screenshot with highlights"
+        if await _skip_if_unchanged(context, tool_result, key, data.get("dataUrl"), params):
+            return tool_result
+        image = await _prepare_image(
+            context, data.get("dataUrl"), result.get("mimeType"), params, tab_id, result.get("url")
+        )
+    except ImageError as e:
+        return _image_failure(tool_result, e)
+    if not image:
+        return tool_result
+    
+    tool_result.data = {"mimeType": image.mimeType, "highlightCount": data.get("highlightCount", 0)}
+    return tool_result.with_images(image)
+
+
+def _wait_timeout(params: Dict[str, Any]) -> float:
+    """Read the caller's ``timeout`` (seconds) for a wait tool."""
+    timeout = params.get("timeout", DEFAULT_WAIT_TIMEOUT)
+    if not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise ValueError("timeout must be a positive number of seconds")
+    return min(float(timeout), MAX_WAIT_TIMEOUT)
+
+
+async def _run_wait(
+    context: Context,
+    message_type: str,
+    payload: Dict[str, Any],
+    params: Dict[str, Any],
+    done: str,
+    failed: str,
+) -> ToolResult:
+    """Ask the extension to wait for a page condition and await its single reply.
+
+    The extension polls or observes the page itself until the condition holds
+    or ``timeout_ms`` passes. The server-side timeout is the same deadline plus
+    a short grace period rather than the action's adaptive timeout.
+    """
+    try:
+        timeout = _wait_timeout(params)
+    except ValueError as e:
+        return ToolResult.invalid(str(e))
+    
+    payload["timeout_ms"] = int(timeout * 1000)
+    if params.get("tab_id") is not None:
+        payload["tab_id"] = params["tab_id"]
+    
+    tool_result, result = await _run_action(
+        context, message_type, payload, done, failed, timeout=timeout + WAIT_RESPONSE_GRACE
+    )
+    if not tool_result.success and result and result.get("timed_out"):
+        tool_result.error_code = TIMEOUT
+    return tool_result
+
+
+async def wait_for_selector_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Wait until an element matching a CSS selector reaches a state.
+    
+    Params:
+        selector (str): Required - CSS selector to watch
+        state (str): Optional - "attached", "visible", "hidden" or "detached", defaults to "visible"
+        timeout (float): Optional - Seconds to wait, defaults to 10
+        tab_id (int): Optional - Specific tab ID, defaults to active tab
+    """
+    if not params or not params.get("selector"):
+        return ToolResult.invalid("selector parameter is required")
+    
+    selector = params["selector"]
+    state = params.get("state", "visible")
+    if state not in SELECTOR_STATES:
+        return ToolResult.invalid(f"state must be one of {', '.join(SELECTOR_STATES)}")
+    
+    return await _run_wait(
+        context,
+        "wait_for_selector",
+        {"selector": selector, "state": state},
+        params,
+        f"Element '{selector}' is {state}",
+        f"Element '{selector}' did not become {state}",
+    )
+
+
+async def wait_for_navigation_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Wait until the tab finishes loading a new page.
+    
+    Params:
+        url_contains (str): Optional - Only finish once the URL contains this text
+        timeout (float): Optional - Seconds to wait, defaults to 10
+        tab_id (int): Optional - Specific tab ID, defaults to active tab
+    """
+    params = params or {}
+    url_contains = params.get("url_contains")
+    
+    payload = {}
+    if url_contains:
+        payload["url_contains"] = url_contains
+    
+    target = f" to a URL containing '{url_contains}'" if url_contains else ""
+    return await _run_wait(
+        context,
+        "wait_for_navigation",
+        payload,
+        params,
+        f"Navigation{target} completed",
+        f"Navigation{target} did not complete",
+    )
+
+
+async def wait_for_network_idle_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Wait until the page has had no network requests in flight for a while.
+    
+    Params:
+        idle_ms (int): Optional - Quiet period that counts as idle, defaults to 500
+        timeout (float): Optional - Seconds to wait, defaults to 10
+        tab_id (int): Optional - Specific tab ID, defaults to active tab
+    """
+    params = params or {}
+    idle_ms = params.get("idle_ms", 500)
+    if not isinstance(idle_ms, int) or idle_ms < 0:
+        return ToolResult.invalid("idle_ms must be a non-negative integer")
+    
+    return await _run_wait(
+        context,
+        "wait_for_network_idle",
+        {"idle_ms": idle_ms},
+        params,
+        f"Network idle for {idle_ms}ms",
+        "Network did not become idle",
+    )
+
+
+async def wait_for_text_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Wait until some text appears on the page.
+    
+    Params:
+        text (str): Required - Text to look for
+        selector (str): Optional - Only search inside elements matching this CSS selector
+        timeout (float): Optional - Seconds to wait, defaults to 10
+        tab_id (int): Optional - Specific tab ID, defaults to active tab
+    """
+    if not params or not params.get("text"):
+        return ToolResult.invalid("text parameter is required")
+    
+    text = params["text"]
+    payload = {"text": text}
+    if params.get("selector"):
+        payload["selector"] = params["selector"]
+    
+    return await _run_wait(
+        context,
+        "wait_for_text",
+        payload,
+        params,
+        f"Text '{text}' appeared",
+        f"Text '{text}' did not appear",
+    )
+
+
+async def batch_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Run several browser actions in order with a single extension round trip.
+    
+    Params:
+        actions (list): Required - Steps like {"type": "click_element", "params": {"element_id": "3"}}.
+            Supported types: navigate, click_element, input_text, send_keys, grab_dom, query_elements,
+            select_range, paste_text, read_range
+        stop_on_error (bool): Optional - Stop at the first failing step, defaults to True
+    """
+    if not params or not params.get("actions"):
+        return ToolResult.invalid("actions parameter is required")
+    
+    actions = []
+    for action in params["actions"]:
+        if not isinstance(action, dict) or "type" not in action:
+            return ToolResult.invalid("each action needs a type")
+        actions.append({"type": action["type"], "payload": action.get("params") or {}})
+    
+    stop_on_error = params.get("stop_on_error", True)
+    
+    start = time.perf_counter()
+    try:
+        results = await context.send_batch(actions, stop_on_error=stop_on_error)
+    except Exception as e:
+        return _error_result("Error running batch", e, start)
+    
+    succeeded = sum(1 for step in results if step.get("success"))
+    return ToolResult(
+        success=succeeded == len(actions),
+        message=f"Completed {succeeded} of {len(actions)} actions",
+        action="batch",
+        data=results,
+        error_code=None if succeeded == len(actions) else ACTION_FAILED,
+        elapsed_ms=_elapsed_ms(start),
+    )
+
+
+async def fill_spreadsheet_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Fill a block of spreadsheet cells by pasting TSV chunks into selected ranges.
+    
+    Rows are split into chunks that fit one clipboard paste. For each chunk the
+    target range is selected and the TSV pasted (one batch), then read back
+    once; a chunk whose read-back differs is pasted again up to ``retries``
+    times. Needs an extension with the ``spreadsheet`` capability.
+    
+    Params:
+        rows (list): Required - Rows of cell values, e.g. [["Name", "Score"], ["Ann", 4]]
+        start_cell (str): Optional - Top-left cell in A1 notation, e.g. "B2" or "Sheet1!B2", defaults to "A1"
+        verify (bool): Optional - Read each chunk back and compare, defaults to True
+        retries (int): Optional - Re-pastes of a chunk that failed verification, defaults to 1
+        chunk_bytes (int): Optional - Maximum TSV size of one paste, defaults to 64 KiB
+        chunk_rows (int): Optional - Maximum rows in one paste, defaults to 500
+        tab_id (int): Optional - Specific tab ID, defaults to active tab
+    """
+    if not params or not params.get("rows"):
+        return ToolResult.invalid("rows parameter is required")
+    rows = params["rows"]
+    if not all(isinstance(row, list) for row in rows) or not any(rows):
+        return ToolResult.invalid("rows must be a list of lists with at least one value")
+    try:
+        sheet, first_row, first_column = parse_cell(params.get("start_cell") or "A1")
+    except ValueError as e:
+        return ToolResult.invalid(str(e))
+    
+    verify = params.get("verify", True)
+    retries = params.get("retries", 1)
+    max_bytes = params.get("chunk_bytes", DEFAULT_PASTE_BYTES)
+    max_rows = params.get("chunk_rows", DEFAULT_PASTE_ROWS)
+    tab_id = params.get("tab_id")
+    
+    if not isinstance(verify, bool):
+        return ToolResult.invalid("verify must be true or false")
+    if isinstance(retries, bool) or not isinstance(retries, int) or retries < 0:
+        return ToolResult.invalid("retries must be a non-negative integer")
+    for name, value in (("chunk_bytes", max_bytes), ("chunk_rows", max_rows)):
+        if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+            return ToolResult.invalid(f"{name} must be a positive integer")
+    
+    if not context.supports("spreadsheet", tab_id):
+        return ToolResult.failure(
+            "Spreadsheet fills need an extension with the spreadsheet capability",
+            ACTION_FAILED,
+            "spreadsheet not supported",
+        )
+    unknown_tab = _check_tab(context, tab_id)
+    if unknown_tab:
+        return unknown_tab
+    
+    def with_tab(payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {**payload, "tab_id": tab_id} if tab_id is not None else payload
+    
+    start = time.perf_counter()
+    width = max(len(row) for row in rows)
+    chunks = []
+    for offset, chunk, tsv in chunk_rows(rows, max_bytes, max_rows):
+        target = a1_range(sheet, first_row + offset, first_column, len(chunk), width)
+        report = {"range": target, "rows": len(chunk), "pastes": 0}
+        chunks.append(report)
         
-        if result.get("success"):
-            return result
-        else:
-            return f"Failed to capture screenshot with highlights: {result.get('error', 'Unknown error')}"
+        for attempt in range(retries + 1):
+            report["pastes"] += 1
+            try:
+                steps = await context.send_batch(
+                    [
+                        {"type": "select_range", "payload": with_tab({"range": target})},
+                        {"type": "paste_text", "payload": with_tab({"text": tsv})},
+                    ]
+                )
+            except Exception as e:
+                tool_result = _error_result(f"Error filling {target}", e, start)
+                tool_result.data = chunks
+                return tool_result
+            failed = next((step for step in steps if not step.get("success")), None)
+            if failed or len(steps) < 2:
+                report["error"] = (failed or {}).get("error", "Paste did not complete")
+                break
+            if not verify:
+                break
             
-    except Exception as e:
-        return f"Error capturing screenshot with highlights: {str(e)}"
+            try:
+                result = await context.send_socket_message("read_range", with_tab({"range": target}))
+            except Exception as e:
+                tool_result = _error_result(f"Error reading back {target}", e, start)
+                tool_result.data = chunks
+                return tool_result
+            if not result or not result.get("success"):
+                report["error"] = (result or {}).get("error", "Read-back failed")
+                break
+            values = (result.get("data") or {}).get("values") or []
+            wrong = mismatches(chunk, values, sheet, first_row + offset, first_column)
+            report["mismatches"] = len(wrong)
+            if not wrong:
+                report.pop("error", None)
+                break
+            report["error"] = f"{len(wrong)} cells differ after paste"
+            report["examples"] = wrong[:MAX_REPORTED_MISMATCHES]
+        
+        if "error" in report:
+            break
+    
+    filled = sum(report["rows"] for report in chunks if "error" not in report)
+    complete = filled == len(rows)
+    pastes = sum(report["pastes"] for report in chunks)
+    whole = a1_range(sheet, first_row, first_column, len(rows), width)
+    message = f"Filled {filled} of {len(rows)} rows of {whole} in {pastes} pastes"
+    if not complete:
+        message += f"; stopped at {chunks[-1]['range']}: {chunks[-1]['error']}"
+    return ToolResult(
+        success=complete,
+        message=message,
+        action="fill_spreadsheet",
+        data=chunks,
+        error=None if complete else chunks[-1]["error"],
+        error_code=None if complete else ACTION_FAILED,
+        elapsed_ms=_elapsed_ms(start),
+    )
+
+
+async def parallel_map_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Run one action on several tabs at once.
+    
+    Each tab gets its own call with the shared ``params`` plus its tab_id
+    (and its entry of ``per_tab_params``, if given). Tabs run concurrently;
+    actions on the same tab still run one at a time.
+    
+    Params:
+        action (str): Required - One of the tools in PARALLEL_ACTIONS
+        tab_ids (list): Required - Tabs to run the action on
+        params (dict): Optional - Parameters shared by every call
+        per_tab_params (list): Optional - One dict per tab, merged over params
+        max_concurrency (int): Optional - Calls in flight at once, defaults to 10
+    """
+    if not params or not params.get("action") or not params.get("tab_ids"):
+        return ToolResult.invalid("action and tab_ids parameters are required")
+    
+    action = params["action"]
+    tool = PARALLEL_ACTIONS.get(action)
+    if tool is None:
+        return ToolResult.invalid(f"action must be one of {', '.join(sorted(PARALLEL_ACTIONS))}")
+    
+    tab_ids = params["tab_ids"]
+    if not isinstance(tab_ids, list):
+        return ToolResult.invalid("tab_ids must be a list")
+    shared = params.get("params") or {}
+    if not isinstance(shared, dict):
+        return ToolResult.invalid("params must be an object")
+    per_tab = params.get("per_tab_params") or [{}] * len(tab_ids)
+    if not isinstance(per_tab, list) or len(per_tab) != len(tab_ids):
+        return ToolResult.invalid("per_tab_params needs one entry per tab")
+    if not all(extra is None or isinstance(extra, dict) for extra in per_tab):
+        return ToolResult.invalid("per_tab_params entries must be objects")
+    
+    max_concurrency = params.get("max_concurrency", DEFAULT_PARALLEL_CONCURRENCY)
+    if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency <= 0:
+        return ToolResult.invalid("max_concurrency must be a positive integer")
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def run(tab_id: int, extra: Dict[str, Any]) -> dict:
+        async with semaphore:
+            result = await tool(context, {**shared, **(extra or {}), "tab_id": tab_id})
+        return {"tab_id": tab_id, **result.model_dump(exclude_none=True)}
+    
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run(tab_id, extra) for tab_id, extra in zip(tab_ids, per_tab)))
+    
+    succeeded = sum(1 for result in results if result.get("success"))
+    return ToolResult(
+        success=succeeded == len(results),
+        message=f"{action} succeeded on {succeeded} of {len(results)} tabs",
+        action="parallel_map",
+        data=results,
+        error_code=None if succeeded == len(results) else ACTION_FAILED,
+        elapsed_ms=_elapsed_ms(start),
+    )
+
+
+async def start_macro_recording_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Start recording successful actions into a macro.
+    
+    Params:
+        name (str): Required - Macro name; an existing macro with this name is replaced
+    """
+    if not params or not params.get("name"):
+        return ToolResult.invalid("name parameter is required")
+    try:
+        context.macros.start(params["name"])
+    except ValueError as e:
+        return ToolResult.invalid(str(e))
+    return ToolResult(success=True, message=f"Recording macro '{params['name']}'", action="start_macro_recording")
+
 
+async def stop_macro_recording_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Finish the current recording and save it as a macro.
+    
+    Params:
+        parameters (dict): Optional - Parameter name to the value used while recording,
+            e.g. {"email": "ann@example.com"}; those values become placeholders
+    """
+    parameters = (params or {}).get("parameters") or {}
+    try:
+        macro = context.macros.stop(parameters)
+    except ValueError as e:
+        return ToolResult.invalid(str(e))
+    return ToolResult(
+        success=True,
+        message=f"Saved macro '{macro.name}' with {len(macro.steps)} steps",
+        action="stop_macro_recording",
+        data=macro.describe(),
+    )
+
+
+async def list_macros_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """List saved macros with their parameters and steps.
+    
+    Params: None
+    """
+    macros = [macro.describe() for macro in context.macros.list()]
+    return ToolResult(
+        success=True,
+        message=f"{len(macros)} macros saved" + (f", recording '{context.macros.recording}'" if context.macros.recording else ""),
+        action="list_macros",
+        data=macros,
+    )
 
-async def add_assistant_message_tool(context: Context, params: Dict[str, Any] = None) -> str:
+
+async def run_macro_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Play a macro once per row of parameter values without model round trips.
+    
+    Params:
+        name (str): Required - Macro to run
+        rows (list): Optional - One dict of parameter values per run, defaults to a single run without values
+        tab_id (int): Optional - Specific tab ID, defaults to active tab
+        stop_on_error (bool): Optional - Stop at the first failing row, defaults to False
+    """
+    if not params or not params.get("name"):
+        return ToolResult.invalid("name parameter is required")
+    macro = context.macros.get(params["name"])
+    if macro is None:
+        return ToolResult.invalid(f"Unknown macro '{params['name']}'")
+    
+    rows = params.get("rows") or [{}]
+    tab_id = params.get("tab_id")
+    stop_on_error = params.get("stop_on_error", False)
+    unknown_tab = _check_tab(context, tab_id)
+    if unknown_tab:
+        return unknown_tab
+    
+    start = time.perf_counter()
+    # Re-resolved element ids carry over between rows, not to other runs
+    run = macro.copy()
+    results = []
+    for index, row in enumerate(rows):
+        try:
+            outcome = await play_macro(context, run, row, tab_id)
+        except Exception as e:
+            outcome = {"success": False, "error": str(e), "steps": []}
+        results.append({"row": index, **outcome})
+        if stop_on_error and not outcome["success"]:
+            break
+    
+    succeeded = sum(1 for result in results if result["success"])
+    return ToolResult(
+        success=succeeded == len(rows),
+        message=f"Macro '{macro.name}' succeeded for {succeeded} of {len(rows)} rows",
+        action="run_macro",
+        data=results,
+        error_code=None if succeeded == len(rows) else ACTION_FAILED,
+        elapsed_ms=_elapsed_ms(start),
+    )
+
+
+async def get_debug_logs_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
+    """Read recent debug_log lines sent by browser extensions.
+    
+    Answered from the server's ring buffer; nothing is sent to the extension.
+    
+    Params:
+        limit (int): Optional - Most recent lines to return, defaults to 50
+        source (str): Optional - Only lines from this source (extension connection id by default)
+        level (str): Optional - Minimum level: "debug", "info", "warning" or "error"
+        contains (str): Optional - Only lines containing this text
+    """
+    params = params or {}
+    limit = params.get("limit", 50)
+    if not isinstance(limit, int) or limit <= 0:
+        return ToolResult.invalid("limit must be a positive integer")
+    
+    level = params.get("level")
+    if level is not None and level not in DEBUG_LOG_LEVELS:
+        return ToolResult.invalid(f"level must be one of {', '.join(DEBUG_LOG_LEVELS)}")
+    
+    entries = context.debug_logs.query(
+        limit=limit,
+        source=params.get("source"),
+        min_level=DEBUG_LOG_LEVELS[level] if level else 0,
+        contains=params.get("contains"),
+    )
+    return ToolResult(
+        success=True,
+        message=f"Returned {len(entries)} debug log lines",
+        action="get_debug_logs",
+        data={"entries": entries, "dropped": context.debug_logs.dropped()},
+    )
+
+
+async def add_assistant_message_tool(context: Context, params: Dict[str, Any] = None) -> ToolResult:
     """Add an assistant message to the chat.
     
     Params:
         message (str): Required - Message to add to the chat
     """
     if not params or "message" not in params:
-        return "Error: message parameter is required"
+        return ToolResult.invalid("message parameter is required")
     
     message = params["message"]
     
-    try:
-        result = await context.send_socket_message("add_assistant_message", {"message": message})
-        
-        if not result:
-            return f"Failed to add assistant message"
-        
-        if result.get("success"):
-            return f"Successfully added assistant message: {message}"
-        else:
-            return f"Failed to add assistant message: {result.get('error', 'Unknown error')}"
-            
-    except Exception as e:
-        return f"Error adding assistant message: {str(e)}" 
\ No newline at end of file
+    tool_result, _ = await _run_action(
+        context,
+        "add_assistant_message",
+        {"message": message},
+        f"Added assistant message: {message}",
+        "Failed to add assistant message",
+    )
+    return tool_result
+
+
+# Tools parallel_map can fan out, by action name
+PARALLEL_ACTIONS = {
+    "navigate": navigate_tool,
+    "close_tab": close_tab_tool,
+    "search_google": search_google_tool,
+    "click_element": click_element_tool,
+    "input_text": input_text_tool,
+    "send_keys": send_keys_tool,
+    "grab_dom": grab_dom_tool,
+    "query_elements": query_elements_tool,
+    "wait_for_selector": wait_for_selector_tool,
+    "wait_for_navigation": wait_for_navigation_tool,
+    "wait_for_network_idle": wait_for_network_idle_tool,
+    "wait_for_text": wait_for_text_tool,
+}
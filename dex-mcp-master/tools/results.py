@@ -0,0 +1,63 @@
+"""Structured results returned by the browser tools."""
+
+from typing import Any, Optional
+
+from mcp.types import CallToolResult, ImageContent, TextContent
+from pydantic import BaseModel, PrivateAttr
+
+# Error codes carried in ``ToolResult.error_code``
+INVALID_PARAMS = "invalid_params"
+NO_CONNECTION = "no_connection"
+TIMEOUT = "timeout"
+CONNECTION_LOST = "connection_lost"
+EXTENSION_ERROR = "extension_error"
+ACTION_FAILED = "action_failed"
+OVERLOADED = "overloaded"
+INTERNAL_ERROR = "internal_error"
+
+
+class ToolResult(BaseModel):
+    """Outcome of a browser tool call, returned to MCP clients as structured content."""
+
+    success: bool
+    message: str
+    action: Optional[str] = None
+    data: Any = None
+    error: Optional[str] = None
+    error_code: Optional[str] = None
+    elapsed_ms: Optional[float] = None
+
+    # Images travel as MCP image content next to the structured result
+    _images: list[ImageContent] = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def failure(cls, message: str, error_code: str, error: Optional[str] = None, **fields) -> "ToolResult":
+        return cls(success=False, message=message, error=error or message, error_code=error_code, **fields)
+
+    @classmethod
+    def invalid(cls, message: str) -> "ToolResult":
+        """Reject a call whose parameters are missing or malformed."""
+        return cls.failure(f"Error: {message}", INVALID_PARAMS)
+
+    def with_images(self, *images: ImageContent) -> "ToolResult":
+        self._images.extend(images)
+        return self
+
+    @property
+    def images(self) -> list[ImageContent]:
+        return self._images
+
+    def to_mcp(self) -> Any:
+        """Convert to what a FastMCP tool should return.
+
+        Results without images are returned as-is and serialized by FastMCP.
+        Results with images become a ``CallToolResult`` carrying the images as
+        image content alongside the structured result.
+        """
+        if not self._images:
+            return self
+
+        structured = self.model_dump(mode="json")
+        content: list = list(self._images)
+        content.append(TextContent(type="text", text=self.model_dump_json()))
+        return CallToolResult(content=content, structuredContent=structured, isError=not self.success)
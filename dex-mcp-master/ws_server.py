@@ -1,30 +1,221 @@
 import asyncio
 import json
 import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
 import websockets
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CONT, CTRL_OPCODES, Frame
 from websockets.server import WebSocketServerProtocol
+from codec import negotiate_codec
 from context import Context
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class WebSocketSettings:
+    """Transport tuning for the extension bridge.
+
+    The defaults favour the large, highly compressible DOM dumps the extension
+    sends: a full 32 KiB deflate window, generous message limits and a write
+    buffer big enough to hold a typical command burst. See
+    ``benchmarks/compression.py`` for the trade-offs between deflate settings.
+    """
+
+    # permessage-deflate
+    compression: bool = True
+    server_max_window_bits: int = 15
+    client_max_window_bits: int = 15
+    mem_level: int = 5
+    compression_level: int = 6
+    # Outgoing messages smaller than this are sent uncompressed
+    min_compress_size: int = 512
+
+    # Frame and message limits
+    max_size: Optional[int] = 64 * 1024 * 1024
+    max_queue: Optional[int] = 64
+
+    # Write buffer high/low water marks in bytes
+    write_limit_high: int = 1024 * 1024
+    write_limit_low: Optional[int] = 256 * 1024
+
+    # Keepalive
+    ping_interval: Optional[float] = 20.0
+    ping_timeout: Optional[float] = 20.0
+
+    def serve_kwargs(self) -> dict:
+        """Keyword arguments for ``websockets.serve``."""
+        kwargs = {
+            "max_size": self.max_size,
+            "max_queue": self.max_queue,
+            "write_limit": (self.write_limit_high, self.write_limit_low),
+            "ping_interval": self.ping_interval,
+            "ping_timeout": self.ping_timeout,
+        }
+        if self.compression:
+            kwargs["extensions"] = [
+                ThresholdPerMessageDeflateFactory(
+                    server_max_window_bits=self.server_max_window_bits,
+                    client_max_window_bits=self.client_max_window_bits,
+                    compress_settings={"memLevel": self.mem_level, "level": self.compression_level},
+                    min_size=self.min_compress_size,
+                )
+            ]
+        else:
+            kwargs["compression"] = None
+        return kwargs
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that leaves small messages uncompressed.
+
+    RFC 7692 lets each message choose whether it is compressed, so skipping
+    tiny command frames saves CPU without breaking the peer's decoder.
+    """
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def encode(self, frame: Frame) -> Frame:
+        if (
+            frame.opcode not in CTRL_OPCODES
+            and frame.opcode is not CONT
+            and frame.fin
+            and len(frame.data) < self.min_size
+        ):
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    """Server factory producing ``ThresholdPerMessageDeflate`` extensions."""
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+        )
+
+
+# Frames at least this large are checked for an abandoned request id before
+# being decoded. Binary-frame headers are always small, so they are never
+# skipped and their attachment is still consumed in order.
+ORPHAN_PEEK_MIN_SIZE = 64 * 1024
+
+_LEADING_ID = re.compile(rb'^\s*\{\s*"id"\s*:\s*"([^"]+)"')
+
+
+def peek_message_id(message) -> Optional[str]:
+    """Read the id of a JSON frame without decoding it, if it comes first."""
+    head = message[:128]
+    if isinstance(head, str):
+        head = head.encode()
+    match = _LEADING_ID.match(head)
+    return match.group(1).decode() if match else None
+
+
+def attach_binary_frame(header: dict, frame: bytes) -> dict:
+    """Place the bytes of a binary frame into the response its header announced.
+
+    The header's ``binary`` field names where the bytes belong inside
+    ``result`` (``path``, defaulting to ``["data"]``), plus their ``mime`` type
+    and expected ``size``. The frame is stored as-is, without copying or base64
+    decoding.
+    """
+    binary = header.pop("binary")
+    if not isinstance(binary, dict):
+        binary = {}
+    path = binary.get("path") or ["data"]
+
+    expected = binary.get("size")
+    if expected is not None and expected != len(frame):
+        logger.warning(f"Binary frame size mismatch: expected {expected} bytes, got {len(frame)}")
+
+    result = header.setdefault("result", {})
+    target = result
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = frame
+    result["mimeType"] = binary.get("mime", "image/png")
+    return header
+
+
 async def handle_websocket_connection(websocket: WebSocketServerProtocol, context: Context):
     """Handle incoming WebSocket connection from browser extension."""
     logger.info("Browser extension connected")
-    context.set_ws(websocket)
+    connection = context.set_ws(websocket)
+    # (header, frame size, decode seconds) of a response whose image bytes
+    # arrive in the next binary frame
+    pending_binary = None
     
     try:
         async for message in websocket:
             try:
-                data = json.loads(message)
+                if isinstance(message, bytes) and pending_binary is not None:
+                    header, header_size, header_decode = pending_binary
+                    pending_binary = None
+                    context.handle_response(
+                        attach_binary_frame(header, message), header_size + len(message), header_decode
+                    )
+                    continue
 
-                # Handle debug log messages separately
-                if data.get("type") == "debug_log":
+                # Drop large late responses to abandoned requests undecoded
+                if len(message) >= ORPHAN_PEEK_MIN_SIZE:
+                    message_id = peek_message_id(message)
+                    if context.is_abandoned(message_id):
+                        context.handle_response({"id": message_id}, len(message))
+                        continue
+
+                decode_started = time.perf_counter()
+                data = connection.codec.decode(message)
+                decode_seconds = time.perf_counter() - decode_started
+
+                # The image for this response follows as a raw binary frame
+                if data.get("binary") and "id" in data:
+                    pending_binary = (data, len(message), decode_seconds)
+                    continue
+
+                # Extensions announce what they support right after connecting
+                if data.get("type") == "hello":
                     payload = data.get("payload", {})
-                    logger.info("[DEBUG_LOG] %s", payload.get("message"))
+                    context.set_capabilities(websocket, payload.get("capabilities", []))
+                    logger.info("Extension capabilities: %s", payload.get("capabilities", []))
+                    if "codecs" in payload:
+                        connection.codec = negotiate_codec(payload["codecs"])
+                        await websocket.send(json.dumps({"type": "hello_ack", "payload": {"codec": connection.codec.name}}))
+                        logger.info("Negotiated %s codec", connection.codec.name)
+                    continue
+
+                # Tab lifecycle events keep the local tab index current
+                if data.get("type") == "tab_event":
+                    context.apply_tab_event(websocket, data.get("payload", {}))
+                    continue
+
+                # Debug logs are sampled, rate-limited and written off the loop
+                if data.get("type") == "debug_log":
+                    context.debug_logs.submit(connection.id, data.get("payload", {}))
                     continue  # Skip normal handling
 
-                context.handle_response(data)
+                # One part of a streamed reply, queued for its consumer
+                if "chunk" in data and "id" in data:
+                    context.handle_chunk(data, len(message), decode_seconds)
+                    continue
+
+                context.handle_response(data, len(message), decode_seconds)
             except json.JSONDecodeError:
                 logger.error(f"Invalid JSON received: {message}")
             except Exception as e:
@@ -35,19 +226,31 @@ async def handle_websocket_connection(websocket: WebSocketServerProtocol, contex
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
-        if context.has_ws() and context._ws == websocket:
-            context._ws = None
+        context.remove_ws(websocket)
+
 
+async def start_websocket_server(
+    context: Context,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    settings: Optional[WebSocketSettings] = None,
+):
+    """Start the WebSocket server for browser extension connections.
 
-async def start_websocket_server(context: Context, host: str = "127.0.0.1", port: int = 8765):
-    """Start the WebSocket server for browser extension connections."""
+    Any number of extensions may connect; requests are spread across them by
+    the connection pool in ``Context``. ``settings`` tunes compression,
+    message limits, write buffering and keepalive.
+    """
+    settings = settings or WebSocketSettings()
+    context.bind_loop()
     logger.info(f"Starting WebSocket server on {host}:{port}")
     
     server = await websockets.serve(
         lambda ws: handle_websocket_connection(ws, context),
         host,
-        port
+        port,
+        **settings.serve_kwargs()
     )
     
     logger.info(f"WebSocket server listening on ws://{host}:{port}")
-    return server 
\ No newline at end of file
+    return server